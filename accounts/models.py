@@ -3,6 +3,7 @@ from django.db import models
 from django.urls import reverse
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
+from djangoblog.object_cache import ObjectCache
 from djangoblog.utils import get_current_site
 
 
@@ -14,6 +15,8 @@ class BlogUser(AbstractUser):
     last_modify_time = models.DateTimeField(_('last modify time'), default=now)
     source = models.CharField(_('create source'), max_length=100, blank=True)
 
+    cached = ObjectCache(lookups=('username',), exclude=('password',))
+
     def get_absolute_url(self):
         return reverse(
             'blog:author_detail', kwargs={
@@ -7,6 +7,7 @@ from django.utils.translation import gettext_lazy as _
 
 # Register your models here.
 from .models import Article, Category, Tag, Links, SideBar, BlogSettings
+from djangoblog import invalidation
 
 
 class ArticleForm(forms.ModelForm):
@@ -19,18 +20,22 @@ class ArticleForm(forms.ModelForm):
 
 def makr_article_publish(modeladmin, request, queryset):
     queryset.update(status='p')
+    invalidation.mark_queryset_updated(queryset)
 
 
 def draft_article(modeladmin, request, queryset):
     queryset.update(status='d')
+    invalidation.mark_queryset_updated(queryset)
 
 
 def close_article_commentstatus(modeladmin, request, queryset):
     queryset.update(comment_status='c')
+    invalidation.mark_queryset_updated(queryset)
 
 
 def open_article_commentstatus(modeladmin, request, queryset):
     queryset.update(comment_status='o')
+    invalidation.mark_queryset_updated(queryset)
 
 
 makr_article_publish.short_description = _('Publish selected articles')
@@ -0,0 +1,173 @@
+import logging
+import time
+from datetime import datetime
+from hashlib import sha256
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from blog.surrogate import article_key, author_key, category_key, tag_key
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+SITE_VERSION_KEY = 'conditional_site_version'
+CONTENT_VERSION_PREFIX = 'conditional_content_version'
+
+
+def _timestamp_version(key):
+    """
+    版本号使用时间戳，缓存被整体清空后会重新生成为当前时间，
+    保证清空后不会与旧的ETag重复
+    """
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        cache.set(key, version, None)
+    return version
+
+
+def get_site_version():
+    """站点级版本：网站配置、侧边栏等所有页面共享内容的版本"""
+    return _timestamp_version(SITE_VERSION_KEY)
+
+
+def bump_site_version():
+    cache.set(SITE_VERSION_KEY, time.time(), None)
+
+
+def get_content_version(scope):
+    return _timestamp_version('{prefix}_{scope}'.format(prefix=CONTENT_VERSION_PREFIX, scope=scope))
+
+
+def bump_content_versions(scopes):
+    now = time.time()
+    cache.set_many({'{prefix}_{scope}'.format(prefix=CONTENT_VERSION_PREFIX, scope=scope): now
+                    for scope in scopes}, None)
+    logger.info('bump content versions:{scopes}'.format(scopes=scopes))
+
+
+def get_article_scopes(article, category_ids=(), tag_slugs=None):
+    """
+    文章修改后受影响的页面：文章本身，以及首页、作者页、所属分类及其上级分类、标签页
+    :param category_ids: 额外需要更新的分类（如修改前的分类）
+    :param tag_slugs: 受影响的标签，为None时取文章当前的标签
+    """
+    from blog.models import Category
+    scopes = {article_key(article.pk), 'index', 'archives', author_key(article.author.username)}
+    ids = {article.category_id, *category_ids} - {None}
+    categorys = {c.pk: c for c in Category.objects.all()} if ids else {}
+    for category_id in ids:
+        seen = set()
+        node = categorys.get(category_id)
+        while node is not None and node.pk not in seen:
+            seen.add(node.pk)
+            scopes.add(category_key(node.slug))
+            node = categorys.get(node.parent_category_id)
+    if tag_slugs is None:
+        tag_slugs = article.tags.values_list('slug', flat=True) if article.pk else []
+    scopes.update(tag_key(slug) for slug in tag_slugs)
+    return scopes
+
+
+def _aware(value):
+    # USE_TZ=False 时数据库里是本地时间，condition 会把naive时间当作UTC处理
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.get_default_timezone())
+    if timezone.is_naive(value):
+        return timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
+def _make_etag(*parts):
+    return sha256('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _request_parts(request):
+    """同一url对不同用户、不同语言渲染的内容不同"""
+    user = getattr(request, 'user', None)
+    user_part = user.pk if user is not None and user.is_authenticated else 'anonymous'
+    language = getattr(request, 'LANGUAGE_CODE', settings.LANGUAGE_CODE)
+    return user_part, language, get_plugin_config_version()
+
+
+_plugin_config_version = None
+
+
+def get_plugin_config_version():
+    """已启用插件及其版本，插件升级或启停后页面的ETag随之变化"""
+    global _plugin_config_version
+    if _plugin_config_version is None:
+        from djangoblog.plugin_manage.loader import get_loaded_plugins
+        plugins = sorted('{slug}:{version}'.format(slug=p.plugin_slug, version=p.PLUGIN_VERSION)
+                         for p in get_loaded_plugins())
+        _plugin_config_version = _make_etag(*plugins)
+    return _plugin_config_version
+
+
+def _memoize(request, compute):
+    # condition 会分别调用 etag_func 和 last_modified_func，同一请求只计算一次
+    if not hasattr(request, '_conditional_validators'):
+        request._conditional_validators = compute()
+    return request._conditional_validators
+
+
+def get_article_validators(request, article_id):
+    """
+    文章页验证器，文章从对象缓存读取，只需一条评论聚合查询，不渲染模板和Markdown
+    :return: (etag, last_modified)，文章不存在时为 (None, None)，交给视图返回404
+    """
+
+    def compute():
+        from blog.models import Article
+        from comments.models import Comment
+        try:
+            article_modified = Article.cached.get(pk=article_id).last_modify_time
+        except Article.DoesNotExist:
+            return None, None
+        comments = Comment.objects.filter(article_id=article_id, is_enable=True).aggregate(
+            last_id=Max('id'), last_modified=Max('last_modify_time'))
+        site_version = get_site_version()
+        # last_modify_time 不会随每次编辑更新，另用文章版本号保证编辑后ETag变化
+        article_version = get_content_version(article_key(article_id))
+        etag = _make_etag('article', article_id, article_modified.timestamp(), article_version,
+                          comments['last_id'], site_version,
+                          request.get_full_path(), *_request_parts(request))
+        last_modified = max(_aware(v) for v in (article_modified, comments['last_modified'],
+                                                site_version, article_version) if v is not None)
+        return etag, last_modified
+
+    return _memoize(request, compute)
+
+
+def get_list_validators(request, scope):
+    """列表页验证器，只读取缓存中的版本号，不查询数据库"""
+
+    def compute():
+        site_version = get_site_version()
+        list_version = get_content_version(scope)
+        etag = _make_etag('list', scope, list_version, site_version,
+                          request.get_full_path(), *_request_parts(request))
+        return etag, _aware(max(site_version, list_version))
+
+    return _memoize(request, compute)
+
+
+def article_condition():
+    return method_decorator(condition(
+        etag_func=lambda request, *args, **kwargs: get_article_validators(
+            request, kwargs['article_id'])[0],
+        last_modified_func=lambda request, *args, **kwargs: get_article_validators(
+            request, kwargs['article_id'])[1]), name='dispatch')
+
+
+def list_condition(scope):
+    """
+    :param scope: 列表标识，如 index、category_python
+    """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: get_list_validators(request, scope)[0],
+        last_modified_func=lambda request, *args, **kwargs: get_list_validators(request, scope)[1])
@@ -1,12 +1,17 @@
+import logging
 import time
+from itertools import islice
 
 import elasticsearch.client
 from django.conf import settings
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
 from elasticsearch_dsl import Document, InnerDoc, Date, Integer, Long, Text, Object, GeoPoint, Keyword, Boolean
 from elasticsearch_dsl.connections import connections
 
 from blog.models import Article
 
+logger = logging.getLogger(__name__)
+
 ELASTICSEARCH_ENABLED = hasattr(settings, 'ELASTICSEARCH_DSL')
 
 if ELASTICSEARCH_ENABLED:
@@ -164,18 +169,125 @@ class ArticleDocument(Document):
         doc_type = 'Article'
 
 
-class ArticleDocumentManager():
+class ReindexError(Exception):
+    pass
+
 
-    def __init__(self):
+class ArticleDocumentManager():
+    '''
+    搜索和写入都通过 blog 别名访问。
+    重建时写入新的带版本索引 blog_v<时间戳>，校验后原子地切换别名，重建期间搜索不受影响
+    '''
+    alias = ArticleDocument.Index.name
+
+    def __init__(self, client=None):
+        self.client = client
         self.create_index()
 
+    def get_client(self):
+        return self.client or connections.get_connection()
+
     def create_index(self):
-        ArticleDocument.init()
+        client = self.get_client()
+        if client.indices.exists(index=self.alias):
+            ArticleDocument.init(using=client)
+        else:
+            name = self.create_versioned_index()
+            client.indices.put_alias(index=name, name=self.alias)
+
+    def create_versioned_index(self):
+        name = '{alias}_v{ts}'.format(alias=self.alias, ts=int(time.time() * 1000))
+        ArticleDocument._index.clone(name).create(using=self.get_client())
+        return name
+
+    def get_alias_indices(self):
+        """别名当前指向的索引；旧版本部署中 blog 是普通索引，此时返回 {'blog'}"""
+        try:
+            return set(self.get_client().indices.get_alias(index=self.alias))
+        except elasticsearch.exceptions.NotFoundError:
+            return set()
 
     def delete_index(self):
-        from elasticsearch import Elasticsearch
-        es = Elasticsearch(settings.ELASTICSEARCH_DSL['default']['hosts'])
-        es.indices.delete(index='blog', ignore=[400, 404])
+        client = self.get_client()
+        # 不能通过别名删除索引，需要删除实际的索引
+        for name in self.get_alias_indices():
+            client.indices.delete(index=name, ignore=[400, 404])
+        client.indices.delete(index=self.alias + '_v*', ignore=[400, 404])
+
+    def is_current(self):
+        """
+        别名存在、文档数与数据库一致，且没有等待写入的文章登记时，启动时可以直接使用，不必重建。
+        文章的修改只通过搜索索引队列写入，还有登记说明索引中的内容已经过时
+        """
+        from djangoblog.models import SearchIndexTask
+        if not self.get_alias_indices():
+            return False
+        if SearchIndexTask.objects.filter(model=Article._meta.label_lower).exists():
+            return False
+        return self.get_client().count(index=self.alias)['count'] == self.get_queryset().count()
+
+    def get_generation(self):
+        """
+        别名指向的索引及其主分片的写入、删除和刷新次数，任何写入或重建后都会变化，
+        可在多个进程间比较；刷新次数保证写入可见后代数再变化一次
+        """
+        stats = self.get_client().indices.stats(index=self.alias, metric='indexing,refresh')
+        primaries = stats['_all']['primaries']
+        return '{indices}:{index}:{delete}:{refresh}'.format(
+            indices=','.join(sorted(stats['indices'])),
+            index=primaries['indexing']['index_total'],
+            delete=primaries['indexing']['delete_total'],
+            refresh=primaries['refresh']['total'])
+
+    def switch_alias(self, name):
+        """在一次请求中把别名从旧索引移到新索引"""
+        actions = []
+        for index in self.get_alias_indices():
+            if index == self.alias:
+                # 与别名同名的旧索引只能删除
+                actions.append({'remove_index': {'index': index}})
+            else:
+                actions.append({'remove': {'index': index, 'alias': self.alias}})
+        actions.append({'add': {'index': name, 'alias': self.alias}})
+        self.get_client().indices.update_aliases(body={'actions': actions})
+
+    def delete_old_indices(self, keep=1):
+        """删除别名未指向的旧版本索引，保留最近 keep 个用于回退"""
+        client = self.get_client()
+        live = self.get_alias_indices()
+        names = sorted((name for name in client.indices.get(index=self.alias + '_v*')
+                        if name not in live), reverse=True)
+        for name in names[keep:]:
+            client.indices.delete(index=name, ignore=[400, 404])
+            logger.info('deleted old search index:{name}'.format(name=name))
+
+    def reindex(self, chunk_size=500, thread_count=1, keep=1):
+        """
+        写入新的带版本索引，文档数一致后切换别名并清理旧索引。
+        校验失败时删除新索引，别名仍指向旧索引。
+        从读取文章前到切换别名持有搜索索引队列的写入锁，期间的修改、删除留在队列中，
+        切换后由写线程写入新索引，不会只写进旧索引
+        """
+        from djangoblog.search_queue import writer_lock
+        client = self.get_client()
+        with writer_lock(settings.SEARCH_INDEX_WRITER_LOCK):
+            last_id = Article.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            name = self.create_versioned_index()
+            articles = self.get_queryset().filter(id__lte=last_id).iterator(chunk_size=chunk_size)
+            result = self.bulk_index(self.iter_docs(articles), chunk_size, thread_count, index=name)
+            client.indices.refresh(index=name)
+            count = client.count(index=name)['count']
+            if result['errors'] or count != result['indexed']:
+                client.indices.delete(index=name, ignore=[400, 404])
+                raise ReindexError(
+                    'reindex into {name} failed: {indexed} indexed, {count} in index, {errors} errors'.format(
+                        name=name, indexed=result['indexed'], count=count, errors=len(result['errors'])))
+            self.switch_alias(name)
+        # 重建期间新发布的文章不在扫描范围内，切换后直接补上，不必等待队列
+        created = self.get_queryset().filter(id__gt=last_id)
+        self.bulk_index(self.iter_docs(created), chunk_size)
+        self.delete_old_indices(keep)
+        return dict(result, index=name)
 
     def convert_to_doc(self, articles):
         return [
@@ -201,13 +313,68 @@ class ArticleDocumentManager():
                 views=article.views,
                 article_order=article.article_order) for article in articles]
 
-    def rebuild(self, articles=None):
-        ArticleDocument.init()
-        articles = articles if articles else Article.objects.all()
-        docs = self.convert_to_doc(articles)
-        for doc in docs:
-            doc.save()
+    @staticmethod
+    def get_queryset():
+        """一次取出作者、分类和标签，转换文档时不再逐篇查询"""
+        return Article.objects.select_related('author', 'category').prefetch_related('tags')
+
+    def bulk_index(self, docs, chunk_size=500, thread_count=1, client=None, index=None):
+        """
+        使用 bulk 接口批量写入文档，每批 chunk_size 篇一次请求，thread_count 大于1时并行发送。
+        单篇失败不会中断整个过程
+        :param index: 写入的索引，默认为别名
+        :return: {'indexed': 成功数, 'errors': 失败的文档, 'elapsed': 耗时（秒）}
+        """
+        client = client or self.get_client()
+        actions = (self.to_action(doc, index) for doc in docs)
+        if thread_count > 1:
+            results = self._parallel_bulk(client, actions, chunk_size, thread_count)
+        else:
+            results = streaming_bulk(client, actions, chunk_size=chunk_size,
+                                     raise_on_error=False, raise_on_exception=False)
+        start = time.time()
+        indexed = 0
+        errors = []
+        for ok, item in results:
+            if ok:
+                indexed += 1
+            else:
+                errors.append(item)
+                logger.error('bulk index failed:{item}'.format(item=item))
+        elapsed = time.time() - start
+        logger.info('bulk indexed {indexed} articles, {errors} errors in {elapsed:.2f}s ({rate:.0f} docs/s)'.format(
+            indexed=indexed, errors=len(errors), elapsed=elapsed, rate=indexed / elapsed if elapsed else 0))
+        return {'indexed': indexed, 'errors': errors, 'elapsed': elapsed}
+
+    @staticmethod
+    def to_action(doc, index=None):
+        action = doc.to_dict(include_meta=True)
+        if index:
+            action['_index'] = index
+        return action
+
+    @staticmethod
+    def _parallel_bulk(client, actions, chunk_size, thread_count):
+        # 数据库只在当前线程读取，每次取出够所有线程发送几批的文档，再并行发送
+        actions = iter(actions)
+        window_size = chunk_size * thread_count * 4
+        while True:
+            window = list(islice(actions, window_size))
+            if not window:
+                return
+            yield from parallel_bulk(client, window, thread_count=thread_count, chunk_size=chunk_size,
+                                     raise_on_error=False, raise_on_exception=False)
+
+    def rebuild(self, articles=None, chunk_size=500, thread_count=1, client=None):
+        ArticleDocument.init(using=client or self.get_client())
+        if articles is None:
+            # 按批迭代，不把全部文章读入内存
+            articles = self.get_queryset().iterator(chunk_size=chunk_size)
+        return self.bulk_index(self.iter_docs(articles), chunk_size, thread_count, client)
+
+    def iter_docs(self, articles):
+        for article in articles:
+            yield self.convert_to_doc([article])[0]
 
     def update_docs(self, docs):
-        for doc in docs:
-            doc.save()
+        return self.bulk_index(docs)
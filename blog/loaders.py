@@ -0,0 +1,109 @@
+import logging
+
+from django.core.paginator import Paginator
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models import prefetch_related_objects
+
+from blog.models import Article, Category, Tag
+from blog.neighbor_index import ArticleNeighborIndex
+
+logger = logging.getLogger(__name__)
+
+
+def annotate_tag_article_count(queryset):
+    """
+    为标签queryset附加 article_count，一条SQL得到所有标签的文章数，
+    与 Tag.get_article_count 的统计口径一致
+    """
+    counts = Article.objects.filter(tags=OuterRef('pk')).order_by().values('tags').annotate(
+        c=Count('pk', distinct=True)).values('c')
+    return queryset.annotate(
+        article_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+
+class ArticleDetailLoader:
+    '''
+    文章详情页数据加载器
+    用固定数量的批量查询收集模板和插件需要的数据，
+    查询次数不随标签、评论、点赞数量增长
+    '''
+
+    def __init__(self, article, comment_page_size, comment_page=1):
+        self.article = article
+        self.comment_page_size = comment_page_size
+        self.comment_page = comment_page
+
+    @staticmethod
+    def get_queryset():
+        return Article.objects.select_related('author', 'category')
+
+    def load_tags(self):
+        """预取标签并带上每个标签的文章数，后续 article.tags.all() 不再查库"""
+        prefetch_related_objects(
+            [self.article],
+            Prefetch('tags', queryset=annotate_tag_article_count(Tag.objects.all())))
+        return list(self.article.tags.all())
+
+    def load_category_tree(self):
+        """一次取出全部分类，在内存中连接父级，避免逐级递归查询"""
+        categorys = {c.pk: c for c in Category.objects.all()}
+        category = categorys.get(self.article.category_id)
+        if category is None:
+            return []
+        self.article.category = category
+        seen = set()
+        node = category
+        while node is not None and node.pk not in seen:
+            seen.add(node.pk)
+            parent = categorys.get(node.parent_category_id)
+            node.parent_category = parent
+            node = parent
+        return self.article.get_category_tree()
+
+    def load_comments(self):
+        """
+        读取评论并建立父子索引，模板据此渲染评论树而不用逐条查询
+        """
+        comments = list(self.article.comment_list())
+        children = {}
+        parents = []
+        for comment in comments:
+            if comment.parent_comment_id is None:
+                parents.append(comment)
+            else:
+                children.setdefault(comment.parent_comment_id, []).append(comment)
+        return comments, parents, children
+
+    def paginate_comments(self, parent_comments):
+        paginator = Paginator(parent_comments, self.comment_page_size)
+        page = self.comment_page
+        if page > paginator.num_pages:
+            page = paginator.num_pages
+        if page < 1:
+            page = 1
+        return paginator.page(page)
+
+    def load_head(self):
+        """页面头部和响应头（Surrogate-Key）需要的数据"""
+        return {
+            'article_tags': self.load_tags(),
+            'category_tree': self.load_category_tree(),
+        }
+
+    def load_body(self):
+        """评论和上下篇，流式渲染时在 <head> 输出之后才加载"""
+        article = self.article
+        comments, parent_comments, comment_children = self.load_comments()
+        prev_article, next_article = ArticleNeighborIndex.neighbors(article)
+        return {
+            'article_comments': comments,
+            'comment_children': comment_children,
+            'p_comments': self.paginate_comments(parent_comments),
+            'comment_count': len(comments),
+            'next_article': next_article,
+            'prev_article': prev_article,
+        }
+
+    def load(self):
+        return dict(self.load_head(), **self.load_body())
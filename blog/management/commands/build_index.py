@@ -1,18 +1,50 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from blog.documents import ElapsedTimeDocument, ArticleDocumentManager, ElaspedTimeDocumentManager, \
-    ELASTICSEARCH_ENABLED
+    ELASTICSEARCH_ENABLED, ReindexError
 
 
-# TODO 参数化
 class Command(BaseCommand):
     help = 'build search index'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--procs', type=int, default=None,
+                            help='whoosh: number of indexing processes, defaults to the number of cpus; '
+                                 'elasticsearch: number of threads sending bulk requests, defaults to 1')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='number of articles loaded from the database and sent per bulk request')
+        parser.add_argument('--force', action='store_true',
+                            help='elasticsearch: reindex even if the live index is current')
+        parser.add_argument('--keep', type=int, default=1,
+                            help='elasticsearch: number of previous indices kept for rollback')
+
     def handle(self, *args, **options):
         if ELASTICSEARCH_ENABLED:
             ElaspedTimeDocumentManager.build_index()
             manager = ElapsedTimeDocument()
             manager.init()
             manager = ArticleDocumentManager()
-            manager.delete_index()
-            manager.rebuild()
+            if not options['force'] and manager.is_current():
+                self.stdout.write('search index is current, skipped')
+                return
+            try:
+                result = manager.reindex(chunk_size=options['chunk_size'], thread_count=options['procs'] or 1,
+                                         keep=options['keep'])
+            except ReindexError as e:
+                raise CommandError(e)
+            self.stdout.write(self.style.SUCCESS('indexed %d articles into %s in %.2fs' % (
+                result['indexed'], result['index'], result['elapsed'])))
+        else:
+            self.rebuild_local(options['procs'], options['chunk_size'])
+
+    def rebuild_local(self, procs, chunk_size):
+        # whoosh 或内存索引
+        from haystack import connections
+        from blog.models import Article
+        backend = connections['default'].get_backend()
+        if not hasattr(backend, 'rebuild'):
+            self.stdout.write(self.style.WARNING('search backend does not support rebuild'))
+            return
+        index = connections['default'].get_unified_index().get_index(Article)
+        count = backend.rebuild(index, procs=procs, chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS('indexed %d articles' % count))
@@ -1,13 +1,13 @@
 from django.core.management.base import BaseCommand
 
-from blog.models import Tag, Category
+from djangoblog.search_words import get_user_dict_path, precompile
 
 
-# TODO 参数化
 class Command(BaseCommand):
-    help = 'build search words'
+    help = 'build jieba user dictionary from tags and categories and precompile the dictionary cache'
 
     def handle(self, *args, **options):
-        datas = set([t.name for t in Tag.objects.all()] +
-                    [t.name for t in Category.objects.all()])
+        datas = precompile()
         print('\n'.join(datas))
+        self.stdout.write(self.style.SUCCESS(
+            'wrote %d words to %s' % (len(datas), get_user_dict_path())))
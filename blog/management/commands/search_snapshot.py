@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from djangoblog.search_snapshot import SnapshotError, SnapshotStore, publish, pull
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'publish the search index as a snapshot, or pull the latest snapshot into the local index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['publish', 'pull'])
+        parser.add_argument('--store', default=None,
+                            help='snapshot directory, defaults to SEARCH_SNAPSHOT_STORE')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='repeat every N seconds, 0 runs once')
+        parser.add_argument('--keep', type=int, default=None,
+                            help='publish: number of snapshots kept, defaults to SEARCH_SNAPSHOT_KEEP')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='publish: rebuild the index from the database when its content changed')
+
+    def handle(self, *args, **options):
+        store = SnapshotStore(options['store'] or settings.SEARCH_SNAPSHOT_STORE)
+        interval = options['interval']
+        while True:
+            try:
+                if options['action'] == 'publish':
+                    manifest = publish(store, keep=options['keep'] or settings.SEARCH_SNAPSHOT_KEEP,
+                                       rebuild=options['rebuild'])
+                else:
+                    manifest = pull(store)
+            except SnapshotError as e:
+                if not interval:
+                    raise CommandError(e)
+                logger.error(e)
+            else:
+                if manifest is None:
+                    self.stdout.write('search snapshot is current')
+                else:
+                    self.stdout.write(self.style.SUCCESS('{action} {name}'.format(
+                        action=options['action'], name=manifest['name'])))
+            if not interval:
+                return
+            close_old_connections()
+            time.sleep(interval)
@@ -1,10 +1,18 @@
 import logging
 import time
 
+from django.conf import settings
+from django.utils.cache import patch_cache_control
 from ipware import get_client_ip
 from user_agents import parse
 
 from blog.documents import ELASTICSEARCH_ENABLED, ElaspedTimeDocumentManager
+from blog.page_cache import LOAD_TIMES_PLACEHOLDER, fill_holes, freeze_response, get_page_cache_key, \
+    is_anonymous_request, thaw_response
+from blog.surrogate import get_surrogate_keys
+from djangoblog.plugin_manage import hooks
+from djangoblog.plugin_manage.hook_constants import PAGE_CACHE_HIT
+from djangoblog.utils import cache
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +25,16 @@ class OnlineMiddleware(object):
     def __call__(self, request):
         ''' page render time '''
         start_time = time.time()
+        request.load_start_time = start_time
         response = self.get_response(request)
         http_user_agent = request.META.get('HTTP_USER_AGENT', '')
         ip, _ = get_client_ip(request)
         user_agent = parse(http_user_agent)
-        if not response.streaming:
+        if response.streaming:
+            # 流式响应在输出页脚时才填入加载耗时
+            response.streaming_content = self.fill_streaming_load_times(request, response.streaming_content)
+        # 整页缓存返回的预压缩响应已经自行填入了加载耗时
+        elif not response.has_header('Content-Encoding'):
             try:
                 cast_time = time.time() - start_time
                 if ELASTICSEARCH_ENABLED:
@@ -40,3 +53,121 @@ class OnlineMiddleware(object):
                 logger.error("Error OnlineMiddleware: %s" % e)
 
         return response
+
+    @staticmethod
+    def fill_streaming_load_times(request, streaming_content):
+        for chunk in streaming_content:
+            if LOAD_TIMES_PLACEHOLDER in chunk:
+                chunk = fill_holes(request, chunk, False)
+            yield chunk
+
+
+class AnonymousPageCacheMiddleware(object):
+    '''
+    匿名访客整页缓存
+    只缓存 PAGE_CACHE_VIEWS 中的页面，按路径、视图读取的查询参数和语言存储渲染结果；
+    CSRF token 在响应时填入，点赞/收藏状态由前端通过 interaction/states/ 批量获取，
+    命中缓存的请求不会访问数据库
+    '''
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cache_key = getattr(request, '_page_cache_key', None)
+        if cache_key and self.should_cache_response(request, response):
+            if response.streaming:
+                response.streaming_content = self.store_streaming(
+                    request, response, response.streaming_content, cache_key)
+            else:
+                self.store(request, response, response.content, cache_key)
+            response['X-Page-Cache'] = 'MISS'
+        return response
+
+    @staticmethod
+    def store(request, response, content, cache_key):
+        cache.set(cache_key, freeze_response(request, response, content), settings.PAGE_CACHE_TIMEOUT)
+        logger.info('set page cache.key:{key}'.format(key=cache_key))
+
+    def store_streaming(self, request, response, streaming_content, cache_key):
+        """流式响应边输出边收集，完整输出后再写入缓存"""
+        chunks = []
+        for chunk in streaming_content:
+            chunks.append(chunk)
+            yield chunk
+        self.store(request, response, b''.join(chunks), cache_key)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.should_cache_request(request):
+            return None
+        cache_key = get_page_cache_key(request)
+        value = cache.get(cache_key)
+        if value is None:
+            request._page_cache_key = cache_key
+            return None
+        hooks.run_action(PAGE_CACHE_HIT, request=request)
+        response = thaw_response(request, value)
+        response['X-Page-Cache'] = 'HIT'
+        return response
+
+    @staticmethod
+    def should_cache_request(request):
+        if not settings.PAGE_CACHE_ENABLED or request.method not in ('GET', 'HEAD'):
+            return False
+        match = request.resolver_match
+        if match is None or match.view_name not in settings.PAGE_CACHE_VIEWS:
+            return False
+        return is_anonymous_request(request)
+
+    @staticmethod
+    def should_cache_response(request, response):
+        if response.status_code != 200 or response.cookies:
+            return False
+        # 只因 CSRF token 而不能由代理共享的页面照常缓存，命中时按访客填入 token
+        if response.has_header('Cache-Control') and 'private' in response['Cache-Control'] \
+                and not getattr(response, 'private_for_csrf', False):
+            return False
+        session = getattr(request, 'session', None)
+        return not (session is not None and session.modified)
+
+
+class SurrogateKeyMiddleware(object):
+    '''
+    为反向代理标注缓存元数据
+    响应头 Surrogate-Key 列出页面渲染用到的对象，内容修改后由 ProxyPurge 按键清除；
+    匿名访客且不含访客专属内容的页面允许代理长期缓存，其他页面标记为 private。
+    放在整页缓存之后，标注的响应头会随页面一起缓存
+    '''
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        keys = get_surrogate_keys(request)
+        if not keys or response.status_code != 200:
+            return response
+        response[settings.SURROGATE_KEY_HEADER] = ' '.join(sorted(keys))
+        if not is_anonymous_request(request):
+            patch_cache_control(response, private=True)
+        elif self.is_shareable(request, response):
+            patch_cache_control(response, public=True, max_age=0,
+                                s_maxage=settings.SURROGATE_CACHE_TIMEOUT)
+        else:
+            patch_cache_control(response, private=True)
+            response.private_for_csrf = not response.cookies
+        return response
+
+    @staticmethod
+    def is_shareable(request, response):
+        """
+        与整页缓存的规则一致：下发了 cookie、修改了 session 或渲染了 CSRF token 的页面因访客而异，
+        不能由代理共享给其他访客
+        """
+        if response.cookies or request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            return False
+        session = getattr(request, 'session', None)
+        return not (session is not None and session.modified)
@@ -11,6 +11,7 @@ from django.utils.translation import gettext_lazy as _
 from mdeditor.fields import MDTextField
 from uuslug import slugify
 
+from djangoblog.object_cache import ObjectCache
 from djangoblog.utils import cache_decorator, cache
 from djangoblog.utils import get_current_site
 
@@ -105,6 +106,8 @@ class Article(BaseModel):
         null=False)
     tags = models.ManyToManyField('Tag', verbose_name=_('tag'), blank=True)
 
+    cached = ObjectCache()
+
     def body_to_string(self):
         return self.body
 
@@ -135,9 +138,14 @@ class Article(BaseModel):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
-    def viewed(self):
-        self.views += 1
-        self.save(update_fields=['views'])
+    def viewed(self, count=1):
+        """
+        浏览次数在数据库中原子地增加，多个进程并发写入不会互相覆盖。
+        update 不触发信号，从数据库取回最新值后刷新对象缓存
+        """
+        Article.objects.filter(pk=self.pk).update(views=models.F('views') + count)
+        self.refresh_from_db(fields=['views'])
+        Article.cached.set(self)
 
     def comment_list(self):
         cache_key = 'article_comments_{id}'.format(id=self.id)
@@ -146,7 +154,8 @@ class Article(BaseModel):
             logger.info('get article comments:{id}'.format(id=self.id))
             return value
         else:
-            comments = self.comment_set.filter(is_enable=True).order_by('-id')
+            comments = self.comment_set.filter(is_enable=True).select_related(
+                'author', 'parent_comment__author').order_by('-id')
             cache.set(cache_key, comments, 60 * 100)
             logger.info('set article comments:{id}'.format(id=self.id))
             return comments
@@ -155,16 +164,17 @@ class Article(BaseModel):
         info = (self._meta.app_label, self._meta.model_name)
         return reverse('admin:%s_%s_change' % info, args=(self.pk,))
 
-    @cache_decorator(expiration=60 * 100)
     def next_article(self):
         # 下一篇
-        return Article.objects.filter(
-            id__gt=self.id, status='p').order_by('id').first()
+        from blog.neighbor_index import ArticleNeighborIndex
+        next_id = ArticleNeighborIndex.neighbor_ids(self)[1]
+        return Article.objects.filter(pk=next_id).first() if next_id else None
 
-    @cache_decorator(expiration=60 * 100)
     def prev_article(self):
         # 前一篇
-        return Article.objects.filter(id__lt=self.id, status='p').first()
+        from blog.neighbor_index import ArticleNeighborIndex
+        prev_id = ArticleNeighborIndex.neighbor_ids(self)[0]
+        return Article.objects.filter(pk=prev_id).first() if prev_id else None
 
     def get_first_image_url(self):
         """
@@ -189,6 +199,8 @@ class Category(BaseModel):
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
     index = models.IntegerField(default=0, verbose_name=_('index'))
 
+    cached = ObjectCache(lookups=('slug',))
+
     class Meta:
         ordering = ['-index']
         verbose_name = _('category')
@@ -245,6 +257,8 @@ class Tag(BaseModel):
     name = models.CharField(_('tag name'), max_length=30, unique=True)
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
 
+    cached = ObjectCache(lookups=('slug',))
+
     def __str__(self):
         return self.name
 
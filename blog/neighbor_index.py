@@ -0,0 +1,134 @@
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import transaction
+
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ArticleNeighborIndex:
+    '''
+    上一篇/下一篇导航索引
+    按类型（可选再按分类）缓存已发布文章的有序id数组，查询时二分查找。
+    发布、撤回、删除时递增对应范围的版本，下次查询时重新构建；
+    并发构建出的旧数组写在旧版本的键下，不会再被读到
+    '''
+    VERSION_KEY = 'article_neighbors_version'
+    TIMEOUT = 60 * 60 * 24
+
+    @classmethod
+    def by_category(cls):
+        return getattr(settings, 'ARTICLE_NEIGHBOR_BY_CATEGORY', False)
+
+    @staticmethod
+    def scope_version_key(type, category_id=None):
+        return 'article_neighbors_version_{type}_{category_id}'.format(type=type, category_id=category_id)
+
+    @classmethod
+    def cache_key(cls, type, category_id=None):
+        scope_key = cls.scope_version_key(type, category_id)
+        versions = cache.get_many([cls.VERSION_KEY, scope_key])
+        for key in (cls.VERSION_KEY, scope_key):
+            if key not in versions:
+                versions[key] = 1
+                cache.set(key, 1, None)
+        key = 'article_neighbors_{version}_{scope_version}_{type}'.format(
+            version=versions[cls.VERSION_KEY], scope_version=versions[scope_key], type=type)
+        if category_id is not None:
+            key += '_{category_id}'.format(category_id=category_id)
+        return key
+
+    @classmethod
+    def build(cls, type, category_id=None):
+        from blog.models import Article
+        # 先取键再查询，查询期间有文章变化时结果只写入旧版本的键
+        key = cls.cache_key(type, category_id)
+        queryset = Article.objects.filter(status='p', type=type)
+        if category_id is not None:
+            queryset = queryset.filter(category_id=category_id)
+        ids = array('q', queryset.order_by('id').values_list('id', flat=True))
+        cache.set(key, ids, cls.TIMEOUT)
+        logger.info('build article neighbor index:{type} {category_id}'.format(
+            type=type, category_id=category_id))
+        return ids
+
+    @classmethod
+    def get_ids(cls, type, category_id=None):
+        ids = cache.get(cls.cache_key(type, category_id))
+        if ids is None:
+            ids = cls.build(type, category_id)
+        return ids
+
+    @classmethod
+    def _scopes(cls, type, category_id):
+        scopes = [(type, None)]
+        if category_id is not None:
+            scopes.append((type, category_id))
+        return scopes
+
+    @staticmethod
+    def _bump(keys):
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 2, None)
+
+    @classmethod
+    def touch(cls, type, category_id=None):
+        """
+        作废文章所在范围的索引。立即递增一次，本事务内的查询可见；
+        事务提交后再递增一次，提交前其他请求构建的旧数组随之作废
+        """
+        keys = [cls.scope_version_key(*scope) for scope in cls._scopes(type, category_id)]
+        cls._bump(keys)
+        transaction.on_commit(lambda: cls._bump(keys))
+
+    @classmethod
+    def update(cls, article, old_state=None):
+        """
+        文章保存后作废受影响的索引
+        :param old_state: 保存前的 (status, type, category_id)，新建文章为None
+        """
+        if old_state is not None:
+            status, type, category_id = old_state
+            if status == 'p':
+                cls.touch(type, category_id)
+        if article.status == 'p':
+            cls.touch(article.type, article.category_id)
+
+    @classmethod
+    def invalidate(cls):
+        """批量更新（如 queryset.update）后整体作废索引"""
+        cls._bump([cls.VERSION_KEY])
+
+    @classmethod
+    def neighbor_ids(cls, article, by_category=None):
+        """
+        :return: (上一篇id, 下一篇id)，不存在时为None
+        """
+        if by_category is None:
+            by_category = cls.by_category()
+        category_id = article.category_id if by_category else None
+        ids = cls.get_ids(article.type, category_id)
+        prev_index = bisect_left(ids, article.id)
+        next_index = bisect_right(ids, article.id)
+        prev_id = ids[prev_index - 1] if prev_index > 0 else None
+        next_id = ids[next_index] if next_index < len(ids) else None
+        return prev_id, next_id
+
+    @classmethod
+    def neighbors(cls, article, by_category=None):
+        """
+        一次查询取回上一篇和下一篇
+        :return: (上一篇, 下一篇)
+        """
+        from blog.models import Article
+        prev_id, next_id = cls.neighbor_ids(article, by_category)
+        ids = [i for i in (prev_id, next_id) if i is not None]
+        articles = Article.objects.in_bulk(ids) if ids else {}
+        return articles.get(prev_id), articles.get(next_id)
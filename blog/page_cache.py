@@ -0,0 +1,163 @@
+import logging
+import re
+import struct
+import time
+import zlib
+from hashlib import sha256
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_vary_headers
+
+from djangoblog.utils import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_PREFIX = 'page_cache'
+CSRF_TOKEN_PLACEHOLDER = b'<!!CSRF_TOKEN!!>'
+LOAD_TIMES_PLACEHOLDER = b'<!!LOAD_TIMES!!>'
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+ACCEPTS_BR_RE = re.compile(r'\bbr\b')
+# 不随页面缓存的响应头，由外层中间件按请求重新生成；
+# 视图提前计算的 ETag/Last-Modified 随页面保存，命中时由 ConditionalGetMiddleware 返回304
+EXCLUDED_HEADERS = {'set-cookie', 'content-length', 'content-encoding', 'vary'}
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def _hash(value):
+    return sha256(value.encode('utf-8')).hexdigest()
+
+
+def _page_version_key(path):
+    return '{prefix}_version:{path}'.format(prefix=PAGE_CACHE_PREFIX, path=_hash(path))
+
+
+def get_page_version(path):
+    return cache.get(_page_version_key(path)) or 1
+
+
+def expire_page_cache(path):
+    '''
+    作废某个路径所有语言、所有查询参数下的整页缓存
+    :param path:url路径
+    '''
+    key = _page_version_key(path)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+    logger.info('expire page cache:{path}'.format(path=path))
+
+
+def get_page_cache_key(request):
+    """只用视图读取的查询参数（PAGE_CACHE_VIEWS）组成键，附加的跟踪参数等命中同一份缓存"""
+    language = getattr(request, 'LANGUAGE_CODE', settings.LANGUAGE_CODE)
+    params = settings.PAGE_CACHE_VIEWS.get(request.resolver_match.view_name, ())
+    query = sorted((name, request.GET.get(name)) for name in params if name in request.GET)
+    return '{prefix}:{language}:{version}:{url}'.format(
+        prefix=PAGE_CACHE_PREFIX,
+        language=language,
+        version=get_page_version(request.path),
+        url=_hash(request.get_host() + request.path + '?' + urlencode(query)))
+
+
+def is_anonymous_request(request):
+    """没有会话cookie的访客一定是匿名的，无需读取会话"""
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and not user.is_authenticated
+
+
+def _deflate(data, final):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if final else zlib.Z_FULL_FLUSH)
+
+
+def split_holes(content):
+    """
+    在第一个按请求填充的占位符处切分页面。
+    前半部分与访客无关，缓存时一次性压缩；后半部分（通常只有页脚）每次请求再填充压缩
+    """
+    positions = [i for i in (content.find(CSRF_TOKEN_PLACEHOLDER),
+                             content.find(LOAD_TIMES_PLACEHOLDER)) if i >= 0]
+    index = min(positions) if positions else len(content)
+    return content[:index], content[index:]
+
+
+def fill_holes(request, data, uses_csrf):
+    if uses_csrf or CSRF_TOKEN_PLACEHOLDER in data:
+        # 调用 get_token 也会让 CsrfViewMiddleware 为访客下发 CSRF cookie
+        data = data.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request).encode('utf-8'))
+    if LOAD_TIMES_PLACEHOLDER in data:
+        start_time = getattr(request, 'load_start_time', None) or time.time()
+        data = data.replace(LOAD_TIMES_PLACEHOLDER, str.encode(str(time.time() - start_time)[:5]))
+    return data
+
+
+def freeze_response(request, response, content):
+    """
+    把渲染好的响应转成可缓存的数据，CSRF token 替换为占位符。
+    与访客无关的部分只保存gzip压缩后的数据，没有占位符的页面额外保存brotli版本
+    """
+    content = CSRF_INPUT_RE.sub(rb'\1' + CSRF_TOKEN_PLACEHOLDER + rb'\2', content)
+    prefix, tail = split_holes(content)
+    headers = [(k, v) for k, v in response.items() if k.lower() not in EXCLUDED_HEADERS]
+    return {
+        'status': response.status_code,
+        'headers': headers,
+        # 页面渲染时用到了CSRF，命中缓存时也要给访客下发CSRF cookie
+        'csrf': bool(request.META.get('CSRF_COOKIE_NEEDS_UPDATE')),
+        'gzip_prefix': _deflate(prefix, final=False),
+        'prefix_crc': zlib.crc32(prefix),
+        'prefix_length': len(prefix),
+        'tail': tail,
+        'br': brotli.compress(content) if brotli is not None and not tail else None,
+    }
+
+
+def get_accepted_encoding(request, value):
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if value['br'] is not None and ACCEPTS_BR_RE.search(accept_encoding):
+        return 'br'
+    if ACCEPTS_GZIP_RE.search(accept_encoding):
+        return 'gzip'
+    return None
+
+
+def build_gzip_content(value, tail):
+    """gzip前缀以完整刷新结束、按字节对齐，可以直接接上按请求压缩的尾部"""
+    crc = zlib.crc32(tail, value['prefix_crc'])
+    size = value['prefix_length'] + len(tail)
+    return (GZIP_HEADER + value['gzip_prefix'] + _deflate(tail, final=True)
+            + struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+
+
+def thaw_response(request, value):
+    """从缓存数据还原响应，按 Accept-Encoding 返回预压缩版本，并填入当前访客的 CSRF token"""
+    tail = fill_holes(request, value['tail'], value['csrf'])
+    encoding = get_accepted_encoding(request, value)
+    if encoding == 'br':
+        content = value['br']
+    elif encoding == 'gzip':
+        content = build_gzip_content(value, tail)
+    else:
+        # 前缀不是完整的deflate流，需用解压对象而不是 zlib.decompress
+        content = zlib.decompressobj(-zlib.MAX_WBITS).decompress(value['gzip_prefix']) + tail
+    response = HttpResponse(content, status=value['status'])
+    for k, v in value['headers']:
+        response[k] = v
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -5,9 +5,17 @@ from blog.models import Article
 
 class ArticleIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
+    # 搜索结果页按分类、标签、发布时间统计数量
+    category = indexes.CharField(model_attr='category__name', faceted=True)
+    tags = indexes.MultiValueField(faceted=True)
+    pub_time = indexes.DateTimeField(model_attr='pub_time', faceted=True)
 
     def get_model(self):
         return Article
 
+    def prepare_tags(self, obj):
+        return [tag.name for tag in obj.tags.all()]
+
     def index_queryset(self, using=None):
-        return self.get_model().objects.filter(status='p')
+        return self.get_model().objects.filter(status='p').select_related(
+            'author', 'category').prefetch_related('tags')
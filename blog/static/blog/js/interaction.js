@@ -5,7 +5,8 @@
 (function (window, document) {
     'use strict';
 
-    const csrfToken = (function () {
+    // 页面可能来自反向代理缓存，CSRF cookie 由 interaction/states/ 下发，因此每次发送前再读取
+    function csrfToken() {
         const name = 'csrftoken';
         const cookies = document.cookie ? document.cookie.split('; ') : [];
         for (let i = 0; i < cookies.length; i++) {
@@ -15,7 +16,7 @@
             }
         }
         return window.csrfToken || '';
-    })();
+    }
 
     function post(url, data) {
         const formData = new FormData();
@@ -29,7 +30,7 @@
             credentials: 'same-origin',
             headers: {
                 'X-Requested-With': 'XMLHttpRequest',
-                'X-CSRFToken': csrfToken
+                'X-CSRFToken': csrfToken()
             },
             body: formData
         }).then(response => response.json());
@@ -49,6 +50,45 @@
         });
     }
 
+    // 一次最多请求的文章数，与 INTERACTION_STATES_MAX_ARTICLES 一致
+    const STATES_BATCH_SIZE = 50;
+
+    function applyArticleState(articleId, state) {
+        document.querySelectorAll('[data-like-button][data-article-id="' + articleId + '"]').forEach(button => {
+            button.classList.toggle('liked', state.liked);
+        });
+        const counter = document.querySelector('[data-like-counter="' + articleId + '"]');
+        if (counter) {
+            counter.textContent = state.like_count;
+        }
+        const saveBtn = document.querySelector('[data-save-button][data-article-id="' + articleId + '"]');
+        if (saveBtn) {
+            saveBtn.classList.toggle('saved', state.saved);
+        }
+    }
+
+    function loadArticleStates(buttons) {
+        // 页面可能来自整页缓存，点赞/收藏状态按访客单独获取；列表页的所有文章合并成一个请求
+        const ids = [];
+        buttons.forEach(button => {
+            const articleId = button.dataset.articleId;
+            if (articleId && ids.indexOf(articleId) === -1) {
+                ids.push(articleId);
+            }
+        });
+        for (let i = 0; i < ids.length; i += STATES_BATCH_SIZE) {
+            const batch = ids.slice(i, i + STATES_BATCH_SIZE);
+            fetch('/interaction/states/?ids=' + encodeURIComponent(batch.join(',')), {
+                credentials: 'same-origin',
+                headers: {'X-Requested-With': 'XMLHttpRequest'}
+            }).then(response => response.json()).then(data => {
+                Object.keys(data.articles || {}).forEach(articleId => {
+                    applyArticleState(articleId, data.articles[articleId]);
+                });
+            });
+        }
+    }
+
     function fetchFolders() {
         return fetch('/interaction/folders/', {
             credentials: 'same-origin',
@@ -163,7 +203,7 @@
                     credentials: 'same-origin',
                     headers: {
                         'X-Requested-With': 'XMLHttpRequest',
-                        'X-CSRFToken': csrfToken
+                        'X-CSRFToken': csrfToken()
                     },
                     body: formData
                 }).then(response => response.json().then(data => ({status: response.status, data})))
@@ -189,6 +229,8 @@
 
     const quickSaveModal = new QuickSaveModal();
 
+    loadArticleStates(document.querySelectorAll('[data-like-button]'));
+
     document.addEventListener('click', function (event) {
         const likeBtn = event.target.closest('[data-like-button]');
         if (likeBtn) {
@@ -0,0 +1,73 @@
+import logging
+
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.template.context import make_context
+from django.template.loader import select_template
+from django.template.loader_tags import BLOCK_CONTEXT_KEY, BlockContext, BlockNode, ExtendsNode, IncludeNode
+
+logger = logging.getLogger(__name__)
+
+
+def _stream_nodes(nodelist, context, deferred=None):
+    """
+    逐个渲染顶层节点，</head> 之后以及每个 block、include 结束时输出一次，
+    浏览器可以先加载样式，再依次收到正文、评论、侧边栏和页脚。
+    deferred 返回正文才用到的上下文，在 </head> 输出之后再调用
+    """
+    buffer = []
+    for node in nodelist:
+        output = str(node.render_annotated(context))
+        buffer.append(output)
+        head_done = '</head>' in output
+        if isinstance(node, (BlockNode, IncludeNode)) or head_done:
+            yield ''.join(buffer)
+            buffer = []
+        if head_done and deferred is not None:
+            context.update(deferred())
+            deferred = None
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _stream_template(template, context, deferred=None):
+    extends_node = next((n for n in template.nodelist if isinstance(n, ExtendsNode)), None)
+    if extends_node is None:
+        yield from _stream_nodes(template.nodelist, context, deferred)
+        return
+    parent = extends_node.get_parent(context)
+    if any(isinstance(n, ExtendsNode) for n in parent.nodelist):
+        # 多级继承时退回整体渲染
+        if deferred is not None:
+            context.update(deferred())
+        yield extends_node.render(context)
+        return
+    # 与 ExtendsNode.render 相同地登记子模板和根模板的block，只是把根模板的节点逐个输出
+    block_context = context.render_context.setdefault(BLOCK_CONTEXT_KEY, BlockContext())
+    block_context.add_blocks(extends_node.blocks)
+    block_context.add_blocks({n.name: n for n in parent.nodelist.get_nodes_by_type(BlockNode)})
+    with context.render_context.push_state(parent, isolated_context=False):
+        yield from _stream_nodes(parent.nodelist, context, deferred)
+
+
+def stream_template(template_names, context, request, deferred=None):
+    backend_template = select_template(template_names)
+    template = backend_template.template
+    context = make_context(context, request, autoescape=backend_template.backend.engine.autoescape)
+    with context.render_context.push_state(template):
+        with context.bind_template(template):
+            context.template_name = template.name
+            yield from _stream_template(template, context, deferred)
+
+
+def streaming_template_response(template_names, context, request, deferred=None):
+    """
+    流式渲染模板。
+    响应头在渲染开始前就已发出，CSRF中间件之后无法再设置cookie，因此提前生成token；
+    页面加载耗时占位符由 OnlineMiddleware 在页脚输出时替换。
+    deferred 返回的上下文在 <head> 输出之后才计算，查询评论等不会推迟首字节
+    """
+    get_token(request)
+    return StreamingHttpResponse(
+        stream_template(template_names, context, request, deferred),
+        content_type='text/html; charset=utf-8')
@@ -0,0 +1,226 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db.models import Q, Sum
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+try:
+    # 没有安装 pypinyin 时退化为 unidecode，多音字只取第一个读音
+    from text_unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+logger = logging.getLogger(__name__)
+
+# 不超过这个长度的前缀匹配项很多，预先保存按浏览量排序的前 TOP_K 项，查询时不扫描
+TOP_PREFIX_LEN = 2
+TOP_K = 20
+
+
+def _is_cjk(char):
+    return '一' <= char <= '鿿'
+
+
+def _pinyin(char):
+    if lazy_pinyin is not None:
+        return lazy_pinyin(char)[0].lower()
+    return unidecode(char).strip().lower()
+
+
+def get_suggest_keys(text):
+    """
+    文本的检索键：小写原文、全拼和拼音首字母，
+    如“深度学习Django”可以用 深度、shendu、sdxx 检索
+    """
+    text = text.strip().lower()
+    keys = {text}
+    if (lazy_pinyin or unidecode) is not None and any(_is_cjk(c) for c in text):
+        full = []
+        initials = []
+        for char in text:
+            if _is_cjk(char):
+                syllable = _pinyin(char)
+                full.append(syllable)
+                initials.append(syllable[:1])
+            elif char.isalnum():
+                full.append(char)
+                initials.append(char)
+        keys.add(''.join(full))
+        keys.add(''.join(initials))
+    keys.discard('')
+    return keys
+
+
+def _short_prefixes(keys):
+    return {key[:n] for key in keys for n in range(1, TOP_PREFIX_LEN + 1) if len(key) >= n}
+
+
+class SuggestIndex:
+    '''
+    进程内的搜索建议前缀索引。
+    所有检索键排序后保存在数组中，查询时二分查找前缀，按浏览量取前k个，不访问搜索引擎；
+    一两个字符的短前缀匹配项太多，另外保存每个短前缀浏览量最高的 TOP_K 项。
+    保存、删除文章、分类、标签时增量更新；定期全量重建以同步其他进程的修改和浏览量，
+    重建在后台线程中进行，期间查询继续使用旧索引。
+    文章只保留浏览量最高的 max_entries 篇，限制内存占用
+    '''
+
+    def __init__(self, max_entries=5000, rebuild_interval=600):
+        self.max_entries = max_entries
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        # 保证同时只有一个线程在重建
+        self.building = threading.Lock()
+        self.keys = []
+        self.entries = {}
+        # 短前缀 -> 浏览量最高的 entry_key 列表；不在其中的前缀在查询时计算
+        self.top = {}
+        self.built_at = None
+
+    def _add(self, entry_key, text, url, weight):
+        self._remove(entry_key)
+        keys = get_suggest_keys(text)
+        self.entries[entry_key] = ({'text': text, 'url': url, 'type': entry_key[0]}, weight, keys)
+        for key in keys:
+            insort(self.keys, (key, entry_key))
+        for prefix in _short_prefixes(keys):
+            top = self.top.get(prefix)
+            if top is None:
+                continue
+            i = 0
+            while i < len(top) and self.entries[top[i]][1] >= weight:
+                i += 1
+            top.insert(i, entry_key)
+            del top[TOP_K:]
+
+    def _remove(self, entry_key):
+        entry = self.entries.pop(entry_key, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            i = bisect_left(self.keys, (key, entry_key))
+            if i < len(self.keys) and self.keys[i] == (key, entry_key):
+                del self.keys[i]
+        # 移除后列表之外的项可能进入前 TOP_K，下次查询时重新计算
+        for prefix in _short_prefixes(entry[2]):
+            if entry_key in self.top.get(prefix, ()):
+                del self.top[prefix]
+
+    def _scan(self, prefix, limit):
+        """二分查找前缀，返回浏览量最高的 limit 个 entry_key"""
+        found = set()
+        i = bisect_left(self.keys, (prefix,))
+        while i < len(self.keys) and self.keys[i][0].startswith(prefix):
+            found.add(self.keys[i][1])
+            i += 1
+        return heapq.nlargest(limit, found, key=lambda entry_key: self.entries[entry_key][1])
+
+    def build(self):
+        from blog.models import Article, Category, Tag
+        published = Q(article__status='p', article__type='a')
+        articles = Article.objects.filter(status='p', type='a').order_by('-views').only(
+            'id', 'title', 'views', 'creation_time')[:self.max_entries]
+        tags = Tag.objects.annotate(weight=Sum('article__views', filter=published))
+        categorys = Category.objects.annotate(weight=Sum('article__views', filter=published))
+        # 在新的数组中构建，最后排序一次后整体替换，构建期间不阻塞查询
+        items = [(('article', article.pk), article.title, article.get_absolute_url(), article.views)
+                 for article in articles]
+        items.extend((('tag', tag.pk), tag.name, tag.get_absolute_url(), tag.weight or 0) for tag in tags)
+        items.extend((('category', category.pk), category.name, category.get_absolute_url(), category.weight or 0)
+                     for category in categorys)
+        entries = {}
+        keys = []
+        candidates = {}
+        for entry_key, text, url, weight in items:
+            entry_keys = get_suggest_keys(text)
+            entries[entry_key] = ({'text': text, 'url': url, 'type': entry_key[0]}, weight, entry_keys)
+            keys.extend((key, entry_key) for key in entry_keys)
+            for prefix in _short_prefixes(entry_keys):
+                candidates.setdefault(prefix, []).append((weight, entry_key))
+        keys.sort()
+        top = {prefix: [entry_key for weight, entry_key in heapq.nlargest(TOP_K, weighted, key=lambda w: w[0])]
+               for prefix, weighted in candidates.items()}
+        with self.lock:
+            self.keys = keys
+            self.entries = entries
+            self.top = top
+            self.built_at = time.time()
+        logger.info('suggest index built:{count} entries'.format(count=len(self.entries)))
+
+    def ensure_fresh(self):
+        """第一次查询时同步建立；过期后只启动一个后台线程重建"""
+        if self.built_at is None:
+            with self.building:
+                if self.built_at is None:
+                    self.build()
+        elif time.time() - self.built_at > self.rebuild_interval and self.building.acquire(blocking=False):
+            threading.Thread(target=self._rebuild_in_background, name='suggest-index-builder', daemon=True).start()
+
+    def _rebuild_in_background(self):
+        from django.db import connection
+        try:
+            self.build()
+        except Exception:
+            logger.exception('suggest index rebuild failed')
+            # 等下一个周期再重试，不在每次查询时重复失败
+            with self.lock:
+                self.built_at = time.time()
+        finally:
+            connection.close()
+            self.building.release()
+
+    def suggest(self, prefix, limit=10):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        with self.lock:
+            if len(prefix) <= TOP_PREFIX_LEN and limit <= TOP_K:
+                top = self.top.get(prefix)
+                if top is None:
+                    top = self.top[prefix] = self._scan(prefix, TOP_K)
+                top = top[:limit]
+            else:
+                top = self._scan(prefix, limit)
+            entries = [self.entries[entry_key] for entry_key in top]
+        return [dict(suggestion) for suggestion, weight, keys in entries]
+
+    def update_article(self, article):
+        if self.built_at is None:
+            return
+        with self.lock:
+            entry_key = ('article', article.pk)
+            if article.status != 'p' or article.type != 'a':
+                self._remove(entry_key)
+                return
+            self._add(entry_key, article.title, article.get_absolute_url(), article.views)
+            articles = [k for k in self.entries if k[0] == 'article']
+            if len(articles) > self.max_entries:
+                self._remove(min(articles, key=lambda k: self.entries[k][1]))
+
+    def update_term(self, instance):
+        """分类或标签被修改，浏览量权重沿用之前的值，等待下次重建"""
+        if self.built_at is None:
+            return
+        with self.lock:
+            entry_key = (instance._meta.model_name, instance.pk)
+            weight = self.entries[entry_key][1] if entry_key in self.entries else 0
+            self._add(entry_key, instance.name, instance.get_absolute_url(), weight)
+
+    def remove(self, model_name, pk):
+        if self.built_at is None:
+            return
+        with self.lock:
+            self._remove((model_name, pk))
+
+
+suggest_index = SuggestIndex(
+    max_entries=settings.SUGGEST_MAX_ARTICLES,
+    rebuild_interval=settings.SUGGEST_REBUILD_INTERVAL)
@@ -0,0 +1,37 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 侧边栏出现在所有博客页面上，其内容变化时需要清除全部页面
+SIDEBAR_KEY = 'sidebar'
+
+
+def add_surrogate_keys(request, *keys):
+    """
+    记录本次响应渲染用到的对象，由 SurrogateKeyMiddleware 写入响应头，
+    键名与 blog.conditional 中的版本范围一致，如 article_1、category_python、index
+    """
+    if not hasattr(request, '_surrogate_keys'):
+        request._surrogate_keys = set()
+    request._surrogate_keys.update(k for k in keys if k)
+
+
+def get_surrogate_keys(request):
+    return getattr(request, '_surrogate_keys', set())
+
+
+def article_key(article_id):
+    return 'article_{id}'.format(id=article_id)
+
+
+def category_key(slug):
+    return 'category_{slug}'.format(slug=slug)
+
+
+def tag_key(slug):
+    return 'tag_{slug}'.format(slug=slug)
+
+
+def author_key(username):
+    from uuslug import slugify
+    return 'author_{name}'.format(name=slugify(username))
@@ -12,6 +12,7 @@ from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
+from blog.loaders import annotate_tag_article_count
 from blog.models import Article, Category, Tag, Links, SideBar, LinkShowType
 from comments.models import Comment
 from djangoblog.utils import CommonMarkdown, sanitize_html
@@ -190,7 +191,9 @@ def load_articletags(article):
     tags_list = []
     for tag in tags:
         url = tag.get_absolute_url()
-        count = tag.get_article_count()
+        count = getattr(tag, 'article_count', None)
+        if count is None:
+            count = tag.get_article_count()
         tags_list.append((
             url, count, tag, random.choice(settings.BOOTSTRAP_COLOR_TYPES)
         ))
@@ -223,15 +226,15 @@ def load_sidebar(user, linktype):
         dates = Article.objects.datetimes('creation_time', 'month', order='DESC')
         links = Links.objects.filter(is_enable=True).filter(
             Q(show_type=str(linktype)) | Q(show_type=LinkShowType.A))
-        commment_list = Comment.objects.filter(is_enable=True).order_by(
-            '-id')[:blogsetting.sidebar_comment_count]
+        commment_list = Comment.objects.filter(is_enable=True).select_related(
+            'author', 'article').order_by('-id')[:blogsetting.sidebar_comment_count]
         # 标签云 计算字体大小
         # 根据总数计算出平均值 大小为 (数目/平均值)*步长
         increment = 5
-        tags = Tag.objects.all()
+        tags = annotate_tag_article_count(Tag.objects.all())
         sidebar_tags = None
         if tags and len(tags) > 0:
-            s = [t for t in [(t, t.get_article_count()) for t in tags] if t[1]]
+            s = [t for t in [(t, t.article_count) for t in tags] if t[1]]
             count = sum([t[1] for t in s])
             dd = 1 if (count == 0 or not len(tags)) else count / len(tags)
             import random
@@ -341,8 +344,8 @@ def load_pagination_info(page_obj, page_type, tag_name):
     }
 
 
-@register.inclusion_tag('blog/tags/article_info.html')
-def load_article_detail(article, isindex, user):
+@register.inclusion_tag('blog/tags/article_info.html', takes_context=True)
+def load_article_detail(context, article, isindex, user):
     """
     加载文章详情
     :param article:
@@ -357,6 +360,7 @@ def load_article_detail(article, isindex, user):
         'isindex': isindex,
         'user': user,
         'open_site_comment': blogsetting.open_site_comment,
+        'article_recommendations': context.get('article_recommendations'),
     }
 
 
@@ -1,19 +1,25 @@
 import os
+from unittest import skipUnless
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.core.paginator import Paginator
+from django.db import connection
 from django.templatetags.static import static
-from django.test import Client, RequestFactory, TestCase
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from accounts.models import BlogUser
 from blog.forms import BlogSearchForm
+from blog.loaders import ArticleDetailLoader
 from blog.models import Article, Category, Tag, SideBar, Links
 from blog.templatetags.blog_tags import load_pagination_info, load_articletags
-from djangoblog.utils import get_current_site, get_sha256
+from comments.models import Comment
+from djangoblog.utils import cache, get_blog_setting, get_current_site, get_sha256
+from interaction.models import InteractionActor, Like
 from oauth.models import OAuthUser, OAuthConfig
 
 
@@ -230,3 +236,1670 @@ class ArticleTest(TestCase):
         call_command("clear_cache")
         call_command("sync_user_avatar")
         call_command("build_search_words")
+
+
+class ArticleDetailLoaderTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        parent = Category.objects.create(name="parent category")
+        self.category = Category.objects.create(
+            name="child category", parent_category=parent)
+        self.article = Article.objects.create(
+            title="loader title",
+            body="loader content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+        cache.clear()
+        get_blog_setting()
+        get_current_site()
+        self.add_items(1)
+
+    def add_items(self, count):
+        start = Tag.objects.count()
+        for i in range(start, start + count):
+            tag = Tag.objects.create(name="loadertag" + str(i))
+            self.article.tags.add(tag)
+        parents = Comment.objects.bulk_create([
+            Comment(body="comment" + str(i), author=self.user,
+                    article=self.article, is_enable=True)
+            for i in range(count)])
+        Comment.objects.bulk_create([
+            Comment(body="reply", author=self.user, article=self.article,
+                    parent_comment=c, is_enable=True) for c in parents])
+        actor_start = InteractionActor.objects.count()
+        for i in range(actor_start, actor_start + count):
+            actor = InteractionActor.objects.create(anonymous_key="loaderkey" + str(i))
+            Like.objects.create(article=self.article, actor=actor)
+
+    def detail_query_count(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.article.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_is_constant(self):
+        base_count, response = self.detail_query_count()
+        # 点赞数只由 interaction/states/ 返回，页面和 ETag 与点赞无关
+        self.assertNotIn('like_count', response.context)
+        self.add_items(8)
+        count, response = self.detail_query_count()
+        self.assertEqual(response.context['comment_count'], 18)
+        self.assertEqual(len(response.context['article_tags']), 9)
+        self.assertEqual(base_count, count)
+
+    def test_loader_context(self):
+        article = ArticleDetailLoader.get_queryset().get(pk=self.article.pk)
+        data = ArticleDetailLoader(article, 5).load()
+        self.assertEqual(data['article_tags'][0].article_count, 1)
+        self.assertEqual(
+            [name for name, url in data['category_tree']],
+            ["child category", "parent category"])
+        self.assertEqual(len(data['p_comments'].object_list), 1)
+        parent = data['p_comments'].object_list[0]
+        self.assertEqual(len(data['comment_children'][parent.pk]), 1)
+
+
+class ArticleNeighborIndexTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        self.category = Category.objects.create(name="neighbor category")
+        self.other_category = Category.objects.create(name="other category")
+        self.articles = [self.create_article(i) for i in range(4)]
+
+    def create_article(self, i, status='p', category=None):
+        return Article.objects.create(
+            title="neighbor" + str(i),
+            body="neighbor content",
+            author=self.user,
+            category=category or self.category,
+            type='a',
+            status=status)
+
+    def test_neighbors(self):
+        from blog.neighbor_index import ArticleNeighborIndex
+        first, second, third, fourth = self.articles
+        self.assertEqual(second.prev_article(), first)
+        self.assertEqual(second.next_article(), third)
+        self.assertIsNone(first.prev_article())
+        self.assertIsNone(fourth.next_article())
+        self.assertEqual(ArticleNeighborIndex.neighbors(third), (second, fourth))
+
+    def test_incremental_update(self):
+        from blog.neighbor_index import ArticleNeighborIndex
+        first, second, third, fourth = self.articles
+        ArticleNeighborIndex.get_ids('a')
+        third.status = 'd'
+        third.save()
+        self.assertEqual(second.next_article(), fourth)
+        third.status = 'p'
+        third.save()
+        self.assertEqual(second.next_article(), third)
+        draft = self.create_article(10, status='d')
+        self.assertNotIn(draft.id, ArticleNeighborIndex.get_ids('a'))
+        fourth.delete()
+        self.assertIsNone(third.next_article())
+        self.assertEqual(
+            list(ArticleNeighborIndex.get_ids('a')),
+            [first.id, second.id, third.id])
+
+    def test_concurrent_build_not_served(self):
+        from array import array
+        from blog.neighbor_index import ArticleNeighborIndex
+        from djangoblog.utils import cache
+        first, second, third, fourth = self.articles
+        # 另一个请求在撤回前开始构建，撤回提交后才写入缓存
+        key = ArticleNeighborIndex.cache_key('a')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            third.status = 'd'
+            third.save()
+        self.assertTrue(callbacks)
+        cache.set(key, array('q', [a.id for a in self.articles]))
+        self.assertEqual(second.next_article(), fourth)
+
+    def test_by_category(self):
+        from blog.neighbor_index import ArticleNeighborIndex
+        first, second, third, fourth = self.articles
+        second.category = self.other_category
+        second.save()
+        self.assertEqual(
+            ArticleNeighborIndex.neighbor_ids(third, by_category=True),
+            (first.id, fourth.id))
+        self.assertEqual(
+            ArticleNeighborIndex.neighbor_ids(third, by_category=False),
+            (second.id, fourth.id))
+
+    def test_invalidate(self):
+        from blog.neighbor_index import ArticleNeighborIndex
+        first, second, third, fourth = self.articles
+        ArticleNeighborIndex.get_ids('a')
+        Article.objects.filter(pk=second.pk).update(status='d')
+        ArticleNeighborIndex.invalidate()
+        self.assertEqual(first.next_article(), third)
+
+
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        category = Category.objects.create(name="page cache category")
+        self.article = Article.objects.create(
+            title="page cache title",
+            body="page cache content",
+            author=self.user,
+            category=category,
+            type='a',
+            status='p')
+        from django.core.cache import caches
+        from djangoblog.utils import cache
+        cache.clear()
+        caches['counters'].clear()
+
+    def test_anonymous_hit(self):
+        url = self.article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = Client().get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        content = response.content.decode('utf-8')
+        self.assertIn(self.article.title, content)
+        self.assertNotIn('<!!CSRF_TOKEN!!>', content)
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_precompressed_variants(self):
+        import gzip
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        response = Client().get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        content = gzip.decompress(response.content).decode('utf-8')
+        self.assertIn(self.article.title, content)
+        self.assertNotIn('<!!CSRF_TOKEN!!>', content)
+        self.assertNotIn('<!!LOAD_TIMES!!>', content)
+
+        response = Client().get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn(self.article.title, response.content.decode('utf-8'))
+        self.assertNotIn(b'<!!LOAD_TIMES!!>', response.content)
+
+    def test_query_params_in_key(self):
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        # 视图不读取的参数命中同一份缓存，评论分页参数单独缓存
+        response = Client().get(url, {'utm_source': 'feed'})
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        response = Client().get(url, {'comment_page': '1'})
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        response = Client().get(url, {'comment_page': '1', 'utm_source': 'feed'})
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+    def test_authenticated_bypass(self):
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        self.client.login(username='liangliangyy1', password='liangliangyy1')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_expire_and_buffered_views(self):
+        from blog.page_cache import expire_page_cache
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url)
+        expire_page_cache(self.article.get_absolute_url())
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.views, 4)
+
+    def test_buffered_views_survive_clear(self):
+        from unittest.mock import patch
+        from django.core.cache import caches
+        from blog.page_cache import expire_page_cache
+        from djangoblog.utils import cache
+        from plugins.view_count.plugin import plugin
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url)
+        # 其他文章或评论保存时清空默认缓存
+        cache.clear()
+        expire_page_cache(url)
+        self.client.get(url)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.views, 4)
+        # 两个请求同时取走缓冲：第二个多减的部分加回，不重复计数
+        counters = caches['counters']
+        key = plugin._buffer_key(self.article.id)
+        counters.set(key, 5)
+        with patch.object(counters, 'get', return_value=5):
+            self.assertEqual(plugin.take_buffered(self.article.id), 5)
+            self.assertEqual(plugin.take_buffered(self.article.id), 0)
+        self.assertEqual(counters.get(key), 0)
+
+    def test_buffered_views_flushed(self):
+        import time
+        from unittest.mock import patch
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        # 一直命中缓存时，缓冲达到次数后写入数据库
+        with override_settings(VIEW_COUNT_FLUSH_THRESHOLD=3):
+            Client().get(url)
+            Client().get(url)
+            self.article.refresh_from_db()
+            self.assertEqual(self.article.views, 1)
+            self.assertEqual(Client().get(url)['X-Page-Cache'], 'HIT')
+            self.article.refresh_from_db()
+            self.assertEqual(self.article.views, 4)
+        # 或开始缓冲超过时间间隔后写入
+        with override_settings(VIEW_COUNT_FLUSH_INTERVAL=60):
+            Client().get(url)
+            with patch('plugins.view_count.plugin.time.time', return_value=time.time() + 60):
+                Client().get(url)
+            self.article.refresh_from_db()
+            self.assertEqual(self.article.views, 6)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="conditional category")
+        self.article = Article.objects.create(
+            title="conditional title",
+            body="conditional content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+        from djangoblog.utils import cache
+        # 保存不再同步清空缓存，先清掉其他用例留下的网站配置
+        cache.clear()
+        get_blog_setting()
+        # 登录后绕过整页缓存，验证视图自身的验证器
+        self.client.login(username='liangliangyy1', password='liangliangyy1')
+
+    def test_article_not_modified(self):
+        from comments.models import Comment
+        url = self.article.get_absolute_url()
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        # 会话、登录用户和评论聚合，文章来自对象缓存
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Comment.objects.create(body='conditional comment', author=self.user, article=self.article,
+                               is_enable=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_version_bumped_on_publish(self):
+        for url in ('/', self.category.get_absolute_url()):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            Article.objects.create(
+                title="conditional new " + url,
+                body="conditional content",
+                author=self.user,
+                category=self.category,
+                type='a',
+                status='p')
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SurrogateKeyTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="surrogate category")
+        self.tag = Tag.objects.create(name="surrogate tag")
+        self.article = Article.objects.create(
+            title="surrogate title",
+            body="surrogate content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+        self.article.tags.add(self.tag)
+        from djangoblog.utils import cache
+        cache.clear()
+
+    def test_response_headers(self):
+        response = self.client.get(self.article.get_absolute_url())
+        keys = response['Surrogate-Key'].split()
+        for key in ('article_%d' % self.article.pk, 'category_' + self.category.slug,
+                    'tag_' + self.tag.slug, 'sidebar'):
+            self.assertIn(key, keys)
+        # 文章页的评论表单带有访客的 CSRF token，不能由代理共享
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('s-maxage', response['Cache-Control'])
+        # 命中整页缓存时响应头保持一致
+        response = self.client.get(self.article.get_absolute_url())
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertIn('article_%d' % self.article.pk, response['Surrogate-Key'])
+
+        response = self.client.get(self.category.get_absolute_url())
+        self.assertIn('article_%d' % self.article.pk, response['Surrogate-Key'].split())
+        self.assertIn('s-maxage', response['Cache-Control'])
+
+        self.client.login(username='liangliangyy1', password='liangliangyy1')
+        response = self.client.get(self.article.get_absolute_url())
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_purge_on_save(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from django.test import override_settings
+
+        purged = []
+        received = threading.Event()
+
+        class StandInProxy(BaseHTTPRequestHandler):
+            def do_PURGE(self):
+                purged.append(self.headers['Surrogate-Key'].split())
+                self.send_response(200)
+                self.end_headers()
+                received.set()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProxy)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            purge_url = 'http://127.0.0.1:%d/' % server.server_address[1]
+            with override_settings(PROXY_PURGE_URL=purge_url):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.article.title = 'surrogate title changed'
+                    self.article.save()
+                self.assertTrue(received.wait(5))
+        finally:
+            server.shutdown()
+            server.server_close()
+        keys = purged[0]
+        for key in ('article_%d' % self.article.pk, 'index', 'category_' + self.category.slug,
+                    'tag_' + self.tag.slug, 'sidebar'):
+            self.assertIn(key, keys)
+
+
+class StreamingArticleTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        category = Category.objects.create(name="streaming category")
+        self.article = Article.objects.create(
+            title="streaming title",
+            body="streaming content",
+            author=self.user,
+            category=category,
+            type='a',
+            status='p')
+        from djangoblog.utils import cache
+        cache.clear()
+
+    def test_streaming_render(self):
+        from unittest.mock import patch
+        from django.test import override_settings
+        from blog.loaders import ArticleDetailLoader
+        url = self.article.get_absolute_url()
+        with override_settings(ARTICLE_STREAMING_ENABLED=True), \
+                patch.object(ArticleDetailLoader, 'load_body', autospec=True,
+                             side_effect=ArticleDetailLoader.load_body) as load_body:
+            response = Client().get(url)
+            self.assertTrue(response.streaming)
+            self.assertIn('csrftoken', response.cookies)
+            # 评论等正文数据在 <head> 输出之后才加载
+            content = iter(response.streaming_content)
+            chunks = [next(content).decode('utf-8')]
+            load_body.assert_not_called()
+            chunks.extend(c.decode('utf-8') for c in content)
+            load_body.assert_called_once()
+            self.assertGreater(len(chunks), 2)
+            # <head> 先于正文单独输出
+            self.assertIn('</head>', chunks[0] + chunks[1])
+            self.assertNotIn('id="primary"', chunks[0] + chunks[1])
+            content = ''.join(chunks)
+            self.assertIn('streaming content', content)
+            self.assertIn('评论<span>0</span>', content)
+            self.assertNotIn('<!!LOAD_TIMES!!>', content)
+
+            # 流式输出完成后写入整页缓存
+            response = Client().get(url)
+            self.assertEqual(response['X-Page-Cache'], 'HIT')
+            self.assertIn(self.article.title, response.content.decode('utf-8'))
+
+
+class ObjectCacheTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="object cache category")
+        self.articles = [Article.objects.create(
+            title="object cache title %d" % i,
+            body="object cache content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p') for i in range(3)]
+        from djangoblog.utils import cache
+        cache.clear()
+
+    def test_get_and_invalidate(self):
+        Category.cached.get(slug=self.category.slug)
+        with self.assertNumQueries(0):
+            self.assertEqual(Category.cached.get(pk=self.category.pk).name, self.category.name)
+            self.assertEqual(Category.cached.get(slug=self.category.slug).pk, self.category.pk)
+        old_slug = self.category.slug
+        self.category.name = "object cache renamed"
+        self.category.save()
+        self.assertEqual(Category.cached.get(pk=self.category.pk).name, "object cache renamed")
+        with self.assertRaises(Category.DoesNotExist):
+            Category.cached.get(slug=old_slug)
+        with self.assertRaises(Article.DoesNotExist):
+            Article.cached.get(pk=0)
+        from django.http import Http404
+        for pk in (None, 'abc', 0):
+            with self.assertRaises(Http404):
+                Article.cached.get_or_404(pk=pk)
+        self.assertEqual(Article.cached.get_or_404(pk=str(self.articles[0].pk)).pk, self.articles[0].pk)
+
+    def test_invalidated_again_on_commit(self):
+        from djangoblog.utils import cache
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "object cache committed"
+            self.category.save()
+            # 提交前另一个请求读到旧数据并回填缓存
+            stale = Category.objects.get(pk=self.category.pk)
+            stale.name = "object cache stale"
+            Category.cached.set(stale)
+        self.assertIsNone(cache.get(Category.cached._key(self.category.pk)))
+        self.assertEqual(Category.cached.get(pk=self.category.pk).name, "object cache committed")
+
+    def test_viewed_is_atomic(self):
+        article = Article.cached.get(pk=self.articles[0].pk)
+        stale = Article.objects.get(pk=article.pk)
+        article.viewed()
+        stale.viewed(2)
+        self.assertEqual(stale.views, 3)
+        self.assertEqual(Article.cached.get(pk=article.pk).views, 3)
+
+    def test_excluded_fields_not_cached(self):
+        from djangoblog.utils import cache
+        BlogUser.cached.get(pk=self.user.pk)
+        cached_user = cache.get(BlogUser.cached._key(self.user.pk))
+        self.assertNotIn('password', cached_user.__dict__)
+        with self.assertNumQueries(0):
+            self.assertEqual(BlogUser.cached.get(pk=self.user.pk).username, self.user.username)
+
+    def test_get_many_and_list(self):
+        ids = [a.pk for a in self.articles]
+        self.assertEqual(set(Article.cached.get_many(ids)), set(ids))
+        article_list = Article.cached.list(ids, select_related=('author', 'category'))
+        # 首次填充作者和分类各一条查询
+        with self.assertNumQueries(2):
+            list(article_list)
+        with self.assertNumQueries(0):
+            page = article_list[:2]
+            self.assertEqual([a.pk for a in page], ids[:2])
+            self.assertEqual(page[0].author.username, self.user.username)
+            self.assertEqual(page[0].category.name, self.category.name)
+        Article.cached.invalidate_all()
+        with self.assertNumQueries(1):
+            Article.cached.get_many(ids)
+
+
+class InvalidationTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="invalidation category")
+        from djangoblog import invalidation
+        # 丢弃其他用例中未提交的待办
+        invalidation._local.pending = None
+
+    def test_flush_once_per_transaction(self):
+        from unittest.mock import patch
+        from djangoblog.invalidation import Invalidation
+        with patch.object(Invalidation, 'flush', autospec=True) as flush:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    Article.objects.create(
+                        title="invalidation title %d" % i,
+                        body="invalidation content",
+                        author=self.user,
+                        category=self.category,
+                        type='a',
+                        status='p')
+            self.assertEqual(flush.call_count, 1)
+            self.assertTrue(flush.call_args[0][0].clear_cache)
+
+    def test_savepoint_rollback_skips_comment_email(self):
+        from unittest.mock import patch
+        from django.db import transaction
+        from comments.models import Comment
+        from djangoblog import invalidation
+        article = Article.objects.create(
+            title="invalidation comment",
+            body="invalidation content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+        with patch.object(invalidation._thread, 'start_new_thread') as start_new_thread:
+            with self.captureOnCommitCallbacks(execute=True):
+                kept = Comment.objects.create(body='kept', author=self.user, article=article, is_enable=True)
+                with self.assertRaises(ValueError):
+                    with transaction.atomic():
+                        Comment.objects.create(body='rolled back', author=self.user, article=article,
+                                               is_enable=True)
+                        raise ValueError()
+        emails = [call[0][1][0] for call in start_new_thread.call_args_list
+                  if call[0][0] is invalidation._send_comment_emails]
+        self.assertEqual(emails, [[kept]])
+
+    def test_admin_bulk_update(self):
+        from blog.admin import draft_article
+        from djangoblog.utils import cache
+        article = Article.objects.create(
+            title="invalidation title",
+            body="invalidation content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+        self.assertEqual(Article.cached.get(pk=article.pk).status, 'p')
+        cache.set('invalidation_marker', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            draft_article(None, None, Article.objects.filter(pk=article.pk))
+        self.assertEqual(Article.cached.get(pk=article.pk).status, 'd')
+        self.assertIsNone(cache.get('invalidation_marker'))
+
+
+class InvalidationRollbackTest(TransactionTestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="invalidation category")
+        from djangoblog import invalidation
+        invalidation._local.pending = None
+
+    def test_rollback_discards_pending(self):
+        from unittest.mock import patch
+        from django.db import transaction
+        from djangoblog import invalidation
+        with patch.object(invalidation.Invalidation, 'flush', autospec=True) as flush:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Article.objects.create(
+                        title="invalidation rollback",
+                        body="invalidation content",
+                        author=self.user,
+                        category=self.category,
+                        type='a',
+                        status='p')
+                    raise ValueError()
+            # 不在事务中时立即执行，回滚的修改不在其中
+            invalidation.mark_sidebar()
+            self.assertEqual(flush.call_count, 1)
+            self.assertFalse(flush.call_args[0][0].clear_cache)
+            self.assertTrue(flush.call_args[0][0].sidebar)
+
+
+class SearchIndexQueueTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="index queue category")
+        from djangoblog.utils import cache
+        cache.clear()
+
+    def test_batched_and_deduplicated(self):
+        from unittest.mock import patch
+        from djangoblog import search_queue
+        from djangoblog.models import SearchIndexTask
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        queue = search_queue.IndexQueue(background=False)
+        with patch.object(search_queue, 'index_queue', queue), \
+                patch.object(WhooshSearchBackend, 'update') as update, \
+                patch.object(WhooshSearchBackend, 'remove') as remove:
+            with self.captureOnCommitCallbacks(execute=True):
+                article = Article.objects.create(
+                    title="index queue title",
+                    body="index queue content",
+                    author=self.user,
+                    category=self.category,
+                    type='a',
+                    status='p')
+                article.save()
+                draft = Article.objects.create(
+                    title="index queue draft",
+                    body="index queue content",
+                    author=self.user,
+                    category=self.category,
+                    type='a',
+                    status='d')
+            self.assertEqual(SearchIndexTask.objects.count(), 3)
+            self.assertEqual(queue.flush(), 2)
+            self.assertFalse(SearchIndexTask.objects.exists())
+            update.assert_called_once()
+            self.assertEqual(update.call_args[0][1], [article])
+            remove.assert_called_once_with('blog.article.%d' % draft.pk)
+
+            # 写入失败时登记保留，下一次重试
+            article.save()
+            update.side_effect = OSError
+            with self.assertRaises(OSError):
+                queue.flush()
+            self.assertEqual(SearchIndexTask.objects.count(), 1)
+            update.side_effect = None
+            self.assertEqual(queue.flush(), 1)
+            self.assertFalse(SearchIndexTask.objects.exists())
+
+    def test_single_writer_and_rollback(self):
+        import fcntl
+        import tempfile
+        from unittest.mock import patch
+        from django.db import transaction
+        from djangoblog import search_queue
+        from djangoblog.models import SearchIndexTask
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        lock_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(lock_file.close)
+        queue = search_queue.IndexQueue(background=False, lock_path=lock_file.name)
+        with patch.object(search_queue, 'index_queue', queue), \
+                patch.object(WhooshSearchBackend, 'update') as update:
+            # 回滚的保存不留下登记
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.create_article("index queue rollback")
+                raise ValueError
+            self.assertFalse(SearchIndexTask.objects.exists())
+            self.create_article("index queue writer")
+            # 其他进程正在写入时跳过，登记留到下一次
+            with open(lock_file.name) as other:
+                fcntl.flock(other, fcntl.LOCK_EX)
+                self.assertEqual(queue.flush(blocking=False), 0)
+            self.assertEqual(SearchIndexTask.objects.count(), 1)
+            self.assertEqual(queue.flush(blocking=False), 1)
+            update.assert_called_once()
+
+    def create_article(self, title):
+        return Article.objects.create(
+            title=title, body="index queue content", author=self.user,
+            category=self.category, type='a', status='p')
+
+
+class SearcherPoolTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="searcher pool category")
+
+    def create_article(self, title):
+        return Article.objects.create(
+            title=title,
+            body="searcher pool content",
+            author=self.user,
+            category=self.category,
+            type='a',
+            status='p')
+
+    @override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+    def test_searcher_reused_until_index_changes(self):
+        from haystack import connections
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        backend = WhooshSearchBackend('default', STORAGE='ram')
+        backend.setup()
+        backend.clear()
+        index = connections['default'].get_unified_index().get_index(Article)
+        backend.update(index, [self.create_article("searcherpool first")])
+        self.assertEqual(backend.search('searcherpool')['hits'], 1)
+        searcher = backend.searcher_pool.searcher
+        self.assertEqual(backend.search('searcherpool')['hits'], 1)
+        self.assertIs(backend.searcher_pool.searcher, searcher)
+
+        backend.update(index, [self.create_article("searcherpool second")])
+        self.assertEqual(backend.search('searcherpool')['hits'], 2)
+        self.assertIsNot(backend.searcher_pool.searcher, searcher)
+        # 没有查询在使用时不保留旧的搜索器
+        self.assertEqual(backend.searcher_pool.users, {})
+
+    @override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+    def test_narrow_filter_cached_per_generation(self):
+        from unittest.mock import patch
+        from haystack import connections
+        from whoosh.qparser import QueryParser
+        from whoosh.searching import Searcher
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        backend = WhooshSearchBackend('default', STORAGE='ram')
+        backend.setup()
+        backend.clear()
+        index = connections['default'].get_unified_index().get_index(Article)
+        backend.update(index, [self.create_article("searcherpool first")])
+        backend.search('searcherpool')
+        # 索引未变化时直接使用缓存的过滤集合
+        with patch.object(Searcher, 'docs_for_query') as docs_for_query:
+            self.assertEqual(backend.search('searcherpool')['hits'], 1)
+            docs_for_query.assert_not_called()
+        self.assertEqual(len(backend.searcher_pool.filters), 1)
+
+        backend.update(index, [self.create_article("searcherpool second")])
+        self.assertEqual(backend.search('searcherpool')['hits'], 2)
+        filter_docs = next(iter(backend.searcher_pool.filters.values()))
+        self.assertEqual(len(filter_docs), 2)
+
+        # 过滤集合数量有上限，先淘汰最久未使用的
+        pool = backend.searcher_pool
+        with pool.acquire(backend.index) as searcher, \
+                patch('djangoblog.whoosh_cn_backend.MAX_NARROW_FILTERS', 2):
+            parser = QueryParser('text', schema=backend.schema)
+            for query_string in ('text:first', 'text:second', 'text:first', 'text:searcherpool'):
+                pool.narrow_filter(searcher, parser, query_string)
+        self.assertEqual(list(pool.filters), ['text:first', 'text:searcherpool'])
+
+    def test_search_result_cache(self):
+        from unittest.mock import patch
+        from haystack import connections
+        from djangoblog.utils import cache
+        from djangoblog.whoosh_cn_backend import SearcherPool, WhooshSearchBackend
+        cache.clear()
+        backend = WhooshSearchBackend('default', STORAGE='ram')
+        backend.setup()
+        backend.clear()
+        index = connections['default'].get_unified_index().get_index(Article)
+        article = self.create_article("searcherpool first")
+        backend.update(index, [article])
+        self.assertEqual(backend.search('searcherpool')['hits'], 1)
+        with patch.object(SearcherPool, 'acquire') as acquire:
+            with self.assertNumQueries(0):
+                results = backend.search(' searcherpool ')
+                self.assertEqual(results['results'][0].object.title, article.title)
+            acquire.assert_not_called()
+
+        backend.update(index, [self.create_article("searcherpool second")])
+        self.assertEqual(backend.search('searcherpool')['hits'], 2)
+
+    @override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+    def test_parallel_rebuild(self):
+        import shutil
+        import tempfile
+        from haystack import connections
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        backend = WhooshSearchBackend('default', PATH=path)
+        index = connections['default'].get_unified_index().get_index(Article)
+        old = self.create_article("searcherpool old")
+        backend.update(index, [old])
+        for i in range(5):
+            self.create_article("searcherpool rebuilt %d" % i)
+        old.delete()
+        with backend.searcher_pool.acquire(backend.index) as searcher:
+            self.assertEqual(backend.rebuild(index, procs=2, chunk_size=2), 5)
+            # 重建期间正在使用的搜索器仍然可用
+            self.assertEqual(searcher.doc_count(), 1)
+        self.assertEqual(backend.search('searcherpool')['hits'], 5)
+        self.assertFalse([f for f in os.listdir(os.path.dirname(path)) if f.startswith('.rebuild_')])
+
+    def test_update_during_rebuild_survives(self):
+        import shutil
+        import tempfile
+        import threading
+        from unittest import mock
+        from haystack import connections
+        from djangoblog import whoosh_cn_backend
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        backend = WhooshSearchBackend('default', PATH=path)
+        index = connections['default'].get_unified_index().get_index(Article)
+        first = self.create_article("searcherpool before")
+        second = self.create_article("searcherpool removed")
+        backend.update(index, [first, second])
+        full_prepare = index.full_prepare
+        committed = []
+
+        def bump_search_version():
+            # 搜索版本只在写入提交后递增
+            with backend.index.refresh().searcher() as searcher:
+                committed.append(tuple(len(searcher.search(backend.parser.parse(word)))
+                                       for word in ("renamed", "removed")))
+
+        def queue_write():
+            backend.update(index, [first])
+            backend.remove(second)
+
+        writer = threading.Thread(target=queue_write)
+        docs = {}
+
+        def prepare(obj):
+            if obj.title == "searcherpool renamed":
+                return dict(docs['renamed'])
+            doc = full_prepare(obj)
+            if obj.pk == first.pk and not docs:
+                # 文档已按旧标题准备好，此时队列写线程写入新标题并删除另一篇
+                first.title = "searcherpool renamed"
+                docs['renamed'] = full_prepare(first)
+                writer.start()
+            return doc
+
+        with mock.patch.object(index, 'full_prepare', side_effect=prepare), \
+                mock.patch.object(whoosh_cn_backend, 'bump_search_version', side_effect=bump_search_version):
+            backend.rebuild(index, procs=1)
+            writer.join()
+        # 重建切换后一次，队列的更新和删除提交后各一次
+        self.assertEqual(committed, [(0, 1), (1, 1), (1, 0)])
+        self.assertEqual(backend.search('renamed')['hits'], 1)
+        self.assertEqual(backend.search('before')['hits'], 0)
+        self.assertEqual(backend.search('removed')['hits'], 0)
+
+
+class SearchWordsTest(TestCase):
+    def test_site_words_in_user_dict(self):
+        import shutil
+        import tempfile
+        from djangoblog import search_words
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.addCleanup(setattr, search_words, '_tokenizer', None)
+        self.addCleanup(setattr, search_words, '_user_dict_version', None)
+        Tag.objects.create(name="云原生网关")
+        Category.objects.create(name="分布式追踪")
+        with override_settings(JIEBA_DICT_DIR=path):
+            call_command("build_search_words")
+            self.assertTrue(os.path.isfile(os.path.join(path, 'jieba.cache')))
+            words = search_words.get_tokenizer().lcut("学习云原生网关和分布式追踪")
+            self.assertIn("云原生网关", words)
+            self.assertIn("分布式追踪", words)
+
+            # 新增的标签立即生效
+            search_words.add_word("服务网格治理")
+            self.assertIn("服务网格治理", search_words.get_tokenizer().lcut("服务网格治理实践"))
+            with open(search_words.get_user_dict_path(), encoding='utf-8') as f:
+                self.assertIn("服务网格治理", f.read())
+
+            # 其他进程追加的词在下次分词前加载
+            self.assertNotIn("边缘计算节点", search_words.get_tokenizer().lcut("部署边缘计算节点"))
+            with open(search_words.get_user_dict_path(), 'a', encoding='utf-8') as f:
+                f.write('边缘计算节点 {freq}\n'.format(freq=search_words.WORD_FREQ))
+            self.assertIn("边缘计算节点", search_words.get_tokenizer().lcut("部署边缘计算节点"))
+
+
+class SuggestTest(TestCase):
+    def setUp(self):
+        from blog.suggest import suggest_index
+        self.index = suggest_index
+        self.addCleanup(setattr, suggest_index, 'built_at', None)
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="后端开发")
+        self.popular = Article.objects.create(
+            title="深度学习入门", body="suggest content", author=self.user,
+            category=self.category, type='a', status='p', views=100)
+        self.article = Article.objects.create(
+            title="深度优先搜索", body="suggest content", author=self.user,
+            category=self.category, type='a', status='p', views=10)
+        Article.objects.create(
+            title="深度草稿", body="suggest content", author=self.user,
+            category=self.category, type='a', status='d')
+        self.index.build()
+
+    def titles(self, prefix):
+        return [s['text'] for s in self.index.suggest(prefix)]
+
+    def test_prefix_and_pinyin(self):
+        self.assertEqual(self.titles("深度"), ["深度学习入门", "深度优先搜索"])
+        self.assertEqual(self.titles("shendu"), ["深度学习入门", "深度优先搜索"])
+        self.assertEqual(self.titles("sdyx"), ["深度优先搜索"])
+        self.assertEqual(self.titles("houduan"), ["后端开发"])
+        self.assertEqual(self.titles("xyz"), [])
+
+    def test_incremental_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.title = "宽度优先搜索"
+            self.article.save()
+            Tag.objects.create(name="深度强化")
+        self.assertEqual(self.titles("深度"), ["深度学习入门", "深度强化"])
+        self.assertEqual(self.titles("kuandu"), ["宽度优先搜索"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.popular.delete()
+        self.assertEqual(self.titles("深度"), ["深度强化"])
+
+    def test_short_prefix_top_k(self):
+        from unittest.mock import patch
+
+        def top(prefix):
+            return [s['text'] for s in self.index.suggest(prefix, 1)]
+
+        with patch('blog.suggest.TOP_K', 1):
+            self.index.build()
+            # 短前缀按浏览量取前几项，与检索键的字母顺序无关
+            self.assertEqual(top("s"), ["深度学习入门"])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.article.views = 1000
+                self.article.save()
+            self.assertEqual(top("s"), ["深度优先搜索"])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.article.delete()
+            self.assertEqual(top("s"), ["深度学习入门"])
+
+    def test_stale_index_rebuilt_in_background(self):
+        from unittest.mock import patch
+        self.index.built_at -= self.index.rebuild_interval + 1
+        with patch('blog.suggest.threading.Thread') as thread:
+            # 后台重建期间继续返回旧索引中的结果，并且只启动一个线程
+            self.assertEqual(self.titles("深度"), ["深度学习入门", "深度优先搜索"])
+            self.assertEqual(self.titles("深度"), ["深度学习入门", "深度优先搜索"])
+        thread.assert_called_once()
+        Article.objects.filter(pk=self.article.pk).update(title="宽度优先搜索")
+        with patch('django.db.connection.close'):
+            self.index._rebuild_in_background()
+        self.assertEqual(self.titles("深度"), ["深度学习入门"])
+        self.assertFalse(self.index.building.locked())
+
+    def test_suggest_view(self):
+        rsp = self.client.get(reverse('blog:search_suggest'), {'q': 'SD', 'limit': 1})
+        self.assertEqual(rsp.status_code, 200)
+        data = rsp.json()
+        self.assertEqual(data['query'], 'SD')
+        self.assertEqual(len(data['suggestions']), 1)
+        self.assertEqual(data['suggestions'][0]['url'], self.popular.get_absolute_url())
+
+
+class FakeIndicesClient:
+    def __init__(self, es):
+        self.es = es
+
+    def exists(self, index):
+        return bool(self.es.resolve(index))
+
+    def create(self, index, body=None, **kwargs):
+        self.es.indices_docs[index] = {}
+        self.es.aliases[index] = set()
+
+    def put_alias(self, index, name, **kwargs):
+        self.es.aliases[index].add(name)
+
+    def get_alias(self, index, **kwargs):
+        from elasticsearch.exceptions import NotFoundError
+        names = self.es.resolve(index)
+        if not names:
+            raise NotFoundError(404, 'index_not_found_exception', {})
+        return {name: {'aliases': {a: {} for a in self.es.aliases[name]}} for name in names}
+
+    def get(self, index, **kwargs):
+        from fnmatch import fnmatch
+        return {name: {} for name in self.es.indices_docs if fnmatch(name, index)}
+
+    def delete(self, index, ignore=None, **kwargs):
+        for name in list(self.get(index)):
+            del self.es.indices_docs[name]
+            del self.es.aliases[name]
+
+    def refresh(self, index, **kwargs):
+        for name in self.es.resolve(index):
+            self.es.refreshes[name] = self.es.refreshes.get(name, 0) + 1
+
+    def stats(self, index, **kwargs):
+        names = self.es.resolve(index)
+        return {'_all': {'primaries': {
+            'indexing': {'index_total': sum(self.es.index_totals.get(n, 0) for n in names), 'delete_total': 0},
+            'refresh': {'total': sum(self.es.refreshes.get(n, 0) for n in names)}}},
+            'indices': {name: {} for name in names}}
+
+    def update_aliases(self, body, **kwargs):
+        for action in body['actions']:
+            (op, params), = action.items()
+            if op == 'remove_index':
+                self.delete(params['index'])
+            elif op == 'remove':
+                self.es.aliases[params['index']].discard(params['alias'])
+            else:
+                self.es.aliases[params['index']].add(params['alias'])
+
+
+class FakeElasticsearch:
+    """本地替代 Elasticsearch，在内存中保存索引、别名和文档，标题含 fail 的文档写入失败"""
+
+    def __init__(self):
+        from elasticsearch.serializer import JSONSerializer
+        self.transport = type('Transport', (), {'serializer': JSONSerializer()})()
+        self.indices = FakeIndicesClient(self)
+        self.indices_docs = {}
+        self.aliases = {}
+        self.index_totals = {}
+        self.refreshes = {}
+        self.requests = []
+
+    def resolve(self, index):
+        if index in self.indices_docs:
+            return [index]
+        return [name for name, aliases in self.aliases.items() if index in aliases]
+
+    def count(self, index, **kwargs):
+        return {'count': sum(len(self.indices_docs[name]) for name in self.resolve(index))}
+
+    def bulk(self, body, **kwargs):
+        import json
+        lines = [json.loads(line) for line in body.strip().split('\n')]
+        self.requests.append(lines)
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            meta = action['index']
+            status = 400 if 'fail' in source['title'] else 201
+            item = {'_index': meta['_index'], '_id': meta['_id'], 'status': status}
+            if status == 400:
+                item['error'] = {'type': 'mapper_parsing_exception'}
+            else:
+                name, = self.resolve(meta['_index'])
+                self.indices_docs[name][meta['_id']] = source
+                self.index_totals[name] = self.index_totals.get(name, 0) + 1
+            items.append({'index': item})
+        return {'errors': any(i['index']['status'] >= 300 for i in items), 'items': items}
+
+
+class ElasticsearchBulkTest(TestCase):
+    def setUp(self):
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        category = Category.objects.create(name="bulk category")
+        tag = Tag.objects.create(name="bulk tag")
+        for i in range(5):
+            article = Article.objects.create(
+                title="bulk fail %d" % i if i == 3 else "bulk title %d" % i,
+                body="bulk content", author=self.user, category=category,
+                type='a', status='p')
+            article.tags.add(tag)
+
+    def test_bulk_index(self):
+        from blog.documents import ArticleDocumentManager
+        client = FakeElasticsearch()
+        manager = ArticleDocumentManager(client)
+        articles = manager.get_queryset().order_by('id')
+        # 文章连同作者、分类一条查询，标签一条查询，与文章数无关
+        with self.assertNumQueries(2):
+            docs = manager.convert_to_doc(articles)
+        result = manager.bulk_index(docs, chunk_size=2)
+        self.assertEqual(result['indexed'], 4)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertEqual([len(r) // 2 for r in client.requests], [2, 2, 1])
+        source = client.requests[0][1]
+        self.assertEqual(source['tags'], [{'name': 'bulk tag', 'id': Tag.objects.get().id}])
+        self.assertEqual(source['author']['nickname'], self.user.username)
+
+    def test_parallel_bulk_index(self):
+        from blog.documents import ArticleDocumentManager
+        client = FakeElasticsearch()
+        manager = ArticleDocumentManager(client)
+        docs = manager.iter_docs(manager.get_queryset().iterator(chunk_size=2))
+        result = manager.bulk_index(docs, chunk_size=2, thread_count=2)
+        self.assertEqual(result['indexed'], 4)
+        self.assertEqual(sum(len(r) // 2 for r in client.requests), 5)
+
+
+class ElasticsearchReindexTest(TestCase):
+    def setUp(self):
+        from blog.documents import ArticleDocumentManager
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="reindex category")
+        for i in range(3):
+            self.create_article("reindex title %d" % i)
+        self.client = FakeElasticsearch()
+        self.manager = ArticleDocumentManager(self.client)
+        # 创建文章时的索引登记视为已经写入
+        from djangoblog.models import SearchIndexTask
+        SearchIndexTask.objects.all().delete()
+
+    def create_article(self, title):
+        return Article.objects.create(
+            title=title, body="reindex content", author=self.user,
+            category=self.category, type='a', status='p')
+
+    def live_indices(self):
+        return self.manager.get_alias_indices()
+
+    def test_reindex_switches_alias(self):
+        first, = self.live_indices()
+        self.assertFalse(self.manager.is_current())
+        result = self.manager.reindex(chunk_size=2)
+        self.assertEqual(self.live_indices(), {result['index']})
+        self.assertNotEqual(result['index'], first)
+        self.assertTrue(self.manager.is_current())
+        # 保留一个旧索引用于回退，更早的被删除
+        second = result['index']
+        third = self.manager.reindex()['index']
+        self.assertEqual(set(self.client.indices_docs), {second, third})
+
+    def test_changes_during_reindex_wait_for_new_index(self):
+        import tempfile
+        from unittest.mock import patch
+        from djangoblog import search_queue
+        from djangoblog.models import SearchIndexTask
+        lock_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(lock_file.close)
+        queue = search_queue.IndexQueue(background=False, lock_path=lock_file.name)
+        iter_docs = self.manager.iter_docs
+        flushed = []
+
+        def edit_during_reindex(articles):
+            if not flushed:
+                # 另一个进程在扫描期间修改文章，队列写线程暂停
+                article = Article.objects.first()
+                article.title = "reindex edited"
+                article.save()
+                flushed.append(queue.flush(blocking=False))
+            return iter_docs(articles)
+
+        with override_settings(SEARCH_INDEX_WRITER_LOCK=lock_file.name), \
+                patch.object(search_queue, 'index_queue', queue), \
+                patch.object(self.manager, 'iter_docs', side_effect=edit_during_reindex):
+            self.manager.reindex()
+        self.assertEqual(flushed, [0])
+        # 登记留在队列中，写入新索引之前索引不是最新的
+        self.assertTrue(SearchIndexTask.objects.exists())
+        self.assertFalse(self.manager.is_current())
+
+    def test_failed_reindex_keeps_live_index(self):
+        from blog.documents import ReindexError
+        self.manager.reindex()
+        live = self.live_indices()
+        indices = set(self.client.indices_docs)
+        self.create_article("reindex fail")
+        with self.assertRaises(ReindexError):
+            self.manager.reindex()
+        self.assertEqual(self.live_indices(), live)
+        self.assertEqual(set(self.client.indices_docs), indices)
+        self.assertEqual(self.client.count(index='blog')['count'], 3)
+
+    def test_replaces_legacy_index(self):
+        from unittest.mock import patch
+        from blog.documents import ArticleDocument, ArticleDocumentManager
+        client = FakeElasticsearch()
+        client.indices.create(index='blog')
+        with patch.object(ArticleDocument, 'init'):
+            manager = ArticleDocumentManager(client)
+        result = manager.reindex()
+        self.assertEqual(manager.get_alias_indices(), {result['index']})
+        self.assertNotIn('blog', client.indices_docs)
+
+
+@override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+class ElasticSearchBackendTest(TestCase):
+    def setUp(self):
+        from unittest.mock import patch
+        from blog.documents import ArticleDocumentManager
+        from djangoblog.elasticsearch_backend import ElasticSearchBackend
+        user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        category = Category.objects.create(name="es category")
+        self.articles = [Article.objects.create(
+            title="es title %d" % i, body="django content", author=user,
+            category=category, type='a', status='p') for i in range(3)]
+        with patch.object(ArticleDocumentManager, 'create_index'):
+            self.backend = ElasticSearchBackend('default')
+        self.backend.is_suggest = True
+        self.requests = []
+
+    def execute(self, correction=None):
+        """替代 Search.execute，记录请求；correction 为推荐词"""
+        from elasticsearch_dsl.response import Response
+        test = self
+
+        def execute(search, ignore_cache=False):
+            body = search.to_dict()
+            test.requests.append(body)
+            response = {'hits': {
+                'total': {'value': len(test.articles), 'relation': 'eq'},
+                'hits': [{'_index': 'blog', '_id': str(a.id), '_score': 1.0} for a in test.articles]}}
+            if 'suggest' in body:
+                text = body['suggest']['suggest_search']['text']
+                options = [{'text': correction, 'score': 0.8, 'freq': 3}] if correction else []
+                response['suggest'] = {'suggest_search': [
+                    {'text': text, 'offset': 0, 'length': len(text), 'options': options}]}
+            return Response(search, response)
+
+        return execute
+
+    def search(self, query, correction=None):
+        from unittest.mock import patch
+        from elasticsearch_dsl import Search
+        with patch.object(Search, 'execute', self.execute(correction)):
+            return self.backend.search(query, start_offset=0, end_offset=10)
+
+    def test_suggestion_in_same_request(self):
+        results = self.search("django")
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('suggest', self.requests[0])
+        self.assertIsNone(results['spelling_suggestion'])
+        # 结果对象已经一次性取出
+        with self.assertNumQueries(0):
+            self.assertEqual([r.object for r in results['results']], self.articles)
+
+    def test_corrected_query(self):
+        results = self.search("djang", correction="django")
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(results['spelling_suggestion'], "django")
+        self.assertNotIn('suggest', self.requests[1])
+        self.assertIn("django", str(self.requests[1]['query']))
+
+    def test_generation_from_index_stats(self):
+        import time
+        from unittest.mock import patch
+        from blog.documents import ArticleDocumentManager
+        client = FakeElasticsearch()
+        self.backend.manager = ArticleDocumentManager(client)
+        now = time.monotonic()
+        with override_settings(SEARCH_RESULT_CACHE_TIMEOUT=60, SEARCH_INDEX_GENERATION_TTL=5), \
+                patch('djangoblog.elasticsearch_backend.time.monotonic', side_effect=lambda: now), \
+                patch.object(self.backend.manager, 'get_generation',
+                             wraps=self.backend.manager.get_generation) as get_generation:
+            self.search("django")
+            self.search("django")
+            self.assertEqual(len(self.requests), 1)
+            # 统计在 TTL 内只请求一次
+            self.assertEqual(get_generation.call_count, 1)
+            # 其他进程写入索引，不经过本进程的搜索版本
+            generation = self.backend.get_index_generation()
+            manager = self.backend.manager
+            manager.bulk_index(manager.convert_to_doc(self.articles[:1]))
+            self.assertEqual(self.backend.get_index_generation(), generation)
+            now += 5
+            self.assertNotEqual(self.backend.get_index_generation(), generation)
+            self.search("django")
+            self.assertEqual(len(self.requests), 2)
+
+
+class WhooshFacetTest(TestCase):
+    def setUp(self):
+        from datetime import datetime
+        from haystack import connections
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        python = Category.objects.create(name="python")
+        rust = Category.objects.create(name="rust")
+        web = Tag.objects.create(name="web")
+        cli = Tag.objects.create(name="cli")
+        articles = []
+        for category, tags, year in ((python, [web, cli], 2023), (python, [web], 2024), (rust, [cli], 2024)):
+            article = Article.objects.create(
+                title="facetword %s %d" % (category.name, year), body="facet content", author=user,
+                category=category, type='a', status='p',
+                pub_time=datetime(year, 6, 1))
+            article.tags.set(tags)
+            articles.append(article)
+        self.backend = WhooshSearchBackend('default', STORAGE='ram')
+        self.backend.setup()
+        self.backend.clear()
+        index = connections['default'].get_unified_index().get_index(Article)
+        self.backend.update(index, articles)
+
+    def search(self, **kwargs):
+        from datetime import datetime
+        return self.backend.search(
+            'facetword',
+            facets={'category_exact': {}, 'tags_exact': {}},
+            date_facets={'pub_time_exact': {
+                'start_date': datetime(2023, 1, 1), 'end_date': datetime(2025, 1, 1),
+                'gap_by': 'year', 'gap_amount': 1}},
+            **kwargs)['facets']
+
+    @override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+    def test_facet_counts(self):
+        from datetime import datetime
+        facets = self.search()
+        self.assertEqual(facets['fields']['category_exact'], [('python', 2), ('rust', 1)])
+        self.assertEqual(facets['fields']['tags_exact'], [('cli', 2), ('web', 2)])
+        self.assertEqual(facets['dates']['pub_time_exact'], [(datetime(2023, 1, 1), 1), (datetime(2024, 1, 1), 2)])
+
+        # 过滤后的搜索只统计过滤后的结果
+        facets = self.search(narrow_queries={'category_exact:rust'})
+        self.assertEqual(facets['fields']['category_exact'], [('rust', 1)])
+        self.assertEqual(facets['fields']['tags_exact'], [('cli', 1)])
+
+    def test_facets_cached_with_results(self):
+        from unittest.mock import patch
+        from whoosh.searching import Searcher
+        facets = self.search()
+        with patch.object(Searcher, 'search_page') as search_page:
+            self.assertEqual(self.search(), facets)
+            search_page.assert_not_called()
+
+
+class SearchBackendTestMixin:
+    def setUp(self):
+        from haystack import connections
+        self.user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        self.category = Category.objects.create(name="memory category")
+        self.articles = [
+            self.create_article("深度学习入门", "介绍深度学习和神经网络的基础知识"),
+            self.create_article("Django 教程", "使用 Django 搭建博客，介绍模型和视图"),
+            self.create_article("神经网络调参", "神经网络的训练技巧与深度学习实践"),
+        ]
+        self.index = connections['default'].get_unified_index().get_index(Article)
+        self.backend = self.get_backend()
+        self.backend.update(self.index, self.articles)
+
+    def create_article(self, title, body):
+        return Article.objects.create(
+            title=title, body=body, author=self.user, category=self.category,
+            type='a', status='p')
+
+    def titles(self, results):
+        return sorted(Article.objects.get(pk=r.pk).title for r in results['results'])
+
+    def test_highlight_and_more_like_this(self):
+        result = self.backend.search("深度学习", highlight=True)['results'][0]
+        self.assertIn("<em>深度学习</em>", result.highlighted['text'][0])
+        similar = self.backend.more_like_this(self.articles[0])
+        self.assertEqual(str(self.articles[2].pk), similar['results'][0].pk)
+        self.assertNotIn(str(self.articles[0].pk), [r.pk for r in similar['results']])
+
+    def test_boolean_query(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from haystack.exceptions import SearchBackendError
+        from haystack.query import SQ
+        from djangoblog.memory_backend import MemorySearchQuery
+
+        def search(sq, **kwargs):
+            query = MemorySearchQuery()
+            query.add_filter(sq)
+            return self.titles(self.backend.search(query.build_query(), **kwargs))
+
+        tag = Tag.objects.create(name="调参")
+        self.articles[2].tags.add(tag)
+        self.articles[0].pub_time = timezone.now() - timedelta(days=10)
+        self.backend.update(self.index, [self.articles[0], self.articles[2]])
+
+        self.assertEqual(search(SQ(content="深度学习") & ~SQ(content="入门")), ["神经网络调参"])
+        self.assertEqual(search(SQ(content="入门") | SQ(content="django")), ["Django 教程", "深度学习入门"])
+        self.assertEqual(search(SQ(content="深度学习") & SQ(pub_time__gte=timezone.now() - timedelta(days=1))),
+                         ["神经网络调参"])
+        self.assertEqual(search(SQ(tags__in=["调参", "不存在"])), ["神经网络调参"])
+        self.assertEqual(search(~SQ(tags="调参")), ["Django 教程", "深度学习入门"])
+        self.assertEqual(search(SQ(category=self.category.name) & ~(SQ(content="django") | SQ(content="入门"))),
+                         ["神经网络调参"])
+        self.assertEqual(self.titles(self.backend.search("深度学习", narrow_queries={'tags:"调参"'})),
+                         ["神经网络调参"])
+        self.assertEqual(self.backend.search("*", sort_by=["pub_time"])['results'][0].pk, str(self.articles[0].pk))
+        with self.assertRaises(SearchBackendError):
+            search(SQ(title__fuzzy="django"))
+
+@override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+class MemoryBackendTest(SearchBackendTestMixin, TestCase):
+    def test_skip_document(self):
+        from unittest.mock import patch
+        from haystack.exceptions import SkipDocument
+        article = self.create_article("跳过的文章", "不进入索引")
+        with patch.object(self.index, 'prepare', side_effect=SkipDocument):
+            self.backend.update(self.index, [article])
+        self.assertEqual(self.backend.search("跳过")['hits'], 0)
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from djangoblog import memory_backend
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.path = os.path.join(path, 'index.pickle')
+        self.addCleanup(memory_backend.HOLDERS.pop, self.path, None)
+        super().setUp()
+
+    def get_backend(self):
+        from djangoblog.memory_backend import MemorySearchBackend
+        return MemorySearchBackend('default', PATH=self.path)
+
+    def test_search(self):
+        results = self.backend.search("深度学习")
+        self.assertEqual(self.titles(results), ["深度学习入门", "神经网络调参"])
+        self.assertEqual(results['hits'], 2)
+        # 所有词都要出现
+        self.assertEqual(self.titles(self.backend.search("django 神经")), [])
+        self.assertEqual(self.titles(self.backend.search("DJANGO")), ["Django 教程"])
+        # 标题命中且文档更短的排在前面
+        self.assertEqual(self.backend.search("神经网络")['results'][0].pk, str(self.articles[2].pk))
+
+    def test_incremental_update_and_snapshot(self):
+        from djangoblog import memory_backend
+        self.articles[1].body = "Django 与深度学习"
+        self.backend.update(self.index, [self.articles[1]])
+        self.backend.remove(self.articles[0])
+        self.assertEqual(self.titles(self.backend.search("深度学习")), ["Django 教程", "神经网络调参"])
+
+        # 新进程从快照加载，不访问数据库
+        memory_backend.HOLDERS.pop(self.path)
+        with self.assertNumQueries(0):
+            results = self.get_backend().search("深度学习")
+        self.assertEqual(results['hits'], 2)
+
+    def test_log_replay_and_compaction(self):
+        from unittest.mock import patch
+        from djangoblog import memory_backend
+        holder = memory_backend.HOLDERS.pop(self.path)
+        other = self.get_backend()
+        other.get_index()
+        memory_backend.HOLDERS[self.path] = holder
+        version = holder.version
+
+        # 写入只追加日志，另一个进程查询时读取新增的操作
+        self.backend.remove(self.articles[0])
+        self.assertEqual(holder.version, version)
+        self.assertEqual(self.titles(other.search("深度学习")), ["神经网络调参"])
+        self.assertEqual(other.get_index_generation(), self.backend.get_index_generation())
+
+        with patch.object(memory_backend, 'LOG_COMPACT_RECORDS', 0):
+            self.backend.remove(self.articles[2])
+        self.assertNotEqual(holder.version, version)
+        self.assertFalse(os.path.exists(holder._log_path(version)))
+        # 快照被重写后在后台加载，查询继续使用当前索引
+        with patch.object(other.holder, '_load_in_background') as load:
+            self.assertEqual(self.titles(other.search("深度学习")), ["神经网络调参"])
+            other.holder.loading.join()
+        load.assert_called_once_with()
+        other.holder.loading = None
+        other.holder._load_in_background()
+        self.assertEqual(other.search("深度学习")['hits'], 0)
+
+    def test_snapshot_written_by_other_process(self):
+        from djangoblog import memory_backend
+        holder = memory_backend.HOLDERS.pop(self.path)
+        other = self.get_backend()
+        other.remove(self.articles[2])
+        memory_backend.HOLDERS[self.path] = holder
+        self.assertEqual(self.titles(self.backend.search("深度学习")), ["深度学习入门"])
+
+
+class DatabaseBackendTestMixin(SearchBackendTestMixin):
+    def get_backend(self):
+        from djangoblog.db_backend import DatabaseSearchBackend
+        return DatabaseSearchBackend('default')
+
+    def test_search(self):
+        results = self.backend.search("深度学习")
+        self.assertEqual(self.titles(results), ["深度学习入门", "神经网络调参"])
+        self.assertEqual(results['hits'], 2)
+        self.assertEqual(self.titles(self.backend.search("django 神经")), [])
+        self.assertEqual(self.titles(self.backend.search("DJANGO")), ["Django 教程"])
+        self.assertEqual(self.backend.search("*")['hits'], 3)
+        self.assertEqual(len(self.backend.search("深度学习", start_offset=1, end_offset=2)['results']), 1)
+
+    def test_skip_document(self):
+        from unittest.mock import patch
+        from haystack.exceptions import SkipDocument
+        article = self.create_article("跳过的文章", "不进入索引")
+        with patch.object(self.index, 'prepare', side_effect=SkipDocument):
+            self.backend.update(self.index, [article])
+        self.assertEqual(self.backend.search("跳过")['hits'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the database search backend is only tested on SQLite')
+@override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+class DatabaseBackendTest(DatabaseBackendTestMixin, TestCase):
+    def test_incremental_update_and_rebuild(self):
+        from djangoblog.search_cache import bump_search_version
+        self.articles[1].body = "Django 与深度学习"
+        # 搜索版本在提交后才递增，回滚的写入不会让缓存失效
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.backend.update(self.index, [self.articles[1]])
+        self.assertEqual(callbacks, [bump_search_version])
+        self.backend.remove(self.articles[0])
+        self.assertEqual(self.titles(self.backend.search("深度学习")), ["Django 教程", "神经网络调参"])
+        # 重建后与数据库一致
+        self.assertEqual(self.backend.rebuild(self.index), 3)
+        self.assertEqual(self.titles(self.backend.search("深度学习")), ["深度学习入门", "神经网络调参"])
+
+    def test_index_written_in_save_transaction(self):
+        from unittest.mock import patch
+        from django.db import transaction
+        from djangoblog.models import SearchDocument
+        from haystack import connections
+        # 站点配置的 QueuedSignalProcessor 遇到 transactional 后端时同步写入；
+        # 事务内可见只在 SQLite 上成立，MySQL 的 FULLTEXT 索引提交后才更新
+        with patch.object(connections['default'], 'get_backend', return_value=self.backend):
+            article = self.create_article("事务测试", "只在提交后可见")
+            self.assertEqual(self.titles(self.backend.search("事务测试")), ["事务测试"])
+
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.create_article("回滚文章", "回滚后不应被检索到")
+                    self.assertEqual(self.backend.search("回滚")['hits'], 1)
+                    raise ValueError()
+            self.assertEqual(self.backend.search("回滚")['hits'], 0)
+
+            tag = Tag.objects.create(name="事务标签")
+            article.tags.add(tag)
+            document = SearchDocument.objects.get(identifier='blog.article.%d' % article.pk)
+            self.assertEqual(document.stored['tags'], ["事务标签"])
+
+            article.status = 'd'
+            article.save()
+            self.assertEqual(self.backend.search("事务测试")['hits'], 0)
+
+
+# MySQL 的 FULLTEXT 索引在事务提交后才更新，TestCase 中的事务不会提交，只在 MySQL 上运行
+@skipUnless(connection.vendor == 'mysql', 'the MySQL full-text search path needs a MySQL database')
+@override_settings(SEARCH_RESULT_CACHE_TIMEOUT=0)
+class MySQLDatabaseBackendTest(DatabaseBackendTestMixin, TransactionTestCase):
+    pass
+
+
+class SearchSnapshotTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from haystack import connections
+        from djangoblog import whoosh_cn_backend
+        from djangoblog.search_snapshot import SnapshotStore
+        from djangoblog.whoosh_cn_backend import WhooshSearchBackend
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.store = SnapshotStore(os.path.join(root, 'store'))
+        self.builder = WhooshSearchBackend('default', PATH=os.path.join(root, 'builder'))
+        self.replica = WhooshSearchBackend('default', PATH=os.path.join(root, 'replica'))
+        for backend in (self.builder, self.replica):
+            self.addCleanup(whoosh_cn_backend.SEARCHER_POOLS.pop, backend.path, None)
+        user = BlogUser.objects.create_superuser(
+            email="liangliangyy1@gmail.com",
+            username="liangliangyy1",
+            password="liangliangyy1")
+        category = Category.objects.create(name="snapshot category")
+        self.articles = [
+            Article.objects.create(title="snapshot %d" % i, body="snapshotword %d" % i, author=user,
+                                   category=category, type='a', status='p')
+            for i in range(3)]
+        self.index = connections['default'].get_unified_index().get_index(Article)
+        self.builder.update(self.index, self.articles)
+
+    def publish(self):
+        from unittest.mock import patch
+        from djangoblog.search_snapshot import publish
+        with patch('djangoblog.search_snapshot.get_backend', return_value=self.builder):
+            return publish(self.store, keep=2)
+
+    def pull(self):
+        from unittest.mock import patch
+        from djangoblog.search_snapshot import pull
+        with patch('djangoblog.search_snapshot.get_backend', return_value=self.replica):
+            return pull(self.store)
+
+    def hits(self):
+        return self.replica.search('snapshotword')['hits']
+
+    def test_publish_and_pull(self):
+        manifest = self.publish()
+        self.assertEqual(manifest['version'], self.builder.get_index_generation())
+        self.assertIsNone(self.publish())
+        self.assertEqual(self.pull()['name'], manifest['name'])
+        self.assertIsNone(self.pull())
+        self.assertEqual(self.hits(), 3)
+        # 副本报告与 builder 相同的版本，共享的搜索缓存不会混用
+        self.assertEqual(self.replica.get_index_generation(), manifest['version'])
+
+        # 进行中的查询继续使用旧的 searcher
+        with self.replica.searcher_pool.acquire(self.replica.index) as searcher:
+            self.builder.remove(self.articles[0])
+            self.publish()
+            self.pull()
+            self.assertEqual(searcher.doc_count(), 3)
+        self.assertEqual(self.hits(), 2)
+
+        self.builder.remove(self.articles[1])
+        self.publish()
+        self.assertEqual(len([n for n in os.listdir(self.store.root) if n.startswith('snapshot-')]), 2)
+
+    def test_corrupted_snapshot(self):
+        from djangoblog.search_snapshot import SnapshotError
+        manifest = self.publish()
+        filename = next(name for name in manifest['files'] if name.endswith('.seg'))
+        with open(os.path.join(self.store.path(manifest['name']), filename), 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(SnapshotError):
+            self.pull()
+        self.assertEqual(self.hits(), 0)
@@ -59,4 +59,8 @@ urlpatterns = [
         r'clean',
         views.clean_cache_view,
         name='clean'),
+    path(
+        r'search/suggest',
+        views.search_suggest,
+        name='search_suggest'),
 ]
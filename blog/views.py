@@ -3,9 +3,7 @@ import os
 import uuid
 
 from django.conf import settings
-from django.core.paginator import Paginator
-from django.http import HttpResponse, HttpResponseForbidden
-from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render
 from django.templatetags.static import static
 from django.utils import timezone
@@ -15,7 +13,13 @@ from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 from haystack.views import SearchView
 
+from accounts.models import BlogUser
+from blog.conditional import article_condition, list_condition
+from blog.loaders import ArticleDetailLoader
 from blog.models import Article, Category, LinkShowType, Links, Tag
+from blog.streaming import streaming_template_response
+from blog.suggest import suggest_index
+from blog.surrogate import SIDEBAR_KEY, add_surrogate_keys, article_key, author_key, category_key, tag_key
 from comments.forms import CommentForm
 from djangoblog.plugin_manage import hooks
 from djangoblog.plugin_manage.hook_constants import ARTICLE_CONTENT_HOOK_NAME
@@ -53,6 +57,16 @@ class ArticleListView(ListView):
         """
         raise NotImplementedError()
 
+    def get_list_scope(self):
+        """
+        子类重写.列表标识，用于条件请求的版本号和反向代理的 Surrogate-Key
+        """
+        raise NotImplementedError()
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = list_condition(self.get_list_scope())(super(ArticleListView, self).dispatch)
+        return dispatch(request, *args, **kwargs)
+
     def get_queryset_data(self):
         """
         子类重写.获取queryset的数据
@@ -61,19 +75,18 @@ class ArticleListView(ListView):
 
     def get_queryset_from_cache(self, cache_key):
         '''
-        缓存页面数据
+        缓存页面数据，只缓存文章id，文章及其作者、分类从对象缓存中取出
         :param cache_key: 缓存key
         :return:
         '''
-        value = cache.get(cache_key)
-        if value:
+        ids = cache.get(cache_key)
+        if ids is not None:
             logger.info('get view cache.key:{key}'.format(key=cache_key))
-            return value
         else:
-            article_list = self.get_queryset_data()
-            cache.set(cache_key, article_list)
+            ids = list(self.get_queryset_data().values_list('id', flat=True))
+            cache.set(cache_key, ids)
             logger.info('set view cache.key:{key}'.format(key=cache_key))
-            return article_list
+        return Article.cached.list(ids, select_related=('author', 'category'))
 
     def get_queryset(self):
         '''
@@ -86,7 +99,12 @@ class ArticleListView(ListView):
 
     def get_context_data(self, **kwargs):
         kwargs['linktype'] = self.link_type
-        return super(ArticleListView, self).get_context_data(**kwargs)
+        context = super(ArticleListView, self).get_context_data(**kwargs)
+        add_surrogate_keys(self.request, self.get_list_scope(), SIDEBAR_KEY)
+        # 不分页的归档页包含全部文章，只用列表标识，避免响应头过长
+        if self.paginate_by:
+            add_surrogate_keys(self.request, *(article_key(a.pk) for a in context['article_list']))
+        return context
 
 
 class IndexView(ArticleListView):
@@ -104,7 +122,11 @@ class IndexView(ArticleListView):
         cache_key = 'index_{page}'.format(page=self.page_number)
         return cache_key
 
+    def get_list_scope(self):
+        return 'index'
+
 
+@article_condition()
 class ArticleDetailView(DetailView):
     '''
     文章详情页面
@@ -114,53 +136,62 @@ class ArticleDetailView(DetailView):
     pk_url_kwarg = 'article_id'
     context_object_name = "article"
 
-    def get_context_data(self, **kwargs):
-        comment_form = CommentForm()
+    def get_object(self, queryset=None):
+        article = Article.cached.get_or_404(pk=self.kwargs.get(self.pk_url_kwarg))
+        BlogUser.cached.hydrate([article], 'author')
+        Category.cached.hydrate([article], 'category')
+        return article
 
-        article_comments = self.object.comment_list()
-        parent_comments = article_comments.filter(parent_comment=None)
+    def get_context_data(self, **kwargs):
         blog_setting = get_blog_setting()
-        paginator = Paginator(parent_comments, blog_setting.article_comment_count)
         page = self.request.GET.get('comment_page', '1')
-        if not page.isnumeric():
-            page = 1
-        else:
-            page = int(page)
-            if page < 1:
-                page = 1
-            if page > paginator.num_pages:
-                page = paginator.num_pages
+        page = int(page) if page.isnumeric() else 1
+        self.loader = ArticleDetailLoader(
+            self.object, blog_setting.article_comment_count, comment_page=page)
+        kwargs.update(self.loader.load_head())
+        kwargs['form'] = CommentForm()
+        add_surrogate_keys(self.request, article_key(self.object.pk), SIDEBAR_KEY,
+                           *(category_key(c.slug) for c in self.object.category.get_category_tree()),
+                           *(tag_key(t.slug) for t in kwargs['article_tags']))
 
-        p_comments = paginator.page(page)
+        context = super(ArticleDetailView, self).get_context_data(**kwargs)
+        if not settings.ARTICLE_STREAMING_ENABLED:
+            self.load_body_context(context)
+        return context
+
+    def load_body_context(self, context):
+        """
+        加载评论、上下篇等正文数据并执行插件钩子。
+        流式渲染时在 <head> 输出之后才调用，浏览器可以先加载样式
+        """
+        context.update(self.loader.load_body())
+        p_comments = context['p_comments']
         next_page = p_comments.next_page_number() if p_comments.has_next() else None
         prev_page = p_comments.previous_page_number() if p_comments.has_previous() else None
 
         if next_page:
-            kwargs[
+            context[
                 'comment_next_page_url'] = self.object.get_absolute_url() + f'?comment_page={next_page}#commentlist-container'
         if prev_page:
-            kwargs[
+            context[
                 'comment_prev_page_url'] = self.object.get_absolute_url() + f'?comment_page={prev_page}#commentlist-container'
-        kwargs['form'] = comment_form
-        kwargs['article_comments'] = article_comments
-        kwargs['p_comments'] = p_comments
-        kwargs['comment_count'] = len(
-            article_comments) if article_comments else 0
-
-        kwargs['next_article'] = self.object.next_article
-        kwargs['prev_article'] = self.object.prev_article
-
-        context = super(ArticleDetailView, self).get_context_data(**kwargs)
         article = self.object
-        
+
         # 触发文章详情加载钩子，让插件可以添加额外的上下文数据
         from djangoblog.plugin_manage.hook_constants import ARTICLE_DETAIL_LOAD
         hooks.run_action(ARTICLE_DETAIL_LOAD, article=article, context=context, request=self.request)
-        
+
         # Action Hook, 通知插件"文章详情已获取"
         hooks.run_action('after_article_body_get', article=article, request=self.request)
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        if settings.ARTICLE_STREAMING_ENABLED:
+            return streaming_template_response(
+                self.get_template_names(), context, self.request,
+                deferred=lambda: self.load_body_context(dict(context)))
+        return super(ArticleDetailView, self).render_to_response(context, **response_kwargs)
+
 
 class CategoryDetailView(ArticleListView):
     '''
@@ -170,7 +201,7 @@ class CategoryDetailView(ArticleListView):
 
     def get_queryset_data(self):
         slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
+        category = Category.cached.get_or_404(slug=slug)
 
         categoryname = category.name
         self.categoryname = categoryname
@@ -182,13 +213,16 @@ class CategoryDetailView(ArticleListView):
 
     def get_queryset_cache_key(self):
         slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
+        category = Category.cached.get_or_404(slug=slug)
         categoryname = category.name
         self.categoryname = categoryname
         cache_key = 'category_list_{categoryname}_{page}'.format(
             categoryname=categoryname, page=self.page_number)
         return cache_key
 
+    def get_list_scope(self):
+        return category_key(self.kwargs['category_name'])
+
     def get_context_data(self, **kwargs):
 
         categoryname = self.categoryname
@@ -214,6 +248,9 @@ class AuthorDetailView(ArticleListView):
             author_name=author_name, page=self.page_number)
         return cache_key
 
+    def get_list_scope(self):
+        return author_key(self.kwargs['author_name'])
+
     def get_queryset_data(self):
         author_name = self.kwargs['author_name']
         article_list = Article.objects.filter(
@@ -235,7 +272,7 @@ class TagDetailView(ArticleListView):
 
     def get_queryset_data(self):
         slug = self.kwargs['tag_name']
-        tag = get_object_or_404(Tag, slug=slug)
+        tag = Tag.cached.get_or_404(slug=slug)
         tag_name = tag.name
         self.name = tag_name
         article_list = Article.objects.filter(
@@ -244,13 +281,16 @@ class TagDetailView(ArticleListView):
 
     def get_queryset_cache_key(self):
         slug = self.kwargs['tag_name']
-        tag = get_object_or_404(Tag, slug=slug)
+        tag = Tag.cached.get_or_404(slug=slug)
         tag_name = tag.name
         self.name = tag_name
         cache_key = 'tag_{tag_name}_{page}'.format(
             tag_name=tag_name, page=self.page_number)
         return cache_key
 
+    def get_list_scope(self):
+        return tag_key(self.kwargs['tag_name'])
+
     def get_context_data(self, **kwargs):
         # tag_name = self.kwargs['tag_name']
         tag_name = self.name
@@ -275,6 +315,9 @@ class ArchivesView(ArticleListView):
         cache_key = 'archives'
         return cache_key
 
+    def get_list_scope(self):
+        return 'archives'
+
 
 class LinkListView(ListView):
     model = Links
@@ -285,6 +328,13 @@ class LinkListView(ListView):
 
 
 class EsSearchView(SearchView):
+    def get_results(self):
+        results = super().get_results()
+        # 分类的数量与搜索结果在同一次查询中统计
+        if hasattr(results, 'facet'):
+            results = results.facet('category')
+        return results
+
     def get_context(self):
         paginator, page = self.build_page()
         context = {
@@ -293,9 +343,12 @@ class EsSearchView(SearchView):
             "page": page,
             "paginator": paginator,
             "suggestion": None,
+            "category_facets": [],
         }
         if hasattr(self.results, "query") and self.results.query.backend.include_spelling:
             context["suggestion"] = self.results.query.get_spelling_suggestion()
+        if hasattr(self.results, "facet_counts"):
+            context["category_facets"] = self.results.facet_counts().get('fields', {}).get('category', [])
         context.update(self.extra_context())
 
         return context
@@ -375,6 +428,17 @@ def permission_denied_view(
             'statuscode': '403'}, status=403)
 
 
+def search_suggest(request):
+    """搜索框输入时的建议，支持标题前缀、全拼和拼音首字母"""
+    q = request.GET.get('q', '')[:50]
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 20)
+    except ValueError:
+        limit = 10
+    suggestions = suggest_index.suggest(q, max(limit, 1))
+    return JsonResponse({'query': q, 'suggestions': suggestions})
+
+
 def clean_cache_view(request):
     cache.clear()
     return HttpResponse('ok')
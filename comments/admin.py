@@ -3,13 +3,17 @@ from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
+from djangoblog import invalidation
+
 
 def disable_commentstatus(modeladmin, request, queryset):
     queryset.update(is_enable=False)
+    invalidation.mark_queryset_updated(queryset)
 
 
 def enable_commentstatus(modeladmin, request, queryset):
     queryset.update(is_enable=True)
+    invalidation.mark_queryset_updated(queryset)
 
 
 disable_commentstatus.short_description = _('Disable comments')
@@ -20,6 +20,17 @@ def parse_commenttree(commentlist, comment):
     return datas
 
 
+@register.simple_tag(takes_context=True)
+def get_comment_children(context, comment):
+    """获得当前评论的直接子评论，优先使用详情页加载器建立的父子索引
+        用法: {% get_comment_children comment as childcomments %}
+    """
+    comment_children = context.get('comment_children')
+    if comment_children is not None:
+        return comment_children.get(comment.pk, [])
+    return context['article_comments'].filter(parent_comment=comment)
+
+
 @register.inclusion_tag('comments/tags/comment_item.html')
 def show_comment_item(comment, ischild):
     """评论"""
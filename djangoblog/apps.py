@@ -6,6 +6,8 @@ class DjangoblogAppConfig(AppConfig):
 
     def ready(self):
         super().ready()
+        # 注册信号，管理命令中保存数据同样需要失效缓存
+        from . import blog_signals  # noqa: F401
         # Import and load plugins here
         from .plugin_manage.loader import load_plugins
         load_plugins() 
\ No newline at end of file
@@ -1,4 +1,3 @@
-import _thread
 import logging
 
 import django.dispatch
@@ -6,14 +5,21 @@ from django.conf import settings
 from django.contrib.admin.models import LogEntry
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 
+from blog.conditional import bump_content_versions, get_article_scopes
+from blog.models import Article, BlogSettings, Category, Links, SideBar, Tag
+from blog.neighbor_index import ArticleNeighborIndex
+from blog.suggest import suggest_index
+from blog.surrogate import SIDEBAR_KEY, article_key, category_key, tag_key
 from comments.models import Comment
-from comments.utils import send_comment_email
-from djangoblog.spider_notify import SpiderNotify
-from djangoblog.utils import cache, expire_view_cache, delete_sidebar_cache, delete_view_cache
+from djangoblog import invalidation, search_words
+from djangoblog.proxy_purge import ProxyPurge
+from djangoblog.utils import delete_sidebar_cache
 from djangoblog.utils import get_current_site
+from interaction.models import ArticleLikeCounter, Like
 from oauth.models import OAuthUser
 
 logger = logging.getLogger(__name__)
@@ -73,44 +79,117 @@ def model_post_save_callback(
         using,
         update_fields,
         **kwargs):
-    clearcache = False
+    # 只登记失效，事务提交后由 invalidation 合并执行一次
     if isinstance(instance, LogEntry):
         return
     if 'get_full_url' in dir(instance):
         is_update_views = update_fields == {'views'}
-        if not settings.TESTING and not is_update_views:
-            try:
-                notify_url = instance.get_full_url()
-                SpiderNotify.baidu_notify([notify_url])
-            except Exception as ex:
-                logger.error("notify sipder", ex)
         if not is_update_views:
-            clearcache = True
+            invalidation.mark_changed(instance)
 
     if isinstance(instance, Comment):
         if instance.is_enable:
-            path = instance.article.get_absolute_url()
-            site = get_current_site().domain
-            if site.find(':') > 0:
-                site = site[0:site.find(':')]
-
-            expire_view_cache(
-                path,
-                servername=site,
-                serverport=80,
-                key_prefix='blogdetail')
-            if cache.get('seo_processor'):
-                cache.delete('seo_processor')
-            comment_cache_key = 'article_comments_{id}'.format(
-                id=instance.article.id)
-            cache.delete(comment_cache_key)
-            delete_sidebar_cache()
-            delete_view_cache('article_comments', [str(instance.article.pk)])
-
-            _thread.start_new_thread(send_comment_email, (instance,))
-
-    if clearcache:
-        cache.clear()
+            invalidation.mark_comment(instance)
+
+    # 分类、标签和站点配置出现在侧边栏中，修改后清除反向代理上的相关页面
+    if isinstance(instance, Category):
+        ProxyPurge.purge([category_key(instance.slug), SIDEBAR_KEY])
+    elif isinstance(instance, Tag):
+        ProxyPurge.purge([tag_key(instance.slug), SIDEBAR_KEY])
+    elif isinstance(instance, (BlogSettings, SideBar, Links)):
+        ProxyPurge.purge([SIDEBAR_KEY])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def search_word_post_save_callback(sender, instance, **kwargs):
+    # 标签、分类名称加入分词词典
+    name = instance.name
+    transaction.on_commit(lambda: search_words.add_word(name))
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def suggest_post_save_callback(sender, instance, update_fields, **kwargs):
+    # 浏览量变化等下次重建时再同步
+    if update_fields == {'views'}:
+        return
+    if sender is Article:
+        transaction.on_commit(lambda: suggest_index.update_article(instance))
+    else:
+        transaction.on_commit(lambda: suggest_index.update_term(instance))
+
+
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def suggest_post_delete_callback(sender, instance, **kwargs):
+    # 提交时 instance.pk 已被置空
+    model_name, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: suggest_index.remove(model_name, pk))
+
+
+@receiver(pre_save, sender=Article)
+def article_pre_save_callback(sender, instance, update_fields, **kwargs):
+    # 记录保存前的发布状态，用于增量维护上一篇/下一篇索引
+    instance._neighbor_state = None
+    if instance.pk and update_fields != {'views'}:
+        instance._neighbor_state = Article.objects.filter(pk=instance.pk).values_list(
+            'status', 'type', 'category_id').first()
+
+
+@receiver(post_save, sender=Article)
+def article_post_save_callback(sender, instance, update_fields, **kwargs):
+    if update_fields == {'views'}:
+        return
+    old_state = getattr(instance, '_neighbor_state', None)
+    ArticleNeighborIndex.update(instance, old_state)
+    # 更新文章页及相关列表页的版本，使其ETag失效；草稿不出现在列表中
+    old_published = old_state is not None and old_state[0] == 'p'
+    if old_published or instance.status == 'p':
+        old_category_ids = [old_state[2]] if old_state is not None else []
+        scopes = get_article_scopes(instance, category_ids=old_category_ids)
+        bump_content_versions(scopes)
+        ProxyPurge.purge(scopes | {SIDEBAR_KEY})
+    else:
+        bump_content_versions([article_key(instance.pk)])
+
+
+@receiver(post_delete, sender=Article)
+def article_post_delete_callback(sender, instance, **kwargs):
+    if instance.status == 'p':
+        ArticleNeighborIndex.touch(instance.type, instance.category_id)
+        scopes = get_article_scopes(instance, tag_slugs=[])
+        bump_content_versions(scopes)
+        ProxyPurge.purge(scopes | {SIDEBAR_KEY})
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed_callback(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse or not isinstance(instance, Article) or instance.status != 'p':
+        return
+    if action in ('post_add', 'post_remove') and pk_set:
+        slugs = Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+    elif action == 'pre_clear':
+        slugs = instance.tags.values_list('slug', flat=True)
+    else:
+        return
+    scopes = {tag_key(slug) for slug in slugs}
+    bump_content_versions(scopes)
+    ProxyPurge.purge(scopes)
+
+
+@receiver(post_save, sender=Like)
+def like_post_save_callback(sender, instance, created, **kwargs):
+    # 点赞数在点赞的同一事务中增减
+    if created:
+        ArticleLikeCounter.adjust(instance.article_id, 1)
+
+
+@receiver(post_delete, sender=Like)
+def like_post_delete_callback(sender, instance, **kwargs):
+    ArticleLikeCounter.adjust(instance.article_id, -1)
 
 
 @receiver(user_logged_in)
@@ -0,0 +1,341 @@
+import json
+import logging
+import warnings
+from collections import Counter
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.encoding import force_str
+from haystack.backends import BaseEngine, BaseSearchBackend, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+from djangoblog.memory_backend import MLT_TERMS, MemorySearchQuery, highlight, parse_query, query_texts, tokenize
+from djangoblog.models import FTS_TABLE, SearchDocument
+from djangoblog.search_cache import bump_search_version, cache_search_results
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TABLE = SearchDocument._meta.db_table
+COMPARISONS = {'exact': '=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _quote(word):
+    return '"%s"' % word.replace('"', ' ')
+
+
+def _like_escape(value):
+    return value.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    '''
+    数据库全文检索后端，索引保存在与文章相同的数据库中：
+    SQLite 使用 FTS5 虚拟表（中文预先切成 bigram），MySQL 使用 ngram 解析器的 FULLTEXT 索引。
+    保存对象时在同一个事务中更新索引，提交后搜索结果与数据库一致。
+    SQLite 的 FTS5 表在事务内即可查到新文档；MySQL 的 FULLTEXT 索引在提交时才更新，事务内查不到
+    '''
+    # QueuedSignalProcessor 看到此标记时在保存的事务中直接写入，不经过后台队列
+    transactional = True
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        if connection.vendor not in ('sqlite', 'mysql'):
+            raise ImproperlyConfigured(
+                'The database search backend supports SQLite and MySQL, not %s.' % connection.vendor)
+
+    @property
+    def content_field_name(self):
+        from haystack import connections
+        return connections[self.connection_alias].get_unified_index().document_field
+
+    def update(self, index, iterable, commit=True):
+        with transaction.atomic():
+            for obj in iterable:
+                try:
+                    doc = index.full_prepare(obj)
+                except SkipDocument:
+                    logger.debug(u"Indexing for object `%s` skipped", obj)
+                    continue
+                text = force_str(doc.pop(self.content_field_name, '') or '')
+                stored = json.loads(json.dumps(doc, cls=DjangoJSONEncoder))
+                document, created = SearchDocument.objects.update_or_create(
+                    identifier=doc[ID],
+                    defaults={'django_ct': doc[DJANGO_CT], 'django_id': doc[DJANGO_ID],
+                              'text': text, 'stored': stored})
+                if connection.vendor == 'sqlite':
+                    with connection.cursor() as cursor:
+                        cursor.execute('DELETE FROM {fts} WHERE rowid = %s'.format(fts=FTS_TABLE), [document.pk])
+                        cursor.execute('INSERT INTO {fts} (rowid, tokens) VALUES (%s, %s)'.format(fts=FTS_TABLE),
+                                       [document.pk, ' '.join(tokenize(text))])
+        transaction.on_commit(bump_search_version)
+
+    def _delete(self, documents):
+        with transaction.atomic():
+            if connection.vendor == 'sqlite':
+                ids = list(documents.values_list('pk', flat=True))
+                if ids:
+                    with connection.cursor() as cursor:
+                        cursor.execute('DELETE FROM {fts} WHERE rowid IN ({ids})'.format(
+                            fts=FTS_TABLE, ids=', '.join(['%s'] * len(ids))), ids)
+            documents.delete()
+        transaction.on_commit(bump_search_version)
+
+    def remove(self, obj_or_string, commit=True):
+        self._delete(SearchDocument.objects.filter(identifier=get_identifier(obj_or_string)))
+
+    def clear(self, models=None, commit=True):
+        documents = SearchDocument.objects.all()
+        if models:
+            documents = documents.filter(django_ct__in=[get_model_ct(model) for model in models])
+        self._delete(documents)
+
+    def rebuild(self, index, procs=None, chunk_size=500, **kwargs):
+        """build_index 命令调用，在一个事务中清空并重建该模型的索引"""
+        count = 0
+        with transaction.atomic():
+            self.clear(models=[index.get_model()])
+            queryset = index.index_queryset(using=self.connection_alias).order_by('pk')
+            for start in range(0, queryset.count(), chunk_size):
+                objects = list(queryset[start:start + chunk_size])
+                self.update(index, objects)
+                count += len(objects)
+        return count
+
+    def get_index_generation(self):
+        """索引随数据库事务提交，只依赖写入时递增的搜索版本"""
+        return None
+
+    def _model_choices(self, models, limit_to_registered_models):
+        if models:
+            return sorted(get_model_ct(model) for model in models)
+        if limit_to_registered_models is None:
+            from django.conf import settings
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        if limit_to_registered_models:
+            return self.build_models_list()
+        return []
+
+    def _match(self, text, any_word=False):
+        """
+        全文检索条件
+        :return: (SQL 片段, 参数, 得分表达式, 得分参数)，没有可检索的词时返回 None
+        """
+        if connection.vendor == 'sqlite':
+            tokens = list(dict.fromkeys(tokenize(text)))
+            if not tokens:
+                return None
+            query = (' OR ' if any_word else ' ').join(_quote(token) for token in tokens)
+            return ('d.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)'.format(fts=FTS_TABLE), [query],
+                    '(SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = d.id)'.format(fts=FTS_TABLE),
+                    [query])
+        words = text.split()
+        if not words:
+            return None
+        query = ' '.join(_quote(word) if any_word else '+' + _quote(word) for word in words)
+        return ('MATCH(d.text) AGAINST (%s IN BOOLEAN MODE)', [query],
+                'MATCH(d.text) AGAINST (%s IN BOOLEAN MODE)', [query])
+
+    def _is_multivalued(self, field):
+        from haystack import connections
+        search_field = connections[self.connection_alias].get_unified_index().all_searchfields().get(field)
+        return search_field is not None and search_field.is_multivalued
+
+    @staticmethod
+    def _like_patterns(filter_type, value):
+        """content、contains、startswith 条件对应的 LIKE 模式，content 中没有可检索的词时返回 None"""
+        if filter_type == 'content':
+            terms = list(dict.fromkeys(tokenize(value)))
+            return ['%' + _like_escape(term) + '%' for term in terms] or None
+        if filter_type == 'contains':
+            return ['%' + _like_escape(force_str(value)) + '%']
+        return [_like_escape(force_str(value)) + '%']
+
+    def _value_condition(self, value_sql, text_sql, expr_params, filter_type, value):
+        """
+        单个取值的比较条件
+        :param value_sql: 用于比较的取值表达式
+        :param text_sql: 用于 LIKE 的文本表达式
+        :param expr_params: 表达式中的参数，每次引用表达式时重复
+        """
+        if filter_type in COMPARISONS:
+            return '%s %s %%s' % (value_sql, COMPARISONS[filter_type]), expr_params + [value]
+        if filter_type == 'in':
+            if not value:
+                return '1 = 0', []
+            return (' OR '.join(['%s = %%s' % value_sql] * len(value)),
+                    [p for v in value for p in expr_params + [v]])
+        if filter_type == 'range':
+            start, end = value
+            return '%s BETWEEN %%s AND %%s' % value_sql, expr_params + [start, end]
+        patterns = self._like_patterns(filter_type, value)
+        if patterns is None:
+            return '%s = %%s' % value_sql, expr_params + [value]
+        return (' AND '.join(["%s LIKE %%s ESCAPE '!'" % text_sql] * len(patterns)),
+                [p for pattern in patterns for p in expr_params + [pattern]])
+
+    def _field_condition(self, field, filter_type, value):
+        """字段条件，作用于 stored 中保存的 JSON；多值字段任意一个值满足即可"""
+        path = '$.%s' % field
+        if connection.vendor == 'sqlite':
+            # json_each 对标量返回一行，对数组逐个元素返回
+            sql, params = self._value_condition('value', 'value', [], filter_type, value)
+            return 'EXISTS (SELECT 1 FROM json_each(d.stored, %s) WHERE {sql})'.format(sql=sql), [path] + params
+        if not self._is_multivalued(field):
+            return self._value_condition('JSON_EXTRACT(d.stored, %s)', 'JSON_UNQUOTE(JSON_EXTRACT(d.stored, %s))',
+                                         [path], filter_type, value)
+        if filter_type in ('exact', 'in'):
+            values = value if filter_type == 'in' else [value]
+            if not values:
+                return '1 = 0', []
+            return (' OR '.join(['JSON_CONTAINS(d.stored, %s, %s)'] * len(values)),
+                    [p for v in values for p in (json.dumps(v, cls=DjangoJSONEncoder), path)])
+        if filter_type in ('contains', 'startswith', 'content'):
+            patterns = self._like_patterns(filter_type, value) or [_like_escape(force_str(value))]
+            return (' AND '.join(["JSON_SEARCH(d.stored, 'one', %s, '!', %s) IS NOT NULL"] * len(patterns)),
+                    [p for pattern in patterns for p in (pattern, path + '[*]')])
+        raise SearchBackendError('The database backend does not support {filter_type} filters on the '
+                                 'multi-valued field {field} with MySQL.'.format(filter_type=filter_type, field=field))
+
+    def _compile(self, node):
+        """
+        把 parse_query 生成的语法树转为 SQL 条件
+        :return: (SQL 片段, 参数)
+        """
+        kind = node[0]
+        if kind == 'all':
+            return '1 = 1', []
+        if kind == 'text':
+            match = self._match(node[1])
+            return (match[0], match[1]) if match else ('1 = 0', [])
+        if kind == 'field':
+            return self._field_condition(*node[1:])
+        if kind == 'not':
+            sql, params = self._compile(node[1])
+            return 'NOT (%s)' % sql, params
+        parts = [self._compile(child) for child in node[1]]
+        connector = ' AND ' if kind == 'and' else ' OR '
+        return (connector.join('(%s)' % sql for sql, params in parts),
+                [p for sql, params in parts for p in params])
+
+    def _order_by(self, sort_by):
+        json_extract = 'json_extract' if connection.vendor == 'sqlite' else 'JSON_EXTRACT'
+        orders = []
+        params = []
+        for order_by in sort_by or ():
+            field = order_by.lstrip('-')
+            direction = 'DESC' if order_by.startswith('-') else 'ASC'
+            if field == 'score':
+                orders.append('score %s' % direction)
+            else:
+                orders.append('%s(d.stored, %%s) %s' % (json_extract, direction))
+                params.append('$.%s' % field)
+        orders.extend(['score DESC', 'd.id DESC'])
+        return ', '.join(orders), params
+
+    def _run(self, condition, score, model_choices, start_offset, end_offset, exclude=None, sort_by=None):
+        """
+        执行检索
+        :param condition: (SQL 条件, 参数)
+        :param score: (得分表达式, 参数)
+        :return: ([(文档, 得分)], 命中数)
+        """
+        where = ['(%s)' % condition[0]]
+        params = list(condition[1])
+        if model_choices:
+            where.append('d.django_ct IN ({cts})'.format(cts=', '.join(['%s'] * len(model_choices))))
+            params.extend(model_choices)
+        if exclude is not None:
+            where.append('d.id <> %s')
+            params.append(exclude)
+        where_sql = ' AND '.join(where)
+        order_sql, order_params = self._order_by(sort_by)
+        limit = -1 if end_offset is None else end_offset - start_offset
+        if connection.vendor == 'mysql' and limit < 0:
+            limit = 18446744073709551615
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM {table} d WHERE {where}'.format(
+                table=DOCUMENT_TABLE, where=where_sql), params)
+            hits = cursor.fetchone()[0]
+            cursor.execute('SELECT d.id, {score} AS score FROM {table} d WHERE {where} '
+                           'ORDER BY {order} LIMIT %s OFFSET %s'.format(
+                               score=score[0], table=DOCUMENT_TABLE, where=where_sql, order=order_sql),
+                           list(score[1]) + params + order_params + [limit, start_offset])
+            rows = cursor.fetchall()
+        documents = SearchDocument.objects.in_bulk([pk for pk, score in rows])
+        return [(documents[pk], score or 0) for pk, score in rows if pk in documents], hits
+
+    def _to_result(self, document, score, terms, result_class):
+        app_label, model_name = document.django_ct.split('.')
+        additional_fields = {k: v for k, v in document.stored.items() if k not in (ID, DJANGO_CT, DJANGO_ID)}
+        additional_fields[self.content_field_name] = document.text
+        if terms:
+            additional_fields['highlighted'] = {self.content_field_name: [highlight(document.text, terms)]}
+        return (result_class or SearchResult)(app_label, model_name, document.django_id, score, **additional_fields)
+
+    @log_query
+    @cache_search_results
+    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None, fields='',
+               highlight=False, facets=None, date_facets=None, query_facets=None, narrow_queries=None,
+               spelling_query=None, models=None, limit_to_registered_models=None, result_class=None,
+               **kwargs):
+        query_string = force_str(query_string).strip()
+        if not query_string:
+            return {'results': [], 'hits': 0}
+
+        # 搜索结果页总是请求分类统计，字段统计直接忽略，只对无法处理的日期、查询统计给出警告
+        if date_facets or query_facets:
+            warnings.warn("The database backend does not handle date or query faceting.", Warning, stacklevel=2)
+
+        node = parse_query(query_string)
+        if node is None:
+            return {'results': [], 'hits': 0}
+        # narrow query 之间是 AND 关系
+        node = ('and', [node] + [n for n in map(parse_query, narrow_queries or ()) if n is not None])
+        text = ' '.join(query_texts(node))
+        match = self._match(text, any_word=True)
+        score = (match[2], match[3]) if match else ('0', [])
+        model_choices = self._model_choices(models, limit_to_registered_models)
+        rows, hits = self._run(self._compile(node), score, model_choices, start_offset, end_offset,
+                               sort_by=sort_by)
+        terms = list(tokenize(text)) if highlight else None
+        return {
+            'results': [self._to_result(document, score, terms, result_class) for document, score in rows],
+            'hits': hits,
+            'spelling_suggestion': None,
+        }
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0,
+                       end_offset=None, models=None, limit_to_registered_models=None,
+                       result_class=None, **kwargs):
+        document = SearchDocument.objects.filter(identifier=get_identifier(model_instance)).first()
+        if document is None:
+            return {'results': [], 'hits': 0}
+        if connection.vendor == 'sqlite':
+            # 出现次数最多的词
+            text = ' '.join(term for term, count in Counter(tokenize(document.text)).most_common(MLT_TERMS))
+        else:
+            text = ' '.join(document.text.split()[:MLT_TERMS])
+        match = self._match(text, any_word=True)
+        if match is None:
+            return {'results': [], 'hits': 0}
+        condition = (match[0], match[1])
+        node = parse_query(additional_query_string or '')
+        if node is not None:
+            sql, params = self._compile(node)
+            condition = ('({match}) AND ({sql})'.format(match=match[0], sql=sql), match[1] + params)
+        model_choices = self._model_choices(models or [type(model_instance)], limit_to_registered_models)
+        rows, hits = self._run(condition, (match[2], match[3]), model_choices, start_offset, end_offset,
+                               exclude=document.pk)
+        return {
+            'results': [self._to_result(d, score, None, result_class) for d, score in rows],
+            'hits': hits,
+        }
+
+
+class DatabaseEngine(BaseEngine):
+    backend = DatabaseSearchBackend
+    query = MemorySearchQuery
@@ -1,3 +1,6 @@
+import time
+
+from django.conf import settings
 from django.utils.encoding import force_str
 from elasticsearch_dsl import Q
 from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
@@ -6,7 +9,7 @@ from haystack.models import SearchResult
 from haystack.utils import log as logging
 
 from blog.documents import ArticleDocument, ArticleDocumentManager
-from blog.models import Article
+from djangoblog.search_cache import bump_search_version, cache_search_results
 
 logger = logging.getLogger(__name__)
 
@@ -20,16 +23,18 @@ class ElasticSearchBackend(BaseSearchBackend):
             **connection_options)
         self.manager = ArticleDocumentManager()
         self.include_spelling = True
+        # 最近一次读取的索引代数及读取时间
+        self.generation = None
+        self.generation_time = 0
 
     def _get_models(self, iterable):
-        models = iterable if iterable and iterable[0] else Article.objects.all()
+        models = iterable if iterable and iterable[0] else self.manager.get_queryset()
         docs = self.manager.convert_to_doc(models)
         return docs
 
     def _create(self, models):
         self.manager.create_index()
-        docs = self._get_models(models)
-        self.manager.rebuild(docs)
+        self.manager.rebuild(models or None)
 
     def _delete(self, models):
         for m in models:
@@ -37,7 +42,7 @@ class ElasticSearchBackend(BaseSearchBackend):
         return True
 
     def _rebuild(self, models):
-        models = models if models else Article.objects.all()
+        models = models if models else self.manager.get_queryset()
         docs = self.manager.convert_to_doc(models)
         self.manager.update_docs(docs)
 
@@ -45,14 +50,29 @@ class ElasticSearchBackend(BaseSearchBackend):
 
         models = self._get_models(iterable)
         self.manager.update_docs(models)
+        bump_search_version()
 
     def remove(self, obj_or_string):
         models = self._get_models([obj_or_string])
         self._delete(models)
+        bump_search_version()
 
     def clear(self, models=None, commit=True):
         self.remove(None)
 
+    def get_index_generation(self):
+        """
+        从索引统计中读取代数，其他进程或 build_index 的写入同样会使结果缓存失效，
+        不依赖缓存是否在进程间共享。
+        统计结果在本进程中保留 SEARCH_INDEX_GENERATION_TTL 秒，不必每次搜索都请求一次；
+        本进程的写入通过搜索版本立即失效，其他进程的写入最多延迟这段时间
+        """
+        now = time.monotonic()
+        if self.generation is None or now - self.generation_time >= settings.SEARCH_INDEX_GENERATION_TTL:
+            self.generation = self.manager.get_generation()
+            self.generation_time = now
+        return self.generation
+
     @staticmethod
     def get_suggestion(query: str) -> str:
         """获取推荐词, 如果没有找到添加原搜索词"""
@@ -61,9 +81,12 @@ class ElasticSearchBackend(BaseSearchBackend):
             .query("match", body=query) \
             .suggest('suggest_search', query, term={'field': 'body'}) \
             .execute()
+        return ElasticSearchBackend.parse_suggestion(search)
 
+    @staticmethod
+    def parse_suggestion(response) -> str:
         keywords = []
-        for suggest in search.suggest.suggest_search:
+        for suggest in response.suggest.suggest_search:
             if suggest["options"]:
                 keywords.append(suggest["options"][0]["text"])
             else:
@@ -71,30 +94,38 @@ class ElasticSearchBackend(BaseSearchBackend):
 
         return ' '.join(keywords)
 
+    @staticmethod
+    def build_search(query):
+        q = Q('bool',
+              should=[Q('match', body=query), Q('match', title=query)],
+              minimum_should_match="70%")
+
+        return ArticleDocument.search() \
+            .query('bool', filter=[q]) \
+            .filter('term', status='p') \
+            .filter('term', type='a') \
+            .source(False)
+
     @log_query
+    @cache_search_results
     def search(self, query_string, **kwargs):
         logger.info('search query_string:' + query_string)
 
         start_offset = kwargs.get('start_offset')
         end_offset = kwargs.get('end_offset')
 
-        # 推荐词搜索
+        search = self.build_search(query_string)[start_offset: end_offset]
+        suggestion = query_string
         if getattr(self, "is_suggest", None):
-            suggestion = self.get_suggestion(query_string)
+            # 推荐词与搜索在同一个请求中返回，大多数查询不需要纠正，只有推荐词不同时才再搜索一次
+            results = search.suggest('suggest_search', query_string, term={'field': 'body'}).execute()
+            if any(suggest["options"] for suggest in results.suggest.suggest_search):
+                suggestion = self.parse_suggestion(results)
+            if suggestion != query_string:
+                results = self.build_search(suggestion)[start_offset: end_offset].execute()
         else:
-            suggestion = query_string
-
-        q = Q('bool',
-              should=[Q('match', body=suggestion), Q('match', title=suggestion)],
-              minimum_should_match="70%")
-
-        search = ArticleDocument.search() \
-                     .query('bool', filter=[q]) \
-                     .filter('term', status='p') \
-                     .filter('term', type='a') \
-                     .source(False)[start_offset: end_offset]
+            results = search.execute()
 
-        results = search.execute()
         hits = results['hits'].total
         raw_results = []
         for raw_result in results['hits']['hits']:
@@ -0,0 +1,184 @@
+import _thread
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Invalidation:
+    '''
+    一批待执行的缓存失效和副作用
+    保存信号只登记脏数据，事务提交后统一去重执行一次：
+    百度推送合并为一次请求，缓存只清空一次，邮件在同一个线程里发送。
+    只合并同一事务（或 batch 代码块）中的登记，自动提交模式下每次保存各自执行一次；
+    事务回滚时登记一并丢弃，内层保存点回滚时其中的登记仍随外层事务执行，
+    多出的只是缓存失效，回滚掉的评论不会发送邮件
+    '''
+
+    def __init__(self):
+        # 是否已登记提交回调
+        self.scheduled = False
+        self.notify_urls = []
+        self.clear_cache = False
+        self.sidebar = False
+        self.article_paths = set()
+        self.comment_article_ids = set()
+        self.comments = {}
+        self.purge_keys = set()
+
+    def run(self):
+        """提交回调，同一事务中登记的多个回调只有第一个执行"""
+        if getattr(_local, 'pending', None) is self:
+            _local.pending = None
+            self.flush()
+
+    def flush(self):
+        from djangoblog.proxy_purge import ProxyPurge
+        from djangoblog.spider_notify import SpiderNotify
+        from djangoblog.utils import cache, delete_sidebar_cache, delete_view_cache, expire_view_cache
+        from djangoblog.utils import get_current_site
+        from blog.page_cache import expire_page_cache
+
+        if self.notify_urls:
+            SpiderNotify.baidu_notify(list(dict.fromkeys(self.notify_urls)))
+        if self.article_paths:
+            site = get_current_site().domain
+            if site.find(':') > 0:
+                site = site[0:site.find(':')]
+            for path in self.article_paths:
+                expire_view_cache(path, servername=site, serverport=80, key_prefix='blogdetail')
+                expire_page_cache(path)
+        if self.comment_article_ids:
+            if cache.get('seo_processor'):
+                cache.delete('seo_processor')
+            cache.delete_many(['article_comments_{id}'.format(id=i) for i in self.comment_article_ids])
+            delete_view_cache('article_comments', [str(i) for i in self.comment_article_ids])
+        if self.sidebar:
+            delete_sidebar_cache()
+        if self.purge_keys:
+            _thread.start_new_thread(ProxyPurge.purge_keys, (set(self.purge_keys),))
+        if self.comments:
+            from comments.models import Comment
+            # 内层保存点回滚的评论已不存在，不发送邮件
+            existing = set(Comment.objects.filter(pk__in=list(self.comments)).values_list('pk', flat=True))
+            comments = [comment for pk, comment in self.comments.items() if pk in existing]
+            if comments:
+                _thread.start_new_thread(_send_comment_emails, (comments,))
+        if self.clear_cache:
+            cache.clear()
+
+
+def _send_comment_emails(comments):
+    from comments.utils import send_comment_email
+    for comment in comments:
+        try:
+            send_comment_email(comment)
+        except Exception as e:
+            logger.error(e)
+
+
+def _schedule():
+    """
+    登记提交回调，不在事务中时立即执行。
+    每次登记都注册回调，内层保存点回滚只丢弃其中登记的回调，其余的回调仍会执行
+    """
+    if getattr(_local, 'depth', 0):
+        return
+    _local.pending.scheduled = True
+    transaction.on_commit(_local.pending.run)
+
+
+def _pending():
+    pending = getattr(_local, 'pending', None)
+    # 不在事务中时提交回调会立即执行；已登记却仍未执行，说明回调随事务回滚被丢弃，回滚的修改不需要失效
+    if pending is not None and pending.scheduled and not transaction.get_connection().in_atomic_block:
+        pending = None
+    if pending is None:
+        pending = _local.pending = Invalidation()
+    return pending
+
+
+@contextmanager
+def batch():
+    """
+    在代码块结束（所在事务提交）后才执行失效，用于管理命令等连续保存大量对象的场景
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth and getattr(_local, 'pending', None) is not None:
+            _schedule()
+
+
+def mark_changed(instance):
+    """带有 get_full_url 的对象被修改：推送搜索引擎并清空缓存"""
+    pending = _pending()
+    if not settings.TESTING:
+        try:
+            pending.notify_urls.append(instance.get_full_url())
+        except Exception as e:
+            logger.error(e)
+    pending.clear_cache = True
+    _schedule()
+
+
+def mark_comment(comment, send_email=True):
+    """已启用的评论被修改：失效所在文章的页面和评论缓存，并给评论者发邮件"""
+    from blog.surrogate import SIDEBAR_KEY, article_key
+    pending = _pending()
+    pending.article_paths.add(comment.article.get_absolute_url())
+    pending.comment_article_ids.add(comment.article_id)
+    pending.sidebar = True
+    pending.purge_keys.update((article_key(comment.article_id), SIDEBAR_KEY))
+    if send_email:
+        pending.comments[comment.pk] = comment
+    _schedule()
+
+
+def mark_sidebar():
+    _pending().sidebar = True
+    _schedule()
+
+
+def purge(keys):
+    """登记反向代理需要清除的 Surrogate-Key"""
+    _pending().purge_keys.update(keys)
+    _schedule()
+
+
+def mark_queryset_updated(queryset):
+    """
+    queryset.update 不触发保存信号，批量修改后需显式调用，
+    按模型补上与逐个保存相同的失效
+    """
+    from blog.conditional import bump_site_version
+    from blog.models import Article
+    from blog.neighbor_index import ArticleNeighborIndex
+    from blog.surrogate import SIDEBAR_KEY, article_key
+    from comments.models import Comment
+
+    model = queryset.model
+    cached = getattr(model, 'cached', None)
+    if cached is not None:
+        cached.invalidate_all()
+    pending = _pending()
+    if model is Article:
+        ArticleNeighborIndex.invalidate()
+        bump_site_version()
+        pending.purge_keys.update(article_key(pk) for pk in queryset.values_list('pk', flat=True))
+        pending.purge_keys.add(SIDEBAR_KEY)
+        pending.clear_cache = True
+    elif model is Comment:
+        for comment in queryset.select_related('article'):
+            mark_comment(comment, send_email=False)
+    elif hasattr(model, 'get_full_url'):
+        pending.clear_cache = True
+    _schedule()
@@ -0,0 +1,850 @@
+import heapq
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import warnings
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import force_str
+from django.utils.html import escape
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID, FILTER_SEPARATOR, ID, VALID_FILTERS
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+from djangoblog.search_cache import bump_search_version, cache_search_results
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 中文连续片段与英文、数字单词
+TOKEN_RE = re.compile(r'[一-鿿]+|[a-z0-9_]+')
+# 查询中的字段条件，如 category_exact:"python"、pub_time__gte:"2024-01-01T00:00:00"
+FIELD_RE = re.compile(r'(\w+):(?=[^\s)])')
+WORD_RE = re.compile(r'[^\s()"]+')
+OPERATORS = ('AND', 'OR', 'NOT')
+MATCH_ALL = ('*', '*:*')
+JSON_DECODER = json.JSONDecoder()
+# BM25 参数
+K1 = 1.2
+B = 0.75
+MLT_TERMS = 10
+# 增量日志超过这么多条操作时重写快照
+LOG_COMPACT_RECORDS = 1000
+HIGHLIGHT_LENGTH = 200
+
+
+def _is_cjk(text):
+    return '一' <= text[0] <= '鿿'
+
+
+def tokenize(text):
+    """英文、数字按单词切分；中文不依赖分词词典，切成相邻两字的 bigram"""
+    for run in TOKEN_RE.findall(force_str(text).lower()):
+        if _is_cjk(run) and len(run) > 1:
+            for i in range(len(run) - 1):
+                yield run[i:i + 2]
+        else:
+            yield run
+
+
+def _read_value(query_string, pos):
+    """字段值可以是 JSON（字符串、数字、列表），也可以是不带引号的单词"""
+    try:
+        value, end = JSON_DECODER.raw_decode(query_string, pos)
+    except ValueError:
+        if query_string[pos] in '"[':
+            raise SearchBackendError('Malformed value in query: %s' % query_string)
+    else:
+        if end == len(query_string) or query_string[end] in ' \t\r\n()':
+            return value, end
+    match = WORD_RE.match(query_string, pos)
+    return match.group(), match.end()
+
+
+def _split_field(name):
+    parts = name.split(FILTER_SEPARATOR)
+    if len(parts) > 1 and parts[-1] in VALID_FILTERS:
+        field, filter_type = FILTER_SEPARATOR.join(parts[:-1]), parts[-1]
+    else:
+        field, filter_type = name, 'exact'
+    if filter_type == 'fuzzy':
+        raise SearchBackendError('Fuzzy filters are not supported by this search backend.')
+    return field, filter_type
+
+
+def _lex(query_string):
+    tokens = []
+    pos = 0
+    while pos < len(query_string):
+        char = query_string[pos]
+        if char.isspace():
+            pos += 1
+        elif char in '()':
+            tokens.append((char, None))
+            pos += 1
+        elif char == '"':
+            value, pos = _read_value(query_string, pos)
+            tokens.append(('text', value))
+        else:
+            match = FIELD_RE.match(query_string, pos)
+            if match:
+                value, pos = _read_value(query_string, match.end())
+                tokens.append(('field', _split_field(match.group(1)) + (value,)))
+                continue
+            match = WORD_RE.match(query_string, pos)
+            word = match.group()
+            pos = match.end()
+            if word in OPERATORS:
+                tokens.append((word, None))
+            elif word in MATCH_ALL:
+                tokens.append(('all', None))
+            else:
+                tokens.append(('text', word))
+    return tokens
+
+
+def _combine(kind, children):
+    children = [child for child in children if child is not None]
+    if len(children) > 1:
+        return (kind, children)
+    return children[0] if children else None
+
+
+class _QueryParser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def parse(self):
+        nodes = []
+        while self.peek() is not None:
+            # 多余的右括号直接忽略
+            if self.peek() == ')':
+                self.pos += 1
+                continue
+            nodes.append(self.parse_or())
+        return _combine('and', nodes)
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.pos += 1
+            children.append(self.parse_and())
+        return _combine('or', children)
+
+    def parse_and(self):
+        children = []
+        while self.peek() not in (None, ')', 'OR'):
+            if self.peek() == 'AND':
+                self.pos += 1
+                continue
+            children.append(self.parse_unary())
+        return _combine('and', children)
+
+    def parse_unary(self):
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == 'NOT':
+            if self.peek() in (None, ')', 'OR', 'AND'):
+                return None
+            child = self.parse_unary()
+            return None if child is None else ('not', child)
+        if kind == '(':
+            node = self.parse_or()
+            if self.peek() == ')':
+                self.pos += 1
+            return node
+        if kind == 'text':
+            # 没有可检索词的文本（如标点）不参与匹配
+            return ('text', value) if any(tokenize(value)) else None
+        if kind == 'field':
+            return ('field',) + value
+        return ('all',)
+
+
+def parse_query(query_string):
+    """
+    把 haystack 生成的查询解析为语法树，支持 AND、OR、NOT、括号和字段条件：
+        ('text', 文本) 全文检索，文本中的词都要出现
+        ('field', 字段, 过滤类型, 值)
+        ('and', [子节点]) / ('or', [子节点]) / ('not', 子节点) / ('all',)
+    :return: 语法树，没有任何检索条件时返回 None
+    """
+    return _QueryParser(_lex(force_str(query_string))).parse()
+
+
+def query_texts(node, negated=False):
+    """语法树中非否定的全文检索文本，用于打分和高亮"""
+    if node is None:
+        return []
+    kind = node[0]
+    if kind == 'text':
+        return [] if negated else [node[1]]
+    if kind == 'not':
+        return query_texts(node[1], not negated)
+    if kind in ('and', 'or'):
+        return [text for child in node[1] for text in query_texts(child, negated)]
+    return []
+
+
+def _plain(value):
+    """与数据库后端保存的 JSON 取值一致，日期时间转为 ISO 格式字符串"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def _compare(actual, value):
+    if isinstance(actual, (int, float)) and isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    if isinstance(actual, (int, float)) and isinstance(value, (int, float)):
+        return (actual > value) - (actual < value)
+    actual, value = force_str(actual), force_str(value)
+    return (actual > value) - (actual < value)
+
+
+def _value_matches(actual, filter_type, value):
+    if filter_type == 'exact':
+        return _compare(actual, value) == 0
+    if filter_type == 'in':
+        return any(_compare(actual, v) == 0 for v in value)
+    if filter_type == 'range':
+        start, end = value
+        return _compare(actual, start) >= 0 and _compare(actual, end) <= 0
+    if filter_type == 'content':
+        terms = set(tokenize(value))
+        if not terms:
+            return _compare(actual, value) == 0
+        return terms <= set(tokenize(actual))
+    if filter_type == 'contains':
+        return force_str(value).lower() in force_str(actual).lower()
+    if filter_type == 'startswith':
+        return force_str(actual).lower().startswith(force_str(value).lower())
+    result = _compare(actual, value)
+    return {'gt': result > 0, 'gte': result >= 0, 'lt': result < 0, 'lte': result <= 0}[filter_type]
+
+
+def field_matches(stored, field, filter_type, value):
+    """多值字段中任意一个值满足条件即可"""
+    actual = stored.get(field)
+    values = actual if isinstance(actual, (list, tuple, set)) else [actual]
+    return any(_value_matches(_plain(v), filter_type, value) for v in values if v is not None)
+
+
+def highlight(text, terms, length=HIGHLIGHT_LENGTH):
+    """截取第一个命中词附近的片段，命中部分用 <em> 标出"""
+    text = force_str(text or '')
+    lower = text.lower()
+    positions = [p for p in (lower.find(term) for term in terms) if p >= 0]
+    start = max(0, min(positions) - length // 4) if positions else 0
+    fragment = text[start:start + length]
+    lower = fragment.lower()
+    spans = []
+    for term in set(terms):
+        i = lower.find(term)
+        while i >= 0:
+            spans.append((i, i + len(term)))
+            i = lower.find(term, i + 1)
+    # 合并重叠的区间，中文 bigram 相互重叠
+    merged = []
+    for begin, end in sorted(spans):
+        if merged and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+    parts = []
+    last = 0
+    for begin, end in merged:
+        parts.append(escape(fragment[last:begin]))
+        parts.append('<em>%s</em>' % escape(fragment[begin:end]))
+        last = end
+    parts.append(escape(fragment[last:]))
+    return ''.join(parts)
+
+
+class InvertedIndex:
+    '''
+    内存倒排索引。
+    每个词的倒排表是按文档号递增的两个 array（文档号、词频），按 BM25 打分。
+    删除只把文档标记为失效，失效文档过多时整体压缩；文档频率只统计有效文档
+    '''
+
+    def __init__(self, content_field='text'):
+        self.content_field = content_field
+        self.postings = {}
+        self.df = Counter()
+        self.doc_keys = []
+        self.doc_lengths = array('I')
+        self.stored = []
+        self.docnums = {}
+        self.total_length = 0
+        self.live_count = 0
+
+    def __len__(self):
+        return self.live_count
+
+    def add(self, key, fields):
+        self.remove(key)
+        docnum = len(self.doc_keys)
+        counts = Counter(tokenize(fields.get(self.content_field) or ''))
+        self.df.update(counts.keys())
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('I'), array('I'))
+            posting[0].append(docnum)
+            posting[1].append(tf)
+        length = sum(counts.values())
+        self.doc_keys.append(key)
+        self.doc_lengths.append(length)
+        self.stored.append(fields)
+        self.docnums[key] = docnum
+        self.total_length += length
+        self.live_count += 1
+
+    def remove(self, key):
+        docnum = self.docnums.pop(key, None)
+        if docnum is None:
+            return False
+        self.df.subtract(set(tokenize(self.stored[docnum].get(self.content_field) or '')))
+        self.doc_keys[docnum] = None
+        self.stored[docnum] = None
+        self.total_length -= self.doc_lengths[docnum]
+        self.live_count -= 1
+        dead = len(self.doc_keys) - self.live_count
+        if dead > max(100, self.live_count // 4):
+            self.compact()
+        return True
+
+    def compact(self):
+        """去掉失效文档，重新编号"""
+        remap = {}
+        doc_keys = []
+        doc_lengths = array('I')
+        stored = []
+        for old, key in enumerate(self.doc_keys):
+            if key is not None:
+                remap[old] = len(doc_keys)
+                doc_keys.append(key)
+                doc_lengths.append(self.doc_lengths[old])
+                stored.append(self.stored[old])
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            new_docs = array('I')
+            new_tfs = array('I')
+            for docnum, tf in zip(docs, tfs):
+                new = remap.get(docnum)
+                if new is not None:
+                    new_docs.append(new)
+                    new_tfs.append(tf)
+            if new_docs:
+                postings[term] = (new_docs, new_tfs)
+        self.postings = postings
+        self.doc_keys = doc_keys
+        self.doc_lengths = doc_lengths
+        self.stored = stored
+        self.docnums = {key: docnum for docnum, key in enumerate(doc_keys)}
+        self.df = +self.df
+
+    def idf(self, term):
+        df = self.df[term]
+        return math.log(1 + (self.live_count - df + 0.5) / (df + 0.5))
+
+    def score(self, terms, require_all=True):
+        """
+        BM25 得分
+        :param require_all: 文档必须包含全部词
+        :return: {文档号: 得分}
+        """
+        terms = list(dict.fromkeys(terms))
+        if not terms or not self.live_count:
+            return {}
+        avgdl = self.total_length / self.live_count or 1
+        scores = {}
+        matched = Counter()
+        # 从最少见的词开始，全部匹配时后面的词只需检查已有的候选
+        for i, term in enumerate(sorted(terms, key=lambda t: self.df[t])):
+            posting = self.postings.get(term)
+            if posting is None or not self.df[term]:
+                if require_all:
+                    return {}
+                continue
+            idf = self.idf(term)
+            for docnum, tf in zip(*posting):
+                if self.doc_keys[docnum] is None or (require_all and i and docnum not in scores):
+                    continue
+                dl = self.doc_lengths[docnum]
+                scores[docnum] = scores.get(docnum, 0) + idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+                matched[docnum] += 1
+        if require_all:
+            return {docnum: s for docnum, s in scores.items() if matched[docnum] == len(terms)}
+        return scores
+
+    def top_terms(self, text, limit=MLT_TERMS):
+        """文本中 tf-idf 最高的词，用于查找相似文档"""
+        counts = Counter(tokenize(text))
+        return heapq.nlargest(limit, counts, key=lambda term: counts[term] * self.idf(term))
+
+
+class IndexWriter:
+    '''
+    IndexHolder.write 中使用，修改索引的同时记录操作，退出时追加到增量日志
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.ops = []
+
+    def add(self, key, fields):
+        self.index.add(key, fields)
+        self.ops.append(('add', key, fields))
+
+    def remove(self, key):
+        if self.index.remove(key):
+            self.ops.append(('remove', key, None))
+
+
+class IndexHolder:
+    '''
+    进程内共享的索引（haystack 的后端对象是每个线程一个）。
+    索引保存为快照文件和增量日志：写入只把操作追加到日志，日志超过 LOG_COMPACT_RECORDS 条时才重写快照。
+    其他进程查询时只读取日志中新增的操作；快照被重写后在后台线程重新加载，加载完成前继续使用当前索引。
+    多个进程写入时用文件锁串行化
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.index = None
+        # 当前索引对应的快照版本、已读取的日志长度和日志中的操作数
+        self.version = None
+        self.offset = 0
+        self.records = 0
+        self.loading = None
+
+    @property
+    def generation(self):
+        """快照版本加日志长度，各进程读到同样的数据时一致"""
+        if self.version is None:
+            return None
+        return '{version}:{offset}'.format(version=self.version, offset=self.offset)
+
+    def _snapshot_version(self):
+        # 快照总是写入新文件再替换，inode 和修改时间一起标识一个快照
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+        return '{ino}-{mtime}'.format(ino=stat.st_ino, mtime=stat.st_mtime_ns)
+
+    def _log_path(self, version):
+        return '{path}.{version}.log'.format(path=self.path, version=version)
+
+    @contextmanager
+    def _file_lock(self):
+        if self.path is None or fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_snapshot(self):
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            index = pickle.load(f)
+        return index, '{ino}-{mtime}'.format(ino=stat.st_ino, mtime=stat.st_mtime_ns)
+
+    def _install(self, index, version):
+        self.index = index
+        self.version = version
+        self.offset = 0
+        self.records = 0
+        self._catch_up()
+        logger.info('memory search index loaded:{count} documents'.format(count=len(self.index)))
+
+    def _catch_up(self):
+        """应用日志中新增的操作；其他进程正在写入的不完整记录留到下次读取"""
+        if self.path is None:
+            return
+        log_path = self._log_path(self.version)
+        try:
+            if os.path.getsize(log_path) <= self.offset:
+                return
+            f = open(log_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self.offset)
+            while True:
+                try:
+                    op, key, fields = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                if op == 'add':
+                    self.index.add(key, fields)
+                else:
+                    self.index.remove(key)
+                self.offset = f.tell()
+                self.records += 1
+
+    def _sync(self, build):
+        """与磁盘上的快照和日志同步，需要持有文件锁"""
+        version = self._snapshot_version()
+        if version is None:
+            if self.index is None or self.version is not None:
+                self.index = build()
+                self.save()
+        elif version != self.version:
+            self._install(*self._load_snapshot())
+        else:
+            self._catch_up()
+
+    def _load_in_background(self):
+        try:
+            index, version = self._load_snapshot()
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning('memory search index reload failed:{error}'.format(error=e))
+        else:
+            with self.lock:
+                if version != self.version:
+                    self._install(index, version)
+        finally:
+            self.loading = None
+
+    def get(self, build):
+        """
+        当前索引。第一次调用时加载快照（没有快照时调用 build 从数据库建立）；
+        之后只读取日志中新增的操作，快照被其他进程重写时在后台重新加载
+        """
+        with self.lock:
+            if self.index is None:
+                with self._file_lock():
+                    self._sync(build)
+            elif self.path is not None:
+                version = self._snapshot_version()
+                if version is not None and version != self.version:
+                    if self.loading is None:
+                        self.loading = threading.Thread(target=self._load_in_background, daemon=True)
+                        self.loading.start()
+                else:
+                    self._catch_up()
+            return self.index
+
+    @contextmanager
+    def write(self, build):
+        """修改索引，完成后把操作追加到日志，日志过长时重写快照"""
+        with self.lock, self._file_lock():
+            self._sync(build)
+            writer = IndexWriter(self.index)
+            yield writer
+            if self.path is None or not writer.ops:
+                return
+            with open(self._log_path(self.version), 'ab') as f:
+                for op in writer.ops:
+                    pickle.dump(op, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self.offset = f.tell()
+            self.records += len(writer.ops)
+            if self.records > LOG_COMPACT_RECORDS:
+                self.save()
+
+    def replace(self, index):
+        with self.lock, self._file_lock():
+            self.index = index
+            self.save()
+
+    def save(self):
+        """重写快照并删除旧日志，需要持有文件锁"""
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '{path}.{pid}.tmp'.format(path=self.path, pid=os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        old_version = self.version
+        self.version = self._snapshot_version()
+        self.offset = 0
+        self.records = 0
+        if old_version is not None and old_version != self.version:
+            try:
+                os.remove(self._log_path(old_version))
+            except FileNotFoundError:
+                pass
+
+
+# 按快照路径（或连接名）共享
+HOLDERS = {}
+HOLDERS_LOCK = threading.Lock()
+
+
+class MemorySearchBackend(BaseSearchBackend):
+    '''
+    内存倒排索引后端，适合文章数较少的站点：查询不访问磁盘，不需要 jieba。
+    在 HAYSTACK_CONNECTIONS 中通过 PATH 指定快照文件，不指定时只保存在内存中
+    '''
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        self.path = connection_options.get('PATH')
+        with HOLDERS_LOCK:
+            key = self.path or connection_alias
+            if key not in HOLDERS:
+                HOLDERS[key] = IndexHolder(self.path)
+            self.holder = HOLDERS[key]
+
+    @property
+    def content_field_name(self):
+        from haystack import connections
+        return connections[self.connection_alias].get_unified_index().document_field
+
+    def get_index(self):
+        return self.holder.get(self.build)
+
+    def build(self):
+        """从数据库建立完整的索引"""
+        from haystack import connections
+        index = InvertedIndex(self.content_field_name)
+        unified_index = connections[self.connection_alias].get_unified_index()
+        for model in unified_index.get_indexed_models():
+            search_index = unified_index.get_index(model)
+            for obj in search_index.index_queryset(using=self.connection_alias).iterator(chunk_size=500):
+                self._add(index, search_index, obj)
+        logger.info('memory search index built:{count} documents'.format(count=len(index)))
+        return index
+
+    def rebuild(self, index, procs=None, chunk_size=500, **kwargs):
+        """build_index 命令调用，重新建立索引并保存快照"""
+        new_index = self.build()
+        self.holder.replace(new_index)
+        bump_search_version()
+        return len(new_index)
+
+    def _add(self, index, search_index, obj):
+        try:
+            doc = search_index.full_prepare(obj)
+        except SkipDocument:
+            logger.debug(u"Indexing for object `%s` skipped", obj)
+            return
+        index.add(doc[ID], doc)
+
+    def update(self, index, iterable, commit=True):
+        with self.holder.write(self.build) as writer:
+            for obj in iterable:
+                self._add(writer, index, obj)
+        bump_search_version()
+
+    def remove(self, obj_or_string, commit=True):
+        with self.holder.write(self.build) as writer:
+            writer.remove(get_identifier(obj_or_string))
+        bump_search_version()
+
+    def clear(self, models=None, commit=True):
+        if models:
+            cts = {get_model_ct(model) for model in models}
+            with self.holder.write(self.build) as writer:
+                for key, docnum in list(writer.index.docnums.items()):
+                    if writer.index.stored[docnum].get(DJANGO_CT) in cts:
+                        writer.remove(key)
+        else:
+            self.holder.replace(InvertedIndex(self.content_field_name))
+        bump_search_version()
+
+    def get_index_generation(self):
+        """快照版本和日志长度，各进程一致"""
+        self.get_index()
+        return self.holder.generation
+
+    def _model_choices(self, models, limit_to_registered_models):
+        if models:
+            return {get_model_ct(model) for model in models}
+        if limit_to_registered_models is None:
+            from django.conf import settings
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        if limit_to_registered_models:
+            return set(self.build_models_list())
+        return None
+
+    @classmethod
+    def _evaluate(cls, index, node):
+        """
+        按语法树求值
+        :return: {文档号: 得分}
+        """
+        kind = node[0]
+        if kind == 'all':
+            return dict.fromkeys(index.docnums.values(), 0)
+        if kind == 'text':
+            return index.score(list(tokenize(node[1])))
+        if kind == 'field':
+            field, filter_type, value = node[1:]
+            return {docnum: 0 for docnum in index.docnums.values()
+                    if field_matches(index.stored[docnum], field, filter_type, value)}
+        if kind == 'not':
+            excluded = cls._evaluate(index, node[1])
+            return {docnum: 0 for docnum in index.docnums.values() if docnum not in excluded}
+        if kind == 'or':
+            scores = {}
+            for child in node[1]:
+                for docnum, score in cls._evaluate(index, child).items():
+                    scores[docnum] = scores.get(docnum, 0) + score
+            return scores
+        # AND：全文检索词合并为一次打分，否定条件最后排除
+        terms = [term for child in node[1] if child[0] == 'text' for term in tokenize(child[1])]
+        scores = index.score(terms) if terms else None
+        for child in node[1]:
+            if child[0] in ('text', 'not'):
+                continue
+            matched = cls._evaluate(index, child)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {docnum: score + matched[docnum] for docnum, score in scores.items() if docnum in matched}
+        if scores is None:
+            scores = dict.fromkeys(index.docnums.values(), 0)
+        for child in node[1]:
+            if child[0] == 'not' and scores:
+                excluded = cls._evaluate(index, child[1])
+                scores = {docnum: score for docnum, score in scores.items() if docnum not in excluded}
+        return scores
+
+    @log_query
+    @cache_search_results
+    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None, fields='',
+               highlight=False, facets=None, date_facets=None, query_facets=None, narrow_queries=None,
+               spelling_query=None, models=None, limit_to_registered_models=None, result_class=None,
+               **kwargs):
+        query_string = force_str(query_string).strip()
+        if not query_string:
+            return {'results': [], 'hits': 0}
+
+        if date_facets is not None or query_facets is not None:
+            warnings.warn("The memory backend only handles field faceting.", Warning, stacklevel=2)
+
+        index = self.get_index()
+        node = parse_query(query_string)
+        if node is None:
+            return {'results': [], 'hits': 0}
+        # narrow query 之间是 AND 关系
+        node = _combine('and', [node] + [parse_query(nq) for nq in narrow_queries or ()])
+        terms = [term for text in query_texts(node) for term in tokenize(text)]
+        with self.holder.lock:
+            scores = self._evaluate(index, node)
+            model_choices = self._model_choices(models, limit_to_registered_models)
+            matched = [(docnum, score) for docnum, score in scores.items()
+                       if model_choices is None or index.stored[docnum].get(DJANGO_CT) in model_choices]
+            page = self._sort(index, matched, sort_by, end_offset)[start_offset:end_offset]
+            return {
+                'results': [self._to_result(index, docnum, score, highlight and terms, result_class)
+                            for docnum, score in page],
+                'hits': len(matched),
+                'facets': self._facet_counts(index, matched, facets),
+                'spelling_suggestion': None,
+            }
+
+    @staticmethod
+    def _sort(index, matched, sort_by, end_offset):
+        if not sort_by:
+            if end_offset is None:
+                return sorted(matched, key=lambda item: item[1], reverse=True)
+            return heapq.nlargest(end_offset, matched, key=lambda item: item[1])
+        results = list(matched)
+        # 从最后一个排序字段开始依次稳定排序
+        for order_by in reversed(sort_by):
+            field = order_by.lstrip('-')
+            results.sort(key=lambda item: (index.stored[item[0]].get(field) is None,
+                                           index.stored[item[0]].get(field) or 0),
+                         reverse=order_by.startswith('-'))
+        return results
+
+    @staticmethod
+    def _facet_counts(index, matched, facets):
+        if not facets:
+            return {}
+        counts = {'fields': {}, 'dates': {}, 'queries': {}}
+        for field in facets:
+            counter = Counter()
+            for docnum, score in matched:
+                value = index.stored[docnum].get(field)
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                counter.update(force_str(v) for v in values if v not in (None, ''))
+            counts['fields'][field] = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+        return counts
+
+    def _to_result(self, index, docnum, score, terms, result_class):
+        stored = index.stored[docnum]
+        app_label, model_name = stored[DJANGO_CT].split('.')
+        additional_fields = {k: v for k, v in stored.items() if k not in (ID, DJANGO_CT, DJANGO_ID)}
+        if terms:
+            additional_fields['highlighted'] = {
+                self.content_field_name: [highlight(stored.get(self.content_field_name), terms)],
+            }
+        return (result_class or SearchResult)(app_label, model_name, stored[DJANGO_ID], score, **additional_fields)
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0,
+                       end_offset=None, models=None, limit_to_registered_models=None,
+                       result_class=None, **kwargs):
+        index = self.get_index()
+        with self.holder.lock:
+            docnum = index.docnums.get(get_identifier(model_instance))
+            if docnum is None:
+                return {'results': [], 'hits': 0}
+            terms = index.top_terms(index.stored[docnum].get(self.content_field_name, ''))
+            scores = index.score(terms, require_all=False)
+            scores.pop(docnum, None)
+            node = parse_query(additional_query_string or '')
+            if node is not None:
+                required = self._evaluate(index, node)
+                scores = {d: s for d, s in scores.items() if d in required}
+            model_choices = self._model_choices(models or [type(model_instance)], limit_to_registered_models)
+            matched = [(d, s) for d, s in scores.items()
+                       if model_choices is None or index.stored[d].get(DJANGO_CT) in model_choices]
+            page = self._sort(index, matched, None, end_offset)[start_offset:end_offset]
+            return {
+                'results': [self._to_result(index, d, s, None, result_class) for d, s in page],
+                'hits': len(matched),
+            }
+
+
+class MemorySearchQuery(BaseSearchQuery):
+    def build_query_fragment(self, field, filter_type, value):
+        """值以 JSON 写入查询，由 parse_query 解析；SQ 的 AND、OR、NOT 原样保留"""
+        if hasattr(value, 'query_string'):
+            value = value.query_string
+        if isinstance(value, (set, tuple)):
+            value = list(value)
+        if field == 'content':
+            return json.dumps(force_str(value), ensure_ascii=False)
+        return '%s%s%s:%s' % (field, FILTER_SEPARATOR, filter_type,
+                              json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False))
+
+    def get_spelling_suggestion(self, preferred_query=None):
+        return None
+
+
+class MemoryEngine(BaseEngine):
+    backend = MemorySearchBackend
+    query = MemorySearchQuery
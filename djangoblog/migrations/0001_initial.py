@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+FTS_TABLE = 'djangoblog_searchdocument_fts'
+FULLTEXT_INDEX = 'djangoblog_searchdocument_text_ft'
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE {table} USING fts5(tokens)'.format(table=FTS_TABLE))
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE djangoblog_searchdocument ADD FULLTEXT INDEX {index} (text) WITH PARSER ngram'.format(
+                index=FULLTEXT_INDEX))
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {table}'.format(table=FTS_TABLE))
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE djangoblog_searchdocument DROP INDEX {index}'.format(
+            index=FULLTEXT_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=255, unique=True)),
+                ('django_ct', models.CharField(db_index=True, max_length=100)),
+                ('django_id', models.CharField(max_length=64)),
+                ('text', models.TextField(default='')),
+                ('stored', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoblog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('using', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('action', models.CharField(max_length=10)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import models
+
+# SQLite FTS5 虚拟表，rowid 与 SearchDocument 主键相同
+FTS_TABLE = 'djangoblog_searchdocument_fts'
+
+
+class SearchDocument(models.Model):
+    """数据库全文检索后端（djangoblog.db_backend）的索引文档"""
+    identifier = models.CharField(max_length=255, unique=True)
+    django_ct = models.CharField(max_length=100, db_index=True)
+    django_id = models.CharField(max_length=64)
+    # 全文检索的文本，MySQL 在此列上建立 ngram 全文索引
+    text = models.TextField(default='')
+    # 其他索引字段，搜索结果直接使用
+    stored = models.JSONField(default=dict)
+
+    def __str__(self):
+        return self.identifier
+
+
+class SearchIndexTask(models.Model):
+    """
+    搜索索引更新队列（djangoblog.search_queue）中等待写入的登记，
+    与保存操作在同一事务中写入，进程退出或被强制结束时不会丢失
+    """
+    using = models.CharField(max_length=64)
+    model = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=64)
+    action = models.CharField(max_length=10)
+
+    def __str__(self):
+        return '{action} {model}.{pk}'.format(action=self.action, model=self.model, pk=self.object_pk)
@@ -0,0 +1,214 @@
+import copy
+import logging
+from hashlib import sha256
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import Http404
+
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectCache:
+    '''
+    按主键缓存单个模型对象的读穿透缓存，用法：
+        class Category(BaseModel):
+            cached = ObjectCache(lookups=('slug',))
+
+        Category.cached.get(pk=1)
+        Category.cached.get(slug='python')
+        Category.cached.get_many([1, 2, 3])
+
+    lookups 中的字段会额外缓存 字段值 -> 主键 的二级索引；
+    exclude 中的字段（如密码哈希）不写入缓存，取出的对象上为延迟字段。
+    对象保存、删除时自动失效，事务提交后再失效一次；queryset.update 等绕过信号的批量修改需调用 invalidate_all。
+    信号在声明时注册，不依赖 blog_signals 是否被导入（如管理命令中）
+    '''
+
+    def __init__(self, lookups=(), exclude=(), timeout=60 * 60 * 24):
+        self.lookups = tuple(lookups)
+        self.exclude = tuple(exclude)
+        self.timeout = timeout
+
+    def contribute_to_class(self, model, name):
+        self.model = model
+        self.label = model._meta.label_lower
+        setattr(model, name, self)
+        uid = 'object_cache_{label}'.format(label=self.label)
+        post_save.connect(self._on_change, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(self._on_change, sender=model, weak=False, dispatch_uid=uid)
+
+    def _version(self):
+        key = 'object_cache_version:{label}'.format(label=self.label)
+        version = cache.get(key)
+        if version is None:
+            version = 1
+            cache.set(key, version, None)
+        return version
+
+    def _key(self, pk, version=None):
+        return 'object_cache:{label}:{version}:pk:{pk}'.format(
+            label=self.label, version=version or self._version(), pk=pk)
+
+    def _lookup_key(self, field, value, version=None):
+        value = sha256(str(value).encode('utf-8')).hexdigest()
+        return 'object_cache:{label}:{version}:{field}:{value}'.format(
+            label=self.label, version=version or self._version(), field=field, value=value)
+
+    def _clean_copy(self, instance):
+        """只缓存对象本身的字段，不带预取和已加载的关联对象"""
+        instance = copy.copy(instance)
+        instance.__dict__.pop('_prefetched_objects_cache', None)
+        instance._state = copy.copy(instance._state)
+        instance._state.fields_cache = {}
+        for field in self.exclude:
+            instance.__dict__.pop(self.model._meta.get_field(field).attname, None)
+        return instance
+
+    def set(self, instance):
+        version = self._version()
+        values = {self._key(instance.pk, version): self._clean_copy(instance)}
+        for field in self.lookups:
+            values[self._lookup_key(field, getattr(instance, field), version)] = instance.pk
+        cache.set_many(values, self.timeout)
+
+    def get(self, pk=None, **kwargs):
+        """
+        按主键或 lookups 中的一个字段取对象，不存在时抛出 Model.DoesNotExist
+        """
+        if pk is None:
+            if len(kwargs) != 1 or next(iter(kwargs)) not in self.lookups:
+                raise ValueError('ObjectCache.get() takes pk or one of {lookups}'.format(
+                    lookups=self.lookups))
+            field, value = next(iter(kwargs.items()))
+            pk = cache.get(self._lookup_key(field, value))
+            if pk is not None:
+                instance = self._get_by_pk(pk)
+                # 字段值被修改后，旧的二级索引不再指向该对象
+                if instance is not None and str(getattr(instance, field)) == str(value):
+                    return instance
+            instance = self.model.objects.get(**{field: value})
+            self.set(instance)
+            return instance
+        instance = self._get_by_pk(pk)
+        if instance is None:
+            raise self.model.DoesNotExist(
+                '{model} matching query does not exist.'.format(model=self.model._meta.object_name))
+        return instance
+
+    def _get_by_pk(self, pk):
+        instance = cache.get(self._key(pk))
+        if instance is None:
+            instance = self.model.objects.filter(pk=pk).first()
+            if instance is not None:
+                self.set(instance)
+        return instance
+
+    def get_many(self, ids):
+        """
+        批量取对象，未命中的用一条查询补齐
+        :return: {pk: 对象}，不存在的主键不在结果中
+        """
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        if not ids:
+            return {}
+        version = self._version()
+        keys = {self._key(pk, version): pk for pk in ids}
+        found = {keys[k]: v for k, v in cache.get_many(keys).items()}
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            loaded = self.model.objects.in_bulk(missing)
+            for instance in loaded.values():
+                self.set(instance)
+            found.update(loaded)
+        return found
+
+    def list(self, ids, select_related=()):
+        """按id列表返回惰性序列，分页切片时才从缓存取出该页对象"""
+        return CachedObjectList(self, ids, select_related)
+
+    def get_or_404(self, pk=None, **kwargs):
+        """与 get_object_or_404 一致，缺少或无效的主键同样返回 404"""
+        not_found = Http404('No {model} matches the given query.'.format(model=self.model._meta.object_name))
+        if pk is None and not kwargs:
+            raise not_found
+        if pk is not None:
+            try:
+                pk = self.model._meta.pk.to_python(pk)
+            except ValidationError:
+                raise not_found
+        try:
+            return self.get(pk=pk, **kwargs)
+        except self.model.DoesNotExist:
+            raise not_found
+
+    def invalidate(self, instance):
+        version = self._version()
+        cache.delete(self._key(instance.pk, version))
+        cache.delete_many([self._lookup_key(f, getattr(instance, f), version) for f in self.lookups])
+
+    def invalidate_all(self):
+        """批量修改（如 queryset.update）后整体作废该模型的缓存"""
+        key = 'object_cache_version:{label}'.format(label=self.label)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+        logger.info('invalidate object cache:{label}'.format(label=self.label))
+
+    def _on_change(self, sender, instance, **kwargs):
+        # 立即失效，本事务内的读取可见；提交后再失效一次，提交前其他请求回填的旧对象随之作废
+        self.invalidate(instance)
+        transaction.on_commit(lambda: self.invalidate(instance))
+
+    def hydrate(self, instances, field_name):
+        """
+        用缓存填充一批对象的外键关联，如 Category.cached.hydrate(articles, 'category')，
+        避免模板中逐条查询
+        """
+        field = instances[0]._meta.get_field(field_name) if instances else None
+        if field is None:
+            return instances
+        related = self.get_many(getattr(i, field.attname) for i in instances)
+        for instance in instances:
+            obj = related.get(getattr(instance, field.attname))
+            if obj is not None:
+                field.set_cached_value(instance, obj)
+        return instances
+
+
+class CachedObjectList:
+    '''
+    只保存id的对象列表，支持 len 和切片，可直接交给 Paginator；
+    取出对象时用关联模型的 ObjectCache 填充 select_related 中的外键
+    '''
+
+    def __init__(self, object_cache, ids, select_related=()):
+        self.object_cache = object_cache
+        self.ids = list(ids)
+        self.select_related = select_related
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def _load(self, ids):
+        objects = self.object_cache.get_many(ids)
+        instances = [objects[pk] for pk in ids if pk in objects]
+        for field_name in self.select_related:
+            field = self.object_cache.model._meta.get_field(field_name)
+            field.related_model.cached.hydrate(instances, field_name)
+        return instances
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._load(self.ids[index])
+        return self._load([self.ids[index]])[0]
+
+    def __iter__(self):
+        return iter(self._load(self.ids))
@@ -5,6 +5,9 @@ ARTICLE_DELETE = 'article_delete'
 
 ARTICLE_CONTENT_HOOK_NAME = "the_content"
 
+# 匿名访客命中整页缓存时触发（此时视图不会执行）
+PAGE_CACHE_HIT = 'page_cache_hit'
+
 # 位置钩子常量
 POSITION_HOOKS = {
     'article_top': 'article_top_widgets',
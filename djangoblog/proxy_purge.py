@@ -0,0 +1,41 @@
+import logging
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyPurge():
+    '''
+    通知前端反向代理按 Surrogate-Key 清除缓存的页面
+    未配置 PROXY_PURGE_URL 时不做任何事
+    '''
+
+    @staticmethod
+    def purge_keys(keys):
+        if not settings.PROXY_PURGE_URL or not keys:
+            return False
+        try:
+            result = requests.request(
+                settings.PROXY_PURGE_METHOD,
+                settings.PROXY_PURGE_URL,
+                headers={settings.SURROGATE_KEY_HEADER: ' '.join(sorted(keys))},
+                timeout=5)
+            logger.info('proxy purge {keys}: {status}'.format(keys=keys, status=result.status_code))
+            return result.ok
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    @staticmethod
+    def purge(keys):
+        """
+        并入本次事务的失效批次，提交后与其他键合并为一次请求在后台线程发送，
+        避免代理在提交前回源取到旧内容
+        """
+        keys = set(keys)
+        if not settings.PROXY_PURGE_URL or not keys:
+            return
+        from djangoblog import invalidation
+        invalidation.purge(keys)
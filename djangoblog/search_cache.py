@@ -0,0 +1,115 @@
+import logging
+import time
+from functools import wraps
+from hashlib import sha256
+
+from django.conf import settings
+from django.utils.encoding import force_str
+from haystack.models import SearchResult
+from haystack.utils.app_loading import haystack_get_model
+
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_PREFIX = 'search_result'
+SEARCH_VERSION_KEY = 'search_result_version'
+# 只影响结果对象的类型，不影响搜索结果本身
+IGNORED_KWARGS = ('result_class',)
+
+
+def get_search_version():
+    """
+    索引写入后递增的版本，与后端自己的索引代数一起作为缓存键的一部分。
+    使用时间戳，缓存被整体清空后不会与旧版本重复
+    """
+    version = cache.get(SEARCH_VERSION_KEY)
+    if version is None:
+        version = time.time()
+        cache.set(SEARCH_VERSION_KEY, version, None)
+    return version
+
+
+def bump_search_version():
+    cache.set(SEARCH_VERSION_KEY, time.time(), None)
+
+
+def normalize_query(query_string):
+    """合并多余的空白，大小写由后端的分析器处理"""
+    return ' '.join(force_str(query_string).split())
+
+
+def _key_part(value):
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return sorted(_key_part(v) for v in value)
+    if isinstance(value, type):
+        return value._meta.label_lower if hasattr(value, '_meta') else value.__name__
+    return force_str(value)
+
+
+def get_search_cache_key(backend, query_string, kwargs):
+    params = sorted((k, _key_part(v)) for k, v in kwargs.items() if k not in IGNORED_KWARGS)
+    raw = repr((type(backend).__name__, backend.connection_alias, normalize_query(query_string),
+                getattr(backend, 'is_suggest', None), params,
+                backend.get_index_generation(), get_search_version()))
+    return '{prefix}:{hash}'.format(prefix=SEARCH_CACHE_PREFIX, hash=sha256(raw.encode('utf-8')).hexdigest())
+
+
+def _freeze(results):
+    return dict(results, results=[
+        (r.app_label, r.model_name, r.pk, r.score, {k: getattr(r, k) for k in r._additional_fields})
+        for r in results.get('results', [])])
+
+
+def _thaw(value, result_class):
+    result_class = result_class or SearchResult
+    return dict(value, results=[result_class(app_label, model_name, pk, score, **fields)
+                                for app_label, model_name, pk, score, fields in value['results']])
+
+
+def hydrate_results(results):
+    """
+    一次性取出搜索结果对应的对象，有对象缓存的模型（如文章）从缓存读取，
+    模板中访问 result.object 时不再逐条查询
+    """
+    by_model = {}
+    for result in results:
+        by_model.setdefault((result.app_label, result.model_name), []).append(result)
+    for (app_label, model_name), items in by_model.items():
+        model = haystack_get_model(app_label, model_name)
+        if model is None:
+            continue
+        pks = [model._meta.pk.to_python(r.pk) for r in items]
+        cached = getattr(model, 'cached', None)
+        objects = cached.get_many(pks) if cached is not None else model._default_manager.in_bulk(pks)
+        for result, pk in zip(items, pks):
+            result._object = objects.get(pk)
+    return results
+
+
+def cache_search_results(func):
+    """
+    缓存后端 search 方法的结果，只保存结果的id、得分、命中数和建议词。
+    键包含规范化后的查询、分页等参数以及索引代数，索引提交后自动失效。
+    无论是否命中缓存，结果对应的对象都一次性取出
+    """
+
+    @wraps(func)
+    def wrapper(backend, query_string, **kwargs):
+        if not settings.SEARCH_RESULT_CACHE_TIMEOUT:
+            results = func(backend, query_string, **kwargs)
+            hydrate_results(results.get('results', []))
+            return results
+        result_class = kwargs.get('result_class')
+        key = get_search_cache_key(backend, query_string, kwargs)
+        value = cache.get(key)
+        if value is None:
+            results = func(backend, query_string, **kwargs)
+            cache.set(key, _freeze(results), settings.SEARCH_RESULT_CACHE_TIMEOUT)
+        else:
+            logger.info('search result cache hit:{query}'.format(query=query_string))
+            results = _thaw(value, result_class)
+        hydrate_results(results.get('results', []))
+        return results
+
+    return wrapper
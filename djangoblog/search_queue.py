@@ -0,0 +1,233 @@
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows 上没有 fcntl，只在进程内互斥
+    fcntl = None
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import signals
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from haystack.utils import get_model_ct
+
+from djangoblog.models import SearchIndexTask
+
+logger = logging.getLogger(__name__)
+
+UPDATE = 'update'
+REMOVE = 'remove'
+# 写入后按主键分批删除登记，避免超出数据库的参数个数限制
+DELETE_CHUNK_SIZE = 500
+
+
+@contextmanager
+def writer_lock(path, blocking=True):
+    """
+    跨进程的写入锁，同一时刻只有一个进程写入索引
+    :return: 是否取得了锁，blocking 为 False 且锁被占用时为 False
+    """
+    if fcntl is None or not path:
+        yield True
+        return
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            acquired = False
+        else:
+            acquired = True
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class IndexQueue:
+    '''
+    搜索索引更新队列。
+    保存、删除时在同一事务中向 SearchIndexTask 登记 (模型, 主键, 操作)，随事务提交或回滚，
+    进程退出或被强制结束也不会丢失。登记后唤醒本进程的写线程，按数量或时间阈值写入：
+    写入前取得 lock_path 上的文件锁，同一时刻只有一个进程写入索引；
+    写入者取出表中全部登记（包括其他进程的），去重后只提交一次，
+    请求不再等待索引提交，多个工作进程也不会争抢索引锁
+    '''
+
+    def __init__(self, batch_size=100, interval=2, background=True, lock_path=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.background = background
+        self.lock_path = lock_path
+        # 本进程登记后尚未写入的数量，只用于决定何时唤醒写线程
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def put(self, using, model, pk, action):
+        """在当前事务中登记，事务提交后唤醒写线程"""
+        SearchIndexTask.objects.bulk_create([SearchIndexTask(
+            using=using, model=get_model_ct(model), object_pk=str(pk), action=action)])
+        transaction.on_commit(self.notify)
+
+    def notify(self):
+        with self.lock:
+            self.pending += 1
+            size = self.pending
+            if self.background:
+                self._ensure_thread()
+        if size >= self.batch_size:
+            self.wakeup.set()
+
+    def _ensure_thread(self):
+        # fork 出的工作进程里没有父进程的线程，首次登记时再启动
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='search-index-writer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            # 只在本进程有登记时访问数据库，其他进程遗留的登记随下一次写入一起处理
+            if not self.pending:
+                continue
+            try:
+                self.flush(blocking=False)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                close_old_connections()
+
+    def flush(self, blocking=True):
+        """
+        写入表中登记的全部更新，成功后删除这些登记，失败时保留到下一次
+        :param blocking: 其他进程正在写入时是否等待，为 False 时直接返回，留到下一次
+        :return: 实际写入索引的对象数
+        """
+        with self.write_lock, writer_lock(self.lock_path, blocking) as acquired:
+            if not acquired:
+                return 0
+            seen = self.pending
+            tasks = list(SearchIndexTask.objects.order_by('id'))
+            # 同一对象只保留最后一次操作
+            latest = OrderedDict()
+            for task in tasks:
+                key = (task.using, task.model, task.object_pk)
+                latest.pop(key, None)
+                latest[key] = task.action
+            groups = defaultdict(lambda: ([], set()))
+            for (using, model_ct, pk), action in latest.items():
+                model = apps.get_model(model_ct)
+                updates, removes = groups[(using, model)]
+                pk = model._meta.pk.to_python(pk)
+                if action == UPDATE:
+                    updates.append(pk)
+                else:
+                    removes.add(pk)
+            count = 0
+            for (using, model), (updates, removes) in groups.items():
+                count += self._write(using, model, updates, removes)
+            ids = [task.id for task in tasks]
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                SearchIndexTask.objects.filter(id__in=ids[start:start + DELETE_CHUNK_SIZE]).delete()
+            with self.lock:
+                self.pending = max(self.pending - seen, 0)
+        return count
+
+    def _write(self, using, model, updates, removes):
+        from haystack import connections
+        try:
+            index = connections[using].get_unified_index().get_index(model)
+        except NotHandled:
+            return 0
+        backend = connections[using].get_backend()
+        # 不满足 index_queryset 条件的对象（如改为草稿）从索引中移除
+        objects = index.index_queryset(using=using).filter(pk__in=updates).in_bulk() if updates else {}
+        changed = []
+        for pk in updates:
+            obj = objects.get(pk)
+            if obj is None:
+                removes.add(pk)
+            else:
+                changed.append(obj)
+        # 后端在提交后才返回，调用方随后删除登记，进程崩溃时未提交的更新不会丢失
+        if changed:
+            backend.update(index, changed)
+        for pk in removes:
+            backend.remove('{ct}.{pk}'.format(ct=get_model_ct(model), pk=pk))
+        logger.info('search index updated:{model} changed:{changed} removed:{removed}'.format(
+            model=get_model_ct(model), changed=len(changed), removed=len(removes)))
+        return len(changed) + len(removes)
+
+
+# 登记保存在数据库中，进程退出时不需要写入剩余的更新，由下一次写入处理
+index_queue = IndexQueue(
+    batch_size=settings.SEARCH_INDEX_BATCH_SIZE,
+    interval=settings.SEARCH_INDEX_BATCH_INTERVAL,
+    lock_path=settings.SEARCH_INDEX_WRITER_LOCK)
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    '''
+    替代 RealtimeSignalProcessor，在保存的事务中把改动登记到 index_queue，由写线程批量更新索引。
+    索引保存在数据库中的后端（transactional）在保存的事务中直接写入，随事务一起提交或回滚
+    '''
+
+    def setup(self):
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+        signals.m2m_changed.connect(self.handle_m2m_changed)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+        signals.m2m_changed.disconnect(self.handle_m2m_changed)
+
+    def write(self, using, sender, pk, action):
+        from haystack import connections
+        index = connections[using].get_unified_index().get_index(sender)
+        backend = connections[using].get_backend()
+        obj = index.index_queryset(using=using).filter(pk=pk).first() if action == UPDATE else None
+        if obj is not None:
+            backend.update(index, [obj])
+        else:
+            backend.remove('{ct}.{pk}'.format(ct=get_model_ct(sender), pk=pk))
+
+    def enqueue(self, sender, instance, action):
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+            pk = instance.pk
+            if getattr(self.connections[using].get_backend(), 'transactional', False):
+                self.write(using, sender, pk, action)
+            else:
+                index_queue.put(using, sender, pk, action)
+
+    def handle_save(self, sender, instance, **kwargs):
+        if kwargs.get('update_fields') == {'views'}:
+            return
+        self.enqueue(sender, instance, UPDATE)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance, REMOVE)
+
+    def handle_m2m_changed(self, sender, instance, action, reverse, model, pk_set, **kwargs):
+        """标签等多对多关系在保存文章之后才写入，修改后重新索引相关对象"""
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        if not reverse:
+            self.enqueue(type(instance), instance, UPDATE)
+        elif pk_set:
+            for obj in model._default_manager.filter(pk__in=pk_set):
+                self.enqueue(model, obj, UPDATE)
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.utils import timezone
+from haystack.exceptions import SkipDocument
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+LATEST_NAME = 'LATEST'
+# 本地索引目录中记录已安装的快照名，whoosh 不会清理以 . 开头的文件
+INSTALLED_NAME = '.snapshot'
+SNAPSHOT_PREFIX = 'snapshot-'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, content):
+    tmp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class SnapshotStore:
+    '''
+    索引快照的交换目录，可以是本地目录或挂载的共享存储。
+    每个快照是一个只写一次的子目录，包含索引文件和 manifest.json；
+    LATEST 记录最新的快照名，整个目录写完后才原子地改写，读取方不会看到写了一半的快照
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def latest(self):
+        """最新快照的 manifest，还没有发布过时返回 None"""
+        try:
+            with open(self.path(LATEST_NAME), encoding='utf-8') as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        with open(os.path.join(self.path(name), MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+
+    def staging(self):
+        """新快照的临时目录，写入文件后调用 commit 发布"""
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.mkdtemp(prefix='.staging_', dir=self.root)
+
+    def commit(self, staging_path, version, **extra):
+        """
+        计算文件摘要、写入 manifest，并把临时目录发布为最新快照
+        :return: manifest
+        """
+        files = {}
+        for filename in sorted(os.listdir(staging_path)):
+            path = os.path.join(staging_path, filename)
+            files[filename] = {'size': os.path.getsize(path), 'sha256': _sha256(path)}
+        # 版本号可能因 builder 重建索引而回退，名称中加上时间避免重名
+        name = '{prefix}{version}-{ms}'.format(prefix=SNAPSHOT_PREFIX, version=version, ms=int(time.time() * 1000))
+        manifest = dict(extra, name=name, version=version, created=timezone.now().isoformat(), files=files)
+        with open(os.path.join(staging_path, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging_path, self.path(name))
+        _write_atomic(self.path(LATEST_NAME), name)
+        return manifest
+
+    def fetch(self, manifest, dest_path):
+        """把快照文件复制到 dest_path，逐个校验大小和摘要"""
+        src_path = self.path(manifest['name'])
+        for filename, meta in manifest['files'].items():
+            path = os.path.join(dest_path, filename)
+            try:
+                shutil.copyfile(os.path.join(src_path, filename), path)
+            except FileNotFoundError:
+                raise SnapshotError('snapshot {name} is missing {file}'.format(name=manifest['name'], file=filename))
+            if os.path.getsize(path) != meta['size'] or _sha256(path) != meta['sha256']:
+                raise SnapshotError('snapshot {name} file {file} is corrupted'.format(
+                    name=manifest['name'], file=filename))
+
+    def prune(self, keep):
+        """只保留最近的 keep 个快照，正在下载旧快照的副本不受影响；LATEST 指向的快照总是保留"""
+        latest = self.latest()
+        names = [name for name in os.listdir(self.root) if name.startswith(SNAPSHOT_PREFIX)]
+        names.sort(key=lambda name: os.path.getmtime(self.path(name)), reverse=True)
+        removed = []
+        for name in names[max(keep, 1):]:
+            if latest is not None and name == latest['name']:
+                continue
+            shutil.rmtree(self.path(name), ignore_errors=True)
+            removed.append(name)
+        return removed
+
+
+def get_backend(using='default'):
+    from haystack import connections
+    backend = connections[using].get_backend()
+    if not hasattr(backend, 'export_snapshot'):
+        raise SnapshotError('search backend {backend} does not support snapshots'.format(
+            backend=type(backend).__name__))
+    return backend
+
+
+def _digest(index, obj):
+    """单个文档索引内容的摘要"""
+    try:
+        doc = index.full_prepare(obj)
+    except SkipDocument:
+        return None
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_content_digest(using='default'):
+    """数据库中所有待索引文档的摘要，用来判断是否需要重建"""
+    from haystack import connections
+    digest = hashlib.sha256()
+    unified_index = connections[using].get_unified_index()
+    for model in sorted(unified_index.get_indexed_models(), key=lambda model: model._meta.label):
+        index = unified_index.get_index(model)
+        for obj in index.index_queryset(using=using).order_by('pk').iterator(chunk_size=500):
+            digest.update('{pk}:{digest}\n'.format(pk=obj.pk, digest=_digest(index, obj)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def publish(store, keep=3, rebuild=False, using='default'):
+    """
+    builder 进程调用，把本地索引发布为新快照。
+    rebuild 为 True 时先按数据库重建索引，收录其他副本上的修改；数据库内容没变时不重建
+    :return: 新快照的 manifest，索引没有变化时返回 None
+    """
+    backend = get_backend(using)
+    latest = store.latest()
+    extra = {}
+    if rebuild:
+        digest = get_content_digest(using)
+        if latest is not None and latest.get('digest') == digest:
+            return None
+        from haystack import connections
+        unified_index = connections[using].get_unified_index()
+        for model in unified_index.get_indexed_models():
+            backend.rebuild(unified_index.get_index(model))
+        extra['digest'] = digest
+    elif latest is not None and latest['version'] == backend.get_index_generation():
+        return None
+
+    staging_path = store.staging()
+    try:
+        version = backend.export_snapshot(staging_path)
+        manifest = store.commit(staging_path, version, **extra)
+    except Exception:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+    store.prune(keep)
+    logger.info('search snapshot published:{name} files:{count}'.format(
+        name=manifest['name'], count=len(manifest['files'])))
+    return manifest
+
+
+def get_installed(backend):
+    try:
+        with open(os.path.join(backend.path, INSTALLED_NAME), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def pull(store, using='default'):
+    """
+    副本进程调用，最新快照与本地索引不同时下载到本地磁盘，校验后替换本地索引。
+    各进程的 searcher 在下次查询时发现新版本并切换，进行中的查询继续使用旧版本
+    :return: 安装的快照 manifest，本地已是最新时返回 None
+    """
+    backend = get_backend(using)
+    manifest = store.latest()
+    if manifest is None or manifest['name'] == get_installed(backend):
+        return None
+    if not backend.setup_complete:
+        backend.setup()
+    # 与索引在同一文件系统，安装时直接移动文件
+    tmp_path = tempfile.mkdtemp(prefix='.pull_', dir=os.path.dirname(os.path.abspath(backend.path)))
+    try:
+        store.fetch(manifest, tmp_path)
+        backend.install_snapshot(tmp_path, manifest['version'])
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    _write_atomic(os.path.join(backend.path, INSTALLED_NAME), manifest['name'])
+    logger.info('search snapshot installed:{name}'.format(name=manifest['name']))
+    return manifest
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+USER_DICT_NAME = 'userdict.txt'
+# 站点词汇的词频，足够大以保证整词切出
+WORD_FREQ = 2000
+
+_lock = threading.Lock()
+_tokenizer = None
+# 已加载的用户词典版本（修改时间和大小），其他进程追加新词后在下次分词前加载
+_user_dict_version = None
+
+
+def get_user_dict_path():
+    return os.path.join(settings.JIEBA_DICT_DIR, USER_DICT_NAME)
+
+
+def get_site_words():
+    """标签和分类名称，作为分词的用户词典"""
+    from blog.models import Category, Tag
+    words = set(Tag.objects.values_list('name', flat=True))
+    words.update(Category.objects.values_list('name', flat=True))
+    return sorted(w.strip() for w in words if w and w.strip() and ' ' not in w.strip())
+
+
+def _dict_lock(path):
+    """多个进程修改用户词典时互斥，避免追加的词被重写词典覆盖"""
+    from djangoblog.search_queue import writer_lock
+    return writer_lock(path + '.lock')
+
+
+def _get_user_dict_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_user_dict(words):
+    os.makedirs(settings.JIEBA_DICT_DIR, exist_ok=True)
+    path = get_user_dict_path()
+    tmp_path = path + '.tmp'
+    with _dict_lock(path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for word in words:
+                f.write('{word} {freq}\n'.format(word=word, freq=WORD_FREQ))
+        os.replace(tmp_path, path)
+    return path
+
+
+def get_tokenizer():
+    """
+    首次分词时才加载jieba词典。
+    前缀词典缓存保存在 JIEBA_DICT_DIR 中，由 build_search_words 预先生成，重启后直接读取；
+    之后加载站点词汇。用户词典被其他进程修改后，分词前重新加载其中的词
+    """
+    global _tokenizer, _user_dict_version
+    path = get_user_dict_path()
+    version = _get_user_dict_version(path)
+    if _tokenizer is None or version != _user_dict_version:
+        with _lock:
+            tokenizer = _tokenizer
+            if tokenizer is None:
+                import jieba
+                tokenizer = jieba.Tokenizer()
+                if os.path.isdir(settings.JIEBA_DICT_DIR):
+                    tokenizer.tmp_dir = settings.JIEBA_DICT_DIR
+                tokenizer.initialize()
+            if version is not None and (_tokenizer is None or version != _user_dict_version):
+                tokenizer.load_userdict(path)
+            _user_dict_version = version
+            _tokenizer = tokenizer
+    return _tokenizer
+
+
+def precompile():
+    """生成用户词典并预编译前缀词典缓存"""
+    global _tokenizer, _user_dict_version
+    words = get_site_words()
+    write_user_dict(words)
+    with _lock:
+        _tokenizer = None
+        _user_dict_version = None
+    get_tokenizer()
+    return words
+
+
+def add_word(word):
+    """
+    新增的标签、分类名称立即加入本进程的词典，并在文件锁内追加到用户词典文件，
+    其他进程在下次分词前发现词典变化并加载
+    """
+    word = (word or '').strip()
+    if not word or ' ' in word:
+        return
+    if _tokenizer is not None:
+        _tokenizer.add_word(word, WORD_FREQ)
+    path = get_user_dict_path()
+    try:
+        os.makedirs(settings.JIEBA_DICT_DIR, exist_ok=True)
+        with _dict_lock(path):
+            if os.path.isfile(path):
+                with open(path, encoding='utf-8') as f:
+                    if any(line.split(' ')[0] == word for line in f):
+                        return
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('{word} {freq}\n'.format(word=word, freq=WORD_FREQ))
+    except OSError as e:
+        logger.error(e)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 from django.utils.translation import gettext_lazy as _
@@ -79,7 +80,9 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
-    'blog.middleware.OnlineMiddleware'
+    'blog.middleware.OnlineMiddleware',
+    'blog.middleware.AnonymousPageCacheMiddleware',
+    'blog.middleware.SurrogateKeyMiddleware',
 ]
 
 ROOT_URLCONF = 'djangoblog.urls'
@@ -167,8 +170,51 @@ HAYSTACK_CONNECTIONS = {
         'PATH': os.path.join(os.path.dirname(__file__), 'whoosh_index'),
     },
 }
+if os.environ.get('DJANGO_SEARCH_BACKEND') == 'memory':
+    # 内存倒排索引，适合文章数较少的站点；PATH 为索引快照文件，同目录下保存增量日志
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'djangoblog.memory_backend.MemoryEngine',
+            'PATH': os.path.join(os.path.dirname(__file__), 'memory_index', 'index.pickle'),
+        },
+    }
+elif os.environ.get('DJANGO_SEARCH_BACKEND') == 'database':
+    # 数据库全文检索（SQLite FTS5 / MySQL ngram FULLTEXT），与文章在同一事务中更新
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'djangoblog.db_backend.DatabaseEngine',
+        },
+    }
 # Automatically update searching index
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# 保存后登记到队列，由后台写线程批量提交索引
+HAYSTACK_SIGNAL_PROCESSOR = 'djangoblog.search_queue.QueuedSignalProcessor'
+# 队列中累计多少条或等待多少秒后提交一次
+SEARCH_INDEX_BATCH_SIZE = int(os.environ.get('DJANGO_SEARCH_INDEX_BATCH_SIZE') or 100)
+SEARCH_INDEX_BATCH_INTERVAL = float(os.environ.get('DJANGO_SEARCH_INDEX_BATCH_INTERVAL') or 2)
+# 同一主机上的工作进程通过此文件锁轮流写入，同一时刻只有一个写入者
+SEARCH_INDEX_WRITER_LOCK = os.environ.get('DJANGO_SEARCH_INDEX_WRITER_LOCK') or os.path.join(
+    tempfile.gettempdir(), 'djangoblog_search_index.lock')
+# 多副本部署：builder 写入 Whoosh 索引并发布快照，replica 只通过 search_snapshot pull 拉取快照
+SEARCH_SNAPSHOT_STORE = os.environ.get('DJANGO_SEARCH_SNAPSHOT_STORE') or os.path.join(BASE_DIR, 'search_snapshots')
+SEARCH_SNAPSHOT_KEEP = int(os.environ.get('DJANGO_SEARCH_SNAPSHOT_KEEP') or 3)
+if os.environ.get('DJANGO_SEARCH_SNAPSHOT_ROLE') == 'replica':
+    # 副本不写本地索引，保存的文章由 builder 重建索引后随快照发布
+    HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
+# jieba 前缀词典缓存和站点用户词典（标签、分类名称）所在目录，由 build_search_words 生成
+JIEBA_DICT_DIR = os.environ.get('DJANGO_JIEBA_DICT_DIR') or os.path.join(os.path.dirname(__file__), 'jieba_dict')
+if TESTING:
+    # 测试中生成的词典写入临时目录，不留在源码目录中
+    JIEBA_DICT_DIR = os.path.join(tempfile.gettempdir(), 'djangoblog_test_jieba_dict')
+# 搜索结果缓存时间（秒），索引写入后自动失效，设为0关闭
+SEARCH_RESULT_CACHE_TIMEOUT = int(os.environ.get('DJANGO_SEARCH_RESULT_CACHE_TIMEOUT') or 60 * 60)
+# Elasticsearch 索引统计（代数）在进程内缓存的秒数，其他进程的写入最多延迟这么久使结果缓存失效
+SEARCH_INDEX_GENERATION_TTL = float(os.environ.get('DJANGO_SEARCH_INDEX_GENERATION_TTL') or 5)
+# 搜索建议索引保留的文章数（按浏览量）和全量重建间隔（秒）
+SUGGEST_MAX_ARTICLES = int(os.environ.get('DJANGO_SUGGEST_MAX_ARTICLES') or 5000)
+SUGGEST_REBUILD_INTERVAL = int(os.environ.get('DJANGO_SUGGEST_REBUILD_INTERVAL') or 600)
+# 列表页批量获取点赞/收藏状态时一次最多的文章数，以及按访客缓存的秒数
+INTERACTION_STATES_MAX_ARTICLES = int(os.environ.get('DJANGO_INTERACTION_STATES_MAX_ARTICLES') or 50)
+INTERACTION_STATES_CACHE_TIMEOUT = int(os.environ.get('DJANGO_INTERACTION_STATES_CACHE_TIMEOUT') or 5)
 # Allow user login with username and password
 AUTHENTICATION_BACKENDS = [
     'accounts.user_login_backend.EmailOrUsernameModelBackend']
@@ -196,23 +242,67 @@ BOOTSTRAP_COLOR_TYPES = [
 
 # paginate
 PAGINATE_BY = 10
+# 上一篇/下一篇是否限定在同一分类内
+ARTICLE_NEIGHBOR_BY_CATEGORY = env_to_bool('DJANGO_ARTICLE_NEIGHBOR_BY_CATEGORY', False)
+# 文章页流式渲染，先发送<head>再依次输出正文、评论、侧边栏
+ARTICLE_STREAMING_ENABLED = env_to_bool('DJANGO_ARTICLE_STREAMING', False)
 # http cache timeout
 CACHE_CONTROL_MAX_AGE = 2592000
+# 匿名访客整页缓存
+PAGE_CACHE_ENABLED = env_to_bool('DJANGO_PAGE_CACHE', True)
+PAGE_CACHE_TIMEOUT = 60 * 10
+# 缓存的页面及其读取的查询参数，其他参数（如 utm_source）不影响页面，不进入缓存键
+PAGE_CACHE_VIEWS = {
+    'blog:index': ('page',),
+    'blog:index_page': (),
+    'blog:detailbyid': ('comment_page',),
+    'blog:category_detail': ('page',),
+    'blog:category_detail_page': (),
+    'blog:author_detail': ('page',),
+    'blog:author_detail_page': (),
+    'blog:tag_detail': ('page',),
+    'blog:tag_detail_page': (),
+    'blog:archives': (),
+    'blog:links': (),
+}
+# 命中整页缓存时缓冲的浏览次数，达到次数或超过秒数后写入数据库
+VIEW_COUNT_FLUSH_THRESHOLD = int(os.environ.get('DJANGO_VIEW_COUNT_FLUSH_THRESHOLD') or 50)
+VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('DJANGO_VIEW_COUNT_FLUSH_INTERVAL') or 60)
+# 反向代理缓存：响应标注 Surrogate-Key，内容修改后向 PROXY_PURGE_URL 发送清除请求
+SURROGATE_KEY_HEADER = 'Surrogate-Key'
+SURROGATE_CACHE_TIMEOUT = 60 * 60 * 24
+PROXY_PURGE_URL = os.environ.get('DJANGO_PROXY_PURGE_URL') or ''
+PROXY_PURGE_METHOD = os.environ.get('DJANGO_PROXY_PURGE_METHOD') or 'PURGE'
 # cache setting
+# counters 保存浏览次数等尚未写入数据库的计数，不随内容修改时的 cache.clear() 清空
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'TIMEOUT': 10800,
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    'counters': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': None,
+        'LOCATION': 'counters',
+    },
 }
 # 使用redis作为缓存
 if os.environ.get("DJANGO_REDIS_URL"):
+    # cache.clear() 会清空整个库，计数默认放在下一个库中
+    redis_host, _, redis_db = os.environ.get("DJANGO_REDIS_URL").partition('/')
     CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.redis.RedisCache',
             'LOCATION': f'redis://{os.environ.get("DJANGO_REDIS_URL")}',
-        }
+        },
+        'counters': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'TIMEOUT': None,
+            'LOCATION': 'redis://{url}'.format(
+                url=os.environ.get('DJANGO_REDIS_COUNTER_URL') or '{host}/{db}'.format(
+                    host=redis_host, db=int(redis_db or 0) + 1)),
+        },
     }
 
 SITE_ID = 1
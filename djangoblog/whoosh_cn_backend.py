@@ -6,8 +6,11 @@ import json
 import os
 import re
 import shutil
+import tempfile
 import threading
 import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import six
 from django.conf import settings
@@ -22,18 +25,24 @@ from haystack.models import SearchResult
 from haystack.utils import get_identifier, get_model_ct
 from haystack.utils import log as logging
 from haystack.utils.app_loading import haystack_get_model
-from jieba.analyse import ChineseAnalyzer
-from whoosh import index
-from whoosh.analysis import StemmingAnalyzer
+from whoosh import index, sorting
+from whoosh.analysis import LowercaseFilter, StemFilter, StemmingAnalyzer, StopFilter, Token, Tokenizer
 from whoosh.fields import BOOLEAN, DATETIME, IDLIST, KEYWORD, NGRAM, NGRAMWORDS, NUMERIC, Schema, TEXT
 from whoosh.fields import ID as WHOOSH_ID
 from whoosh.filedb.filestore import FileStorage, RamStorage
 from whoosh.highlight import ContextFragmenter, HtmlFormatter
 from whoosh.highlight import highlight as whoosh_highlight
+from whoosh.idsets import BitSet
+from whoosh.index import TOC, clean_files
+from whoosh.lang.porter import stem
 from whoosh.qparser import QueryParser
 from whoosh.searching import ResultsPage
+from whoosh.support.relativedelta import relativedelta
 from whoosh.writing import AsyncWriter
 
+from djangoblog.search_cache import bump_search_version, cache_search_results
+from djangoblog.search_words import get_tokenizer
+
 try:
     import whoosh
 except ImportError:
@@ -51,6 +60,46 @@ DATETIME_REGEX = re.compile(
     '^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})T(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})(\.\d{3,6}Z?)?$')
 LOCALS = threading.local()
 LOCALS.RAM_STORE = None
+# Searcher pools are shared by every backend instance of the process, keyed by index location.
+SEARCHER_POOLS = {}
+SEARCHER_POOLS_LOCK = threading.Lock()
+# Narrow query bitsets kept per searcher pool, least recently used ones are dropped first.
+MAX_NARROW_FILTERS = 128
+
+
+STOP_WORDS = frozenset(('a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can',
+                        'for', 'from', 'have', 'if', 'in', 'is', 'it', 'may',
+                        'not', 'of', 'on', 'or', 'tbd', 'that', 'the', 'this',
+                        'to', 'us', 'we', 'when', 'will', 'with', 'yet',
+                        'you', 'your', '的', '了', '和'))
+ACCEPTED_CHARS = re.compile(r"[\u4E00-\u9FD5]+")
+
+
+class ChineseTokenizer(Tokenizer):
+    """
+    Same as jieba's ChineseTokenizer, but the jieba dictionary is only loaded
+    on the first tokenization, from the precompiled cache and with the site
+    vocabulary (see djangoblog.search_words). Importing this module no longer
+    imports jieba.analyse, which loads its IDF table at import time.
+    """
+
+    def __call__(self, text, **kargs):
+        words = get_tokenizer().tokenize(text, mode="search")
+        token = Token()
+        for (w, start_pos, stop_pos) in words:
+            if not ACCEPTED_CHARS.match(w) and len(w) <= 1:
+                continue
+            token.original = token.text = w
+            token.pos = start_pos
+            token.startchar = start_pos
+            token.endchar = stop_pos
+            yield token
+
+
+def ChineseAnalyzer(stoplist=STOP_WORDS, minsize=1, stemfn=stem, cachesize=50000):
+    return (ChineseTokenizer() | LowercaseFilter() |
+            StopFilter(stoplist=stoplist, minsize=minsize) |
+            StemFilter(stemfn=stemfn, ignore=None, cachesize=cachesize))
 
 
 class WhooshHtmlFormatter(HtmlFormatter):
@@ -62,6 +111,84 @@ class WhooshHtmlFormatter(HtmlFormatter):
     template = '<%(tag)s>%(t)s</%(tag)s>'
 
 
+class SearcherPool(object):
+    """
+    Holds one open searcher per index and shares it between concurrent queries.
+
+    Each acquire only compares the index generation with the one the searcher
+    was opened on. When the index changed and nobody is using the current
+    searcher, it is refreshed in place, which reopens only the changed
+    segments. Otherwise a new searcher is opened and the old one is closed
+    once its last user releases it, so in-flight queries never see their
+    readers closed underneath them.
+
+    The docnums matching each narrow query are cached as bitsets for the
+    current searcher and dropped together with it. At most
+    ``MAX_NARROW_FILTERS`` of them are kept, evicting the least recently used.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.searcher = None
+        self.users = {}
+        self.filters = OrderedDict()
+
+    @contextmanager
+    def acquire(self, ix):
+        with self.lock:
+            searcher = self._current(ix)
+            self.users[searcher] = self.users.get(searcher, 0) + 1
+        try:
+            yield searcher
+        finally:
+            with self.lock:
+                self.users[searcher] -= 1
+                if not self.users[searcher]:
+                    del self.users[searcher]
+                    if searcher is not self.searcher:
+                        searcher.close()
+
+    def _current(self, ix):
+        searcher = self.searcher
+        if searcher is None:
+            self.searcher = ix.searcher()
+        elif not searcher.up_to_date():
+            if searcher in self.users:
+                self.searcher = ix.searcher()
+            else:
+                # Reuses the readers of unchanged segments and closes the rest.
+                self.searcher = searcher.refresh()
+            # Docnums change with the segments, cached filters are no longer valid.
+            self.filters = OrderedDict()
+        return self.searcher
+
+    def narrow_filter(self, searcher, parser, query_string):
+        """
+        Returns the docnums matching a narrow query as a bitset usable as the
+        ``filter`` argument. Callers must not modify the returned set.
+        """
+        with self.lock:
+            docs = self.filters.get(query_string) if searcher is self.searcher else None
+            if docs is not None:
+                self.filters.move_to_end(query_string)
+        if docs is None:
+            docs = BitSet(searcher.docs_for_query(parser.parse(query_string)),
+                          size=searcher.doc_count_all())
+            with self.lock:
+                if searcher is self.searcher:
+                    self.filters[query_string] = docs
+                    while len(self.filters) > MAX_NARROW_FILTERS:
+                        self.filters.popitem(last=False)
+        return docs
+
+    def reset(self):
+        with self.lock:
+            if self.searcher is not None and self.searcher not in self.users:
+                self.searcher.close()
+            self.searcher = None
+            self.filters = OrderedDict()
+
+
 class WhooshSearchBackend(BaseSearchBackend):
     # Word reserved by Whoosh for special use.
     RESERVED_WORDS = (
@@ -130,6 +257,10 @@ class WhooshSearchBackend(BaseSearchBackend):
 
             self.storage = LOCALS.RAM_STORE
 
+        with SEARCHER_POOLS_LOCK:
+            pool_key = self.path if self.use_file_storage else id(self.storage)
+            self.searcher_pool = SEARCHER_POOLS.setdefault(pool_key, SearcherPool())
+
         self.content_field_name, self.schema = self.build_schema(
             connections[self.connection_alias].get_unified_index().all_searchfields())
         self.parser = QueryParser(self.content_field_name, schema=self.schema)
@@ -156,13 +287,23 @@ class WhooshSearchBackend(BaseSearchBackend):
         content_field_name = ''
 
         for field_name, field_class in fields.items():
+            # The ``_exact`` fields Haystack adds for ``faceted=True``.
+            is_facet = hasattr(field_class, 'facet_for')
+
             if field_class.is_multivalued:
                 if field_class.indexed is False:
                     schema_fields[field_class.index_fieldname] = IDLIST(
                         stored=True, field_boost=field_class.boost)
                 else:
+                    # Term vectors let overlapping facets read a document's
+                    # values without walking the whole lexicon per search.
                     schema_fields[field_class.index_fieldname] = KEYWORD(
-                        stored=True, commas=True, scorable=True, field_boost=field_class.boost)
+                        stored=True, commas=True, scorable=True, vector=is_facet or None,
+                        field_boost=field_class.boost)
+            elif is_facet and field_class.field_type == 'string':
+                # Untokenized and column-backed so the value is the facet key.
+                schema_fields[field_class.index_fieldname] = WHOOSH_ID(
+                    stored=field_class.stored, sortable=True)
             elif field_class.field_type in ['date', 'datetime']:
                 schema_fields[field_class.index_fieldname] = DATETIME(
                     stored=field_class.stored, sortable=True)
@@ -242,7 +383,175 @@ class WhooshSearchBackend(BaseSearchBackend):
         if len(iterable) > 0:
             # For now, commit no matter what, as we run into locking issues
             # otherwise.
-            writer.commit()
+            self._commit(writer)
+            bump_search_version()
+
+    def rebuild(self, index, procs=None, chunk_size=500, limitmb=128):
+        """
+        Rebuilds every document of ``index`` without taking the live index offline.
+
+        The queryset is streamed in chunks and written into a temporary
+        directory next to the live index, with Whoosh's multi-process writer
+        so jieba tokenization runs on every core. The new segments are then
+        moved into the live directory and published with a single TOC write,
+        which readers pick up atomically as the next generation.
+
+        The live index's write lock is held from before the queryset is read
+        until the swap. Updates and removals from the index queue meanwhile
+        go through ``AsyncWriter``, which buffers them and replays them on the
+        rebuilt generation once the lock is released, so changes saved during
+        the rebuild are not lost. Those calls return, and bump the search
+        version, only after their replay is committed.
+
+        Returns the number of indexed documents.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        procs = procs or os.cpu_count() or 1
+
+        if not self.use_file_storage:
+            self.clear()
+            self.update(index, list(index.index_queryset(using=self.connection_alias)))
+            return self.index.doc_count()
+
+        tmp_path = tempfile.mkdtemp(prefix='.rebuild_', dir=os.path.dirname(os.path.abspath(self.path)))
+
+        try:
+            with self._write_lock():
+                tmp_storage = FileStorage(tmp_path)
+                tmp_index = tmp_storage.create_index(self.schema, indexname=self.index.indexname)
+
+                if procs > 1:
+                    # Separate segments per process, nothing is merged at the end.
+                    writer = tmp_index.writer(procs=procs, multisegment=True, limitmb=limitmb)
+                else:
+                    writer = tmp_index.writer(limitmb=limitmb)
+
+                count = 0
+
+                try:
+                    for obj in index.index_queryset(using=self.connection_alias).iterator(chunk_size=chunk_size):
+                        try:
+                            doc = index.full_prepare(obj)
+                        except SkipDocument:
+                            continue
+
+                        for key in doc:
+                            doc[key] = self._from_python(doc[key])
+
+                        doc.pop('boost', None)
+                        writer.add_document(**doc)
+                        count += 1
+                except Exception:
+                    writer.cancel()
+                    raise
+
+                writer.commit()
+                self._swap_in(tmp_storage, tmp_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.log.info("Rebuilt Whoosh index with %s documents using %s processes", count, procs)
+        return count
+
+    @staticmethod
+    def _commit(writer):
+        """
+        Commits an ``AsyncWriter`` and returns once the changes are on disk.
+
+        When the write lock was held (e.g. by a rebuild) the writer buffers
+        and replays in its own thread; waiting for it keeps successive writes
+        in order and lets callers bump the search version or drop their queue
+        entries only after the commit.
+        """
+        writer.commit()
+        if writer.writer is None:
+            writer.join()
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Holds the live index's write lock. Queued writers go through
+        ``AsyncWriter`` and replay their changes once it is released.
+        """
+        lock = self.index.lock('WRITELOCK')
+        lock.acquire(blocking=True)
+
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _swap_in(self, tmp_storage, tmp_path, generation=None):
+        """Moves the segments in ``tmp_path`` into the live index, the caller holds the write lock."""
+        indexname = self.index.indexname
+        toc = TOC.read(tmp_storage, indexname)
+        segment_pattern = TOC._segment_pattern(indexname)
+
+        for filename in os.listdir(tmp_path):
+            if segment_pattern.match(filename):
+                os.replace(os.path.join(tmp_path, filename), os.path.join(self.path, filename))
+
+        # The TOC with the highest generation wins, never go backwards.
+        generation = max(generation or 0, self.index.latest_generation() + 1)
+        TOC(self.schema, toc.segments, generation).write(self.storage, indexname)
+        # Open searchers keep their old segment files until they are refreshed.
+        clean_files(self.storage, indexname, generation, toc.segments)
+
+        bump_search_version()
+
+    def export_snapshot(self, dest_path):
+        """
+        Copies the files of the latest generation into ``dest_path``.
+
+        The write lock is held while copying, so no commit can merge away the
+        segments being copied. Returns the copied generation.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        if not self.use_file_storage:
+            raise SearchBackendError("Snapshots need a file based Whoosh index.")
+
+        indexname = self.index.indexname
+        segment_pattern = TOC._segment_pattern(indexname)
+        with self._write_lock():
+            generation = self.index.latest_generation()
+            toc = TOC.read(self.storage, indexname, generation)
+            segment_ids = set(segment.segment_id() for segment in toc.segments)
+            filenames = [TOC._filename(indexname, generation)]
+
+            for filename in self.storage.list():
+                match = segment_pattern.match(filename)
+
+                if match and match.group(1) in segment_ids:
+                    filenames.append(filename)
+
+            for filename in filenames:
+                shutil.copyfile(os.path.join(self.path, filename), os.path.join(dest_path, filename))
+
+        return generation
+
+    def install_snapshot(self, src_path, generation):
+        """
+        Publishes the snapshot in ``src_path`` as the live index.
+
+        ``src_path`` must be on the same filesystem as the index, its segments
+        are moved in and become visible with a single TOC write. The snapshot's
+        generation is kept when it is ahead of the local one, so replicas
+        report the same generation for the same snapshot. Searchers opened on
+        the previous generation keep working until they are refreshed.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        if not self.use_file_storage:
+            raise SearchBackendError("Snapshots need a file based Whoosh index.")
+
+        with self._write_lock():
+            self._swap_in(FileStorage(src_path), src_path, generation)
+        return self.index.latest_generation()
 
     def remove(self, obj_or_string, commit=True):
         if not self.setup_complete:
@@ -252,10 +561,11 @@ class WhooshSearchBackend(BaseSearchBackend):
         whoosh_id = get_identifier(obj_or_string)
 
         try:
-            self.index.delete_by_query(
-                q=self.parser.parse(
-                    u'%s:"%s"' %
-                    (ID, whoosh_id)))
+            # Like update(), wait for the write lock instead of failing while a rebuild holds it.
+            writer = AsyncWriter(self.index)
+            writer.delete_by_term(ID, whoosh_id)
+            self._commit(writer)
+            bump_search_version()
         except Exception as e:
             if not self.silently_fail:
                 raise
@@ -289,6 +599,7 @@ class WhooshSearchBackend(BaseSearchBackend):
                 self.index.delete_by_query(
                     q=self.parser.parse(
                         u" OR ".join(models_to_delete)))
+            bump_search_version()
         except Exception as e:
             if not self.silently_fail:
                 raise
@@ -312,8 +623,19 @@ class WhooshSearchBackend(BaseSearchBackend):
             self.storage.clean()
 
         # Recreate everything.
+        self.searcher_pool.reset()
         self.setup()
 
+    def get_index_generation(self):
+        """
+        Returns the generation of the latest commit. It only lists the index
+        directory, so it is cheap enough to call on every search.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        return self.index.latest_generation()
+
     def optimize(self):
         if not self.setup_complete:
             self.setup()
@@ -346,6 +668,7 @@ class WhooshSearchBackend(BaseSearchBackend):
         return page_num, page_length
 
     @log_query
+    @cache_search_results
     def search(
             self,
             query_string,
@@ -417,17 +740,7 @@ class WhooshSearchBackend(BaseSearchBackend):
 
             sort_by = sort_by_list[0]
 
-        if facets is not None:
-            warnings.warn(
-                "Whoosh does not handle faceting.",
-                Warning,
-                stacklevel=2)
-
-        if date_facets is not None:
-            warnings.warn(
-                "Whoosh does not handle date faceting.",
-                Warning,
-                stacklevel=2)
+        groupedby = self._build_facets(facets, date_facets)
 
         if query_facets is not None:
             warnings.warn(
@@ -435,9 +748,6 @@ class WhooshSearchBackend(BaseSearchBackend):
                 Warning,
                 stacklevel=2)
 
-        narrowed_results = None
-        self.index = self.index.refresh()
-
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(
                 settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
@@ -458,107 +768,104 @@ class WhooshSearchBackend(BaseSearchBackend):
             narrow_queries.add(' OR '.join(
                 ['%s:%s' % (DJANGO_CT, rm) for rm in model_choices]))
 
-        narrow_searcher = None
+        with self.searcher_pool.acquire(self.index) as searcher:
+            narrowed_results = None
 
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in
-            # Whoosh...
-            narrow_searcher = self.index.searcher()
+            if narrow_queries is not None:
+                # Narrow queries run on the same pooled searcher as the main query
+                # and their docnums are cached until the index changes.
+                for nq in narrow_queries:
+                    recent_narrowed_results = self.searcher_pool.narrow_filter(
+                        searcher, self.parser, force_str(nq))
 
-            for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(
-                    self.parser.parse(force_str(nq)), limit=None)
+                    if len(recent_narrowed_results) <= 0:
+                        return {
+                            'results': [],
+                            'hits': 0,
+                        }
 
-                if len(recent_narrowed_results) <= 0:
+                    if narrowed_results is not None:
+                        narrowed_results = narrowed_results & recent_narrowed_results
+                    else:
+                        narrowed_results = recent_narrowed_results
+
+            if searcher.doc_count():
+                parsed_query = self.parser.parse(query_string)
+
+                # In the event of an invalid/stopworded query, recover gracefully.
+                if parsed_query is None:
                     return {
                         'results': [],
                         'hits': 0,
                     }
 
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
-                else:
-                    narrowed_results = recent_narrowed_results
-
-        self.index = self.index.refresh()
-
-        if self.index.doc_count():
-            searcher = self.index.searcher()
-            parsed_query = self.parser.parse(query_string)
+                page_num, page_length = self.calculate_page(
+                    start_offset, end_offset)
 
-            # In the event of an invalid/stopworded query, recover gracefully.
-            if parsed_query is None:
-                return {
-                    'results': [],
-                    'hits': 0,
+                search_kwargs = {
+                    'pagelen': page_length,
+                    'sortedby': sort_by,
+                    'reverse': reverse,
                 }
 
-            page_num, page_length = self.calculate_page(
-                start_offset, end_offset)
-
-            search_kwargs = {
-                'pagelen': page_length,
-                'sortedby': sort_by,
-                'reverse': reverse,
-            }
-
-            # Handle the case where the results have been narrowed.
-            if narrowed_results is not None:
-                search_kwargs['filter'] = narrowed_results
+                # Handle the case where the results have been narrowed.
+                if narrowed_results is not None:
+                    search_kwargs['filter'] = narrowed_results
 
-            try:
-                raw_page = searcher.search_page(
-                    parsed_query,
-                    page_num,
-                    **search_kwargs
-                )
-            except ValueError:
-                if not self.silently_fail:
-                    raise
+                # Facets are counted by the collector of the main query, over
+                # every matching document rather than only the current page.
+                if groupedby is not None:
+                    search_kwargs['groupedby'] = groupedby
+                    search_kwargs['maptype'] = sorting.Count
 
-                return {
-                    'results': [],
-                    'hits': 0,
-                    'spelling_suggestion': None,
-                }
+                try:
+                    raw_page = searcher.search_page(
+                        parsed_query,
+                        page_num,
+                        **search_kwargs
+                    )
+                except ValueError:
+                    if not self.silently_fail:
+                        raise
 
-            # Because as of Whoosh 2.5.1, it will return the wrong page of
-            # results if you request something too high. :(
-            if raw_page.pagenum < page_num:
-                return {
-                    'results': [],
-                    'hits': 0,
-                    'spelling_suggestion': None,
-                }
+                    return {
+                        'results': [],
+                        'hits': 0,
+                        'spelling_suggestion': None,
+                    }
 
-            results = self._process_results(
-                raw_page,
-                highlight=highlight,
-                query_string=query_string,
-                spelling_query=spelling_query,
-                result_class=result_class)
-            searcher.close()
+                # Because as of Whoosh 2.5.1, it will return the wrong page of
+                # results if you request something too high. :(
+                if raw_page.pagenum < page_num:
+                    return {
+                        'results': [],
+                        'hits': 0,
+                        'spelling_suggestion': None,
+                    }
 
-            if hasattr(narrow_searcher, 'close'):
-                narrow_searcher.close()
+                return self._process_results(
+                    raw_page,
+                    highlight=highlight,
+                    query_string=query_string,
+                    spelling_query=spelling_query,
+                    result_class=result_class,
+                    facets=self._facet_counts(raw_page, date_facets) if groupedby is not None else None)
 
-            return results
-        else:
-            if self.include_spelling:
-                if spelling_query:
-                    spelling_suggestion = self.create_spelling_suggestion(
-                        spelling_query)
-                else:
-                    spelling_suggestion = self.create_spelling_suggestion(
-                        query_string)
+        if self.include_spelling:
+            if spelling_query:
+                spelling_suggestion = self.create_spelling_suggestion(
+                    spelling_query)
             else:
-                spelling_suggestion = None
+                spelling_suggestion = self.create_spelling_suggestion(
+                    query_string)
+        else:
+            spelling_suggestion = None
 
-            return {
-                'results': [],
-                'hits': 0,
-                'spelling_suggestion': spelling_suggestion,
-            }
+        return {
+            'results': [],
+            'hits': 0,
+            'spelling_suggestion': spelling_suggestion,
+        }
 
     def more_like_this(
             self,
@@ -579,8 +886,6 @@ class WhooshSearchBackend(BaseSearchBackend):
 
         field_name = self.content_field_name
         narrow_queries = set()
-        narrowed_results = None
-        self.index = self.index.refresh()
 
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(
@@ -605,75 +910,108 @@ class WhooshSearchBackend(BaseSearchBackend):
         if additional_query_string and additional_query_string != '*':
             narrow_queries.add(additional_query_string)
 
-        narrow_searcher = None
+        page_num, page_length = self.calculate_page(start_offset, end_offset)
 
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in
-            # Whoosh...
-            narrow_searcher = self.index.searcher()
+        with self.searcher_pool.acquire(self.index) as searcher:
+            narrowed_results = None
 
-            for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(
-                    self.parser.parse(force_str(nq)), limit=None)
+            if narrow_queries is not None:
+                for nq in narrow_queries:
+                    recent_narrowed_results = self.searcher_pool.narrow_filter(
+                        searcher, self.parser, force_str(nq))
 
-                if len(recent_narrowed_results) <= 0:
-                    return {
-                        'results': [],
-                        'hits': 0,
-                    }
+                    if len(recent_narrowed_results) <= 0:
+                        return {
+                            'results': [],
+                            'hits': 0,
+                        }
 
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
-                else:
-                    narrowed_results = recent_narrowed_results
+                    if narrowed_results is not None:
+                        narrowed_results = narrowed_results & recent_narrowed_results
+                    else:
+                        narrowed_results = recent_narrowed_results
 
-        page_num, page_length = self.calculate_page(start_offset, end_offset)
+            raw_results = EmptyResults()
 
-        self.index = self.index.refresh()
-        raw_results = EmptyResults()
+            if searcher.doc_count():
+                query = "%s:%s" % (ID, get_identifier(model_instance))
+                parsed_query = self.parser.parse(query)
+                results = searcher.search(parsed_query)
 
-        if self.index.doc_count():
-            query = "%s:%s" % (ID, get_identifier(model_instance))
-            searcher = self.index.searcher()
-            parsed_query = self.parser.parse(query)
-            results = searcher.search(parsed_query)
+                if len(results):
+                    # Handle the case where the results have been narrowed.
+                    raw_results = results[0].more_like_this(
+                        field_name, top=end_offset, filter=narrowed_results)
 
-            if len(results):
-                raw_results = results[0].more_like_this(
-                    field_name, top=end_offset)
+            try:
+                raw_page = ResultsPage(raw_results, page_num, page_length)
+            except ValueError:
+                if not self.silently_fail:
+                    raise
 
-            # Handle the case where the results have been narrowed.
-            if narrowed_results is not None and hasattr(raw_results, 'filter'):
-                raw_results.filter(narrowed_results)
+                return {
+                    'results': [],
+                    'hits': 0,
+                    'spelling_suggestion': None,
+                }
 
-        try:
-            raw_page = ResultsPage(raw_results, page_num, page_length)
-        except ValueError:
-            if not self.silently_fail:
-                raise
+            # Because as of Whoosh 2.5.1, it will return the wrong page of
+            # results if you request something too high. :(
+            if raw_page.pagenum < page_num:
+                return {
+                    'results': [],
+                    'hits': 0,
+                    'spelling_suggestion': None,
+                }
 
-            return {
-                'results': [],
-                'hits': 0,
-                'spelling_suggestion': None,
-            }
+            return self._process_results(raw_page, result_class=result_class)
 
-        # Because as of Whoosh 2.5.1, it will return the wrong page of
-        # results if you request something too high. :(
-        if raw_page.pagenum < page_num:
-            return {
-                'results': [],
-                'hits': 0,
-                'spelling_suggestion': None,
-            }
+    def _build_facets(self, facets, date_facets):
+        """
+        Translates Haystack's ``facets`` and ``date_facets`` into Whoosh
+        sorting facets, or returns ``None`` if there is nothing to facet on.
+        """
+        groupedby = sorting.Facets()
 
-        results = self._process_results(raw_page, result_class=result_class)
-        searcher.close()
+        for field_name in facets or ():
+            if field_name not in self.schema:
+                warnings.warn(
+                    "Whoosh cannot facet on unknown field '%s'." % field_name,
+                    Warning,
+                    stacklevel=3)
+                continue
 
-        if hasattr(narrow_searcher, 'close'):
-            narrow_searcher.close()
+            # A document with several tags is counted once for each tag.
+            allow_overlap = isinstance(self.schema[field_name], KEYWORD)
+            groupedby.add_field(field_name, allow_overlap=allow_overlap)
 
-        return results
+        for field_name, options in (date_facets or {}).items():
+            gap = relativedelta(**{options['gap_by'] + 's': options.get('gap_amount', 1)})
+            groupedby.add_facet(field_name, sorting.DateRangeFacet(
+                field_name, options['start_date'], options['end_date'], gap))
+
+        return groupedby if groupedby.names() else None
+
+    def _facet_counts(self, raw_page, date_facets):
+        """
+        Reads the facet counts collected with the page into Haystack's format:
+        ``(value, count)`` pairs, most frequent first, and ``(start, count)``
+        pairs in date order.
+        """
+        facets = {'fields': {}, 'dates': {}, 'queries': {}}
+
+        for field_name in raw_page.results.facet_names():
+            groups = raw_page.results.groups(field_name)
+
+            if field_name in (date_facets or {}):
+                facets['dates'][field_name] = sorted(
+                    (key[0], count) for key, count in groups.items() if key is not None)
+            else:
+                facets['fields'][field_name] = sorted(
+                    ((key, count) for key, count in groups.items() if key not in (None, '')),
+                    key=lambda item: (-item[1], item[0]))
+
+        return facets
 
     def _process_results(
             self,
@@ -681,7 +1019,8 @@ class WhooshSearchBackend(BaseSearchBackend):
             highlight=False,
             query_string='',
             spelling_query=None,
-            result_class=None):
+            result_class=None,
+            facets=None):
         from haystack import connections
         results = []
 
@@ -692,7 +1031,7 @@ class WhooshSearchBackend(BaseSearchBackend):
         if result_class is None:
             result_class = SearchResult
 
-        facets = {}
+        facets = facets or {}
         spelling_suggestion = None
         unified_index = connections[self.connection_alias].get_unified_index()
         indexed_models = unified_index.get_indexed_models()
@@ -769,13 +1108,17 @@ class WhooshSearchBackend(BaseSearchBackend):
 
     def create_spelling_suggestion(self, query_string):
         spelling_suggestion = None
-        reader = self.index.reader()
-        corrector = reader.corrector(self.content_field_name)
-        cleaned_query = force_str(query_string)
 
         if not query_string:
             return spelling_suggestion
 
+        with self.searcher_pool.acquire(self.index) as searcher:
+            return self._spelling_suggestion(searcher.reader(), query_string)
+
+    def _spelling_suggestion(self, reader, query_string):
+        corrector = reader.corrector(self.content_field_name)
+        cleaned_query = force_str(query_string)
+
         # Clean the string.
         for rev_word in self.RESERVED_WORDS:
             cleaned_query = cleaned_query.replace(rev_word, '')
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_like_counters(apps, schema_editor):
+    Like = apps.get_model('interaction', 'Like')
+    ArticleLikeCounter = apps.get_model('interaction', 'ArticleLikeCounter')
+    rows = Like.objects.values('article').annotate(total=models.Count('id')).order_by()
+    ArticleLikeCounter.objects.bulk_create(
+        [ArticleLikeCounter(article_id=row['article'], count=row['total']) for row in rows],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_alter_blogsettings_options'),
+        ('interaction', '0002_folder_tags_sort_pinned_item_note_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleLikeCounter',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='like_counter', serialize=False, to='blog.article', verbose_name='article')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='like count')),
+            ],
+            options={
+                'verbose_name': 'like counter',
+                'verbose_name_plural': 'like counters',
+            },
+        ),
+        migrations.RunPython(fill_like_counters, migrations.RunPython.noop),
+    ]
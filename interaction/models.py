@@ -15,7 +15,7 @@ from typing import Optional
 
 from django.conf import settings
 from django.core import validators
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.utils.encoding import force_str
 from django.utils.text import slugify
@@ -265,6 +265,48 @@ class Like(models.Model):
         return f'{self.actor} -> {self.article}'
 
 
+class ArticleLikeCounter(models.Model):
+    """
+    文章点赞数。由 Like 的保存、删除信号在同一事务中用 F() 原子增减，
+    读取点赞数只需按主键取一行，不再对点赞表 COUNT。
+    """
+
+    article = models.OneToOneField(
+        Article,
+        verbose_name=_('article'),
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='like_counter')
+    count = models.PositiveIntegerField(_('like count'), default=0)
+
+    class Meta:
+        verbose_name = _('like counter')
+        verbose_name_plural = _('like counters')
+
+    def __str__(self):  # pragma: no cover
+        return f'{self.article_id}: {self.count}'
+
+    @classmethod
+    def adjust(cls, article_id: int, delta: int):
+        counters = cls.objects.filter(article_id=article_id)
+        if delta < 0:
+            # 计数不会减到负数
+            counters.filter(count__gte=-delta).update(count=models.F('count') + delta)
+            return
+        if counters.update(count=models.F('count') + delta):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(article_id=article_id, count=delta)
+        except IntegrityError:
+            # 并发的第一次点赞已经建好了计数行
+            counters.update(count=models.F('count') + delta)
+
+    @classmethod
+    def get_count(cls, article_id: int) -> int:
+        return cls.objects.filter(article_id=article_id).values_list('count', flat=True).first() or 0
+
+
 class InteractionNotification(models.Model):
     """
     简单的通知模型，用于给作者发送点赞/收藏提醒。
@@ -6,8 +6,9 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable, List, Optional
+from typing import Iterable, List, Optional, Tuple
 
+from django.db import IntegrityError, transaction
 from django.db.models import Count, F, Q
 from django.utils import timezone
 
@@ -38,10 +39,12 @@ class LeaderboardService:
         return models.Like.objects.filter(article=article, created_time__gte=since).count()
 
     def top_articles(self, limit: int = 20, since: Optional[datetime] = None) -> List[LeaderboardEntry]:
-        like_qs = models.Like.objects.all()
         if since:
-            like_qs = like_qs.filter(created_time__gte=since)
-        queryset = like_qs.values('article').annotate(total=Count('id')).order_by('-total')[:limit]
+            like_qs = models.Like.objects.filter(created_time__gte=since)
+            queryset = like_qs.values('article').annotate(total=Count('id')).order_by('-total')[:limit]
+        else:
+            queryset = models.ArticleLikeCounter.objects.filter(count__gt=0).values(
+                'article', total=F('count')).order_by('-total')[:limit]
         entries: List[LeaderboardEntry] = []
         for row in queryset:
             article = self.article_qs.get(pk=row['article'])
@@ -56,6 +59,29 @@ class LeaderboardService:
         return entries
 
 
+def toggle_like(article: Article, actor: models.InteractionActor, **fields) -> Tuple[bool, int]:
+    """
+    Like the article, or unlike it when the actor already liked it.
+
+    The insert relies on the (article, actor) unique constraint instead of
+    checking first, a duplicate means the like exists and is removed. The like
+    counter is adjusted by the Like signals inside the same transaction.
+    Returns whether the article is now liked and its like count.
+    """
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                models.Like.objects.create(article=article, actor=actor, **fields)
+            liked = True
+        except IntegrityError:
+            # Locked so a concurrent unlike finds nothing and leaves the counter alone.
+            for like in models.Like.objects.select_for_update().filter(article=article, actor=actor):
+                like.delete()
+            liked = False
+        return liked, models.ArticleLikeCounter.get_count(article.pk)
+
+
 def move_anonymous_actor(old_key: str, user_actor: models.InteractionActor) -> int:
     """
     Merge likes/favorites from an anonymous actor into a logged-in actor.
@@ -3,7 +3,7 @@ from django.test import Client, TestCase
 from django.urls import reverse
 
 from blog.models import Article, Category, Tag
-from . import models
+from . import models, services
 
 
 class InteractionTests(TestCase):
@@ -88,6 +88,23 @@ class InteractionTests(TestCase):
         self.assertFalse(data['liked'])
         self.assertEqual(data['like_count'], 0)
 
+    def test_like_counter(self):
+        """The like counter follows every write path and is read without counting likes."""
+        actor1 = models.InteractionActor.for_anonymous('key1', 'fp1')
+        actor2 = models.InteractionActor.for_anonymous('key2', 'fp2')
+        like = models.Like.objects.create(article=self.article, actor=actor1)
+        self.assertEqual(services.toggle_like(self.article, actor2), (True, 2))
+        like.delete()
+        self.assertEqual(services.toggle_like(self.article, actor2), (False, 0))
+        self.assertEqual(services.toggle_like(self.article, actor2), (True, 1))
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('interaction:article_states'), {'ids': self.article.id}).json()
+        self.assertEqual(data['articles'][str(self.article.id)]['like_count'], 1)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
     def test_favorite_item_add_remove(self):
         """Test adding and removing favorite items."""
         self.client.login(username='tester', password='pass1234')
@@ -250,3 +267,62 @@ class InteractionTests(TestCase):
         self.assertNotEqual(actor1.id, actor3.id)
 
 # Create your tests here.
+
+    def test_article_state(self):
+        url = reverse('interaction:article_states')
+        response = self.client.get(url, {'ids': self.article.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrftoken', response.cookies)
+        data = response.json()
+        self.assertFalse(data['is_authenticated'])
+        self.assertFalse(data['articles'][str(self.article.id)]['liked'])
+        self.assertEqual(models.InteractionActor.objects.count(), 0)
+
+        self.client.post(reverse('interaction:toggle_like'), {'article_id': self.article.id})
+        data = self.client.get(url, {'ids': self.article.id}).json()
+        self.assertTrue(data['articles'][str(self.article.id)]['liked'])
+        self.assertEqual(data['articles'][str(self.article.id)]['like_count'], 1)
+
+        self.client.login(username='tester', password='pass1234')
+        data = self.client.get(url, {'ids': self.article.id}).json()
+        self.assertTrue(data['is_authenticated'])
+        self.assertEqual(data['username'], 'tester')
+        self.assertFalse(data['articles'][str(self.article.id)]['liked'])
+
+    def test_article_states(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test import override_settings
+        from django.test.utils import CaptureQueriesContext
+        other = Article.objects.create(
+            title='Other', body='content', category=self.article.category, author=self.user)
+        actor = models.InteractionActor.for_user(self.user)
+        models.Like.objects.create(article=self.article, actor=actor)
+        models.Like.objects.create(article=other, actor=models.InteractionActor.for_anonymous('key1', 'fp1'))
+        folder = models.FavoriteFolder.objects.create(owner=actor, name='States')
+        models.FavoriteItem.objects.create(folder=folder, article=other, added_by=actor)
+        self.client.login(username='tester', password='pass1234')
+        url = reverse('interaction:article_states')
+        ids = '%d,%d,%d' % (self.article.id, other.id, other.id)
+
+        def state_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'ids': ids})
+            tables = ('interaction_articlelikecounter', 'interaction_like"', 'interaction_favoriteitem')
+            return response, [t for q in queries.captured_queries for t in tables if 'FROM "%s' % t in q['sql']]
+
+        cache.clear()
+        # 计数、点赞、收藏各一条 IN 查询，与文章数无关
+        response, tables = state_queries()
+        self.assertEqual(len(tables), 3)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(response.json()['articles'], {
+            str(self.article.id): {'like_count': 1, 'liked': True, 'saved': False},
+            str(other.id): {'like_count': 1, 'liked': False, 'saved': True},
+        })
+        # 同一访客几秒内的重复请求直接读缓存
+        self.assertEqual(state_queries()[1], [])
+
+        with override_settings(INTERACTION_STATES_MAX_ARTICLES=1):
+            self.assertEqual(self.client.get(url, {'ids': ids}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'abc'}).status_code, 400)
@@ -6,6 +6,7 @@ app_name = 'interaction'
 
 urlpatterns = [
     path('like/', views.ToggleLikeView.as_view(), name='toggle_like'),
+    path('states/', views.ArticleStatesView.as_view(), name='article_states'),
     path('like-history/', views.UserLikeHistoryView.as_view(), name='like_history'),
     path('folders/', views.FavoriteFolderListView.as_view(), name='folder_list'),
     path('folders/<int:folder_id>/', views.FavoriteFolderDetailView.as_view(), name='folder_detail'),
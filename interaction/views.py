@@ -7,18 +7,21 @@ from __future__ import annotations
 import csv
 import io
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import IntegrityError
-from django.db.models import Count
+from django.db.models import F
+from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils import timezone
 from django.utils.encoding import force_str
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views import View
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 
 from blog.models import Article
 from . import forms, models, services
@@ -53,30 +56,112 @@ class ToggleLikeView(InteractionActorMixin, View):
 
     def post(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
         article = get_object_or_404(Article, pk=request.POST.get('article_id'))
-        existing = models.Like.objects.filter(article=article, actor=self.actor)
-        created = False
-        if existing.exists():
-            existing.delete()
-            liked = False
-        else:
-            models.Like.objects.create(
-                article=article,
-                actor=self.actor,
-                anonymous_key=self.actor.anonymous_key or '',
-                user_agent=request.META.get('HTTP_USER_AGENT', '')[:255],
-                ip_address=request.META.get('REMOTE_ADDR'),
-                created_time=timezone.now())
+        liked, like_count = services.toggle_like(
+            article,
+            self.actor,
+            anonymous_key=self.actor.anonymous_key or '',
+            user_agent=request.META.get('HTTP_USER_AGENT', '')[:255],
+            ip_address=request.META.get('REMOTE_ADDR'),
+            created_time=timezone.now())
+        if liked:
             models.InteractionNotification.notify_like(article, self.actor)
-            liked = True
-            created = True
-        like_count = models.Like.objects.filter(article=article).count()
         return JsonResponse({
             'liked': liked,
-            'created': created,
+            'created': liked,
             'like_count': like_count,
         })
 
 
+def find_existing_actor(request: HttpRequest):
+    """
+    Look up the actor of the request without creating one (read-only paths).
+    """
+
+    if request.user.is_authenticated:
+        return models.InteractionActor.objects.filter(user=request.user).first()
+    session_key = request.session.session_key
+    if not session_key:
+        return None
+    return models.InteractionActor.objects.filter(anonymous_key=session_key).first()
+
+
+def parse_article_ids(request: HttpRequest, limit: int):
+    """
+    Read article ids from ``?ids=1,2,3`` (or repeated ``article_id``), de-duplicated.
+    """
+
+    raw = request.GET.getlist('article_id')
+    for value in request.GET.getlist('ids'):
+        raw.extend(value.split(','))
+    ids = []
+    for value in raw:
+        value = value.strip()
+        if not value:
+            continue
+        if not value.isdigit():
+            raise ValueError(value)
+        if int(value) not in ids:
+            ids.append(int(value))
+    if len(ids) > limit:
+        raise ValueError(len(ids))
+    return ids
+
+
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class ArticleStatesView(View):
+    """
+    Like counts and liked/saved flags of many articles in one request.
+
+    Listing pages ask for all their cards at once. Counts come from the like
+    counters and each flag from a single ``IN`` query, regardless of the
+    number of articles. Responses are cached per actor for a few seconds.
+    """
+
+    http_method_names = ['get']
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        limit = settings.INTERACTION_STATES_MAX_ARTICLES
+        try:
+            ids = parse_article_ids(request, limit)
+        except ValueError:
+            return JsonResponse({'error': f'expected at most {limit} numeric article ids'}, status=400)
+        actor = find_existing_actor(request)
+        timeout = settings.INTERACTION_STATES_CACHE_TIMEOUT
+        cache_key = 'interaction_states:{actor}:{ids}'.format(
+            actor=actor.pk if actor is not None else '', ids=','.join(str(i) for i in sorted(ids)))
+        states = cache.get(cache_key) if timeout else None
+        if states is None:
+            states = self.load_states(ids, actor)
+            if timeout:
+                cache.set(cache_key, states, timeout)
+        response = JsonResponse({
+            'is_authenticated': request.user.is_authenticated,
+            'username': request.user.get_username() if request.user.is_authenticated else '',
+            'articles': states,
+        })
+        patch_cache_control(response, private=True, max_age=timeout)
+        return response
+
+    @staticmethod
+    def load_states(ids, actor):
+        counts = dict(models.ArticleLikeCounter.objects.filter(
+            article_id__in=ids).values_list('article_id', 'count'))
+        liked = saved = set()
+        if actor is not None and ids:
+            liked = set(models.Like.objects.filter(
+                actor=actor, article_id__in=ids).values_list('article_id', flat=True))
+            saved = set(models.FavoriteItem.objects.filter(
+                folder__owner=actor, article_id__in=ids).values_list('article_id', flat=True))
+        return {
+            str(article_id): {
+                'like_count': counts.get(article_id, 0),
+                'liked': article_id in liked,
+                'saved': article_id in saved,
+            }
+            for article_id in ids
+        }
+
+
 class LikeLeaderboardView(View):
     """
     点赞排行榜页面，显示最受欢迎文章TOP20
@@ -86,9 +171,9 @@ class LikeLeaderboardView(View):
         # 获取点赞数最多的20篇文章
         top_articles = Article.objects.filter(
             status='p',
-            likes__isnull=False
+            like_counter__count__gt=0
         ).annotate(
-            like_count=Count('likes')
+            like_count=F('like_counter__count')
         ).order_by('-like_count', '-pub_time')[:20]
         
         # 获取当前用户的点赞状态
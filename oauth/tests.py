@@ -6,7 +6,7 @@ from django.contrib import auth
 from django.test import Client, RequestFactory, TestCase
 from django.urls import reverse
 
-from djangoblog.utils import get_sha256
+from djangoblog.utils import cache, get_sha256
 from oauth.models import OAuthConfig
 from oauth.oauthmanager import BaseOauthManager
 
@@ -37,6 +37,8 @@ class OauthLoginTest(TestCase):
     def setUp(self) -> None:
         self.client = Client()
         self.factory = RequestFactory()
+        # 已启用的oauth应用列表有缓存，其他用例可能留下了空列表
+        cache.clear()
         self.apps = self.init_apps()
 
     def init_apps(self):
@@ -35,8 +35,9 @@ class ArticleRecommendationPlugin(BasePlugin):
     
     def on_article_detail_load(self, article, context, request, *args, **kwargs):
         """文章详情页加载时的处理"""
-        # 可以在这里预加载推荐数据到context中
-        recommendations = self.get_recommendations(article)
+        # 预加载推荐数据到context中，文章底部渲染时直接复用
+        recommendations = self.get_recommendations(
+            article, count=self.CONFIG['article_bottom_count'])
         context['article_recommendations'] = recommendations
     
     def should_display(self, position, context, **kwargs):
@@ -58,7 +59,12 @@ class ArticleRecommendationPlugin(BasePlugin):
         
         # 使用配置的数量，也可以通过kwargs覆盖
         count = kwargs.get('count', self.CONFIG['article_bottom_count'])
-        recommendations = self.get_recommendations(article, count=count)
+        recommendations = None
+        if count == self.CONFIG['article_bottom_count'] and hasattr(context, 'get'):
+            # 详情页加载钩子已计算过推荐，避免重复查询
+            recommendations = context.get('article_recommendations')
+        if recommendations is None:
+            recommendations = self.get_recommendations(article, count=count)
         if not recommendations:
             return None
         
@@ -131,10 +137,10 @@ class ArticleRecommendationPlugin(BasePlugin):
         
         recommendations = []
         
-        # 1. 基于标签的推荐
-        if article.tags.exists():
-            tag_ids = list(article.tags.values_list('id', flat=True))
-            tag_based = list(Article.objects.filter(
+        # 1. 基于标签的推荐（使用已预取的标签，不再单独查询）
+        tag_ids = [tag.id for tag in article.tags.all()]
+        if tag_ids:
+            tag_based = list(Article.objects.select_related('category').filter(
                 status='p',
                 tags__id__in=tag_ids
             ).exclude(
@@ -151,7 +157,7 @@ class ArticleRecommendationPlugin(BasePlugin):
             needed = count - len(recommendations)
             existing_ids = [r.id for r in recommendations] + [article.id]
             
-            category_based = list(Article.objects.filter(
+            category_based = list(Article.objects.select_related('category').filter(
                 status='p',
                 category=article.category
             ).exclude(
@@ -168,7 +174,7 @@ class ArticleRecommendationPlugin(BasePlugin):
             needed = count - len(recommendations)
             existing_ids = [r.id for r in recommendations] + [article.id]
             
-            popular_articles = list(Article.objects.filter(
+            popular_articles = list(Article.objects.select_related('category').filter(
                 status='p'
             ).exclude(
                 id__in=existing_ids
@@ -1,5 +1,11 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
 from djangoblog.plugin_manage.base_plugin import BasePlugin
 from djangoblog.plugin_manage import hooks
+from djangoblog.plugin_manage.hook_constants import PAGE_CACHE_HIT
 
 
 class ViewCountPlugin(BasePlugin):
@@ -10,9 +16,84 @@ class ViewCountPlugin(BasePlugin):
 
     def register_hooks(self):
         hooks.register('after_article_body_get', self.record_view)
+        hooks.register(PAGE_CACHE_HIT, self.buffer_view)
 
-    def record_view(self, article, *args, **kwargs):
-        article.viewed()
+    @staticmethod
+    def _buffer_key(article_id):
+        return 'article_views_buffer_{id}'.format(id=article_id)
+
+    @staticmethod
+    def _since_key(article_id):
+        return 'article_views_buffer_since_{id}'.format(id=article_id)
+
+    @staticmethod
+    def _counters():
+        # 单独的缓存，内容修改时清空默认缓存不会丢掉未写入的浏览次数
+        return caches['counters']
 
+    def buffer_view(self, request, *args, **kwargs):
+        """
+        命中整页缓存时不访问数据库，先把浏览次数记在缓存里。
+        缓冲达到 VIEW_COUNT_FLUSH_THRESHOLD 次或开始缓冲超过 VIEW_COUNT_FLUSH_INTERVAL 秒时写入数据库，
+        页面一直命中缓存时浏览次数也不会长期不更新
+        """
+        match = request.resolver_match
+        if match is None or match.view_name != 'blog:detailbyid':
+            return
+        article_id = match.kwargs['article_id']
+        counters = self._counters()
+        key = self._buffer_key(article_id)
+        try:
+            count = counters.incr(key)
+        except ValueError:
+            if counters.add(key, 1):
+                count = 1
+            else:
+                count = counters.incr(key)
+        now = time.time()
+        since_key = self._since_key(article_id)
+        since = counters.get(since_key)
+        if since is None:
+            counters.add(since_key, now, None)
+            since = now
+        if count >= settings.VIEW_COUNT_FLUSH_THRESHOLD or now - since >= settings.VIEW_COUNT_FLUSH_INTERVAL:
+            self.flush_buffered(article_id)
+
+    def flush_buffered(self, article_id):
+        """把缓冲的浏览次数写入数据库"""
+        from blog.models import Article
+        self._counters().delete(self._since_key(article_id))
+        count = self.take_buffered(article_id)
+        if not count:
+            return
+        try:
+            article = Article.cached.get(pk=article_id)
+        except Article.DoesNotExist:
+            return
+        article.viewed(count)
+
+    def take_buffered(self, article_id):
+        """
+        原子地取走缓冲的浏览次数。并发取走时减成负数的部分加回去，
+        每次浏览只被计入一次，取走期间新增的浏览留在缓冲中
+        """
+        counters = self._counters()
+        key = self._buffer_key(article_id)
+        pending = counters.get(key)
+        if not pending:
+            return 0
+        try:
+            remaining = counters.decr(key, pending)
+        except ValueError:
+            return 0
+        if remaining >= 0:
+            return pending
+        taken = max(pending + remaining, 0)
+        counters.incr(key, pending - taken)
+        return taken
+
+    def record_view(self, article, *args, **kwargs):
+        self._counters().delete(self._since_key(article.id))
+        article.viewed(1 + self.take_buffered(article.id))
 
-plugin = ViewCountPlugin() 
\ No newline at end of file
+plugin = ViewCountPlugin()
@@ -10,8 +10,8 @@ class BlogApi:
         self.__max_takecount__ = 8
 
     def search_articles(self, query):
+        # 搜索后端已批量填充结果对象，无需 load_all
         sqs = self.searchqueryset.auto_query(query)
-        sqs = sqs.load_all()
         return sqs[:self.__max_takecount__]
 
     def get_category_lists(self):